@@ -0,0 +1,222 @@
+#    Copyright (C) 2011 Jeremy S. Sanders
+#    Email: Jeremy Sanders <jeremy@jeremysanders.net>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""Export a set of documents from the command line.
+
+Documents can be exported by a set of worker processes, which are
+other copies of veusz run with the --export-worker option. Each
+worker reads jobs from stdin, one per line, and writes the result of
+each job to stdout. The workers are kept running until all the jobs
+are done, so Qt and plugins are only loaded once in each.
+"""
+
+import sys
+import os.path
+import time
+import threading
+import subprocess
+import Queue
+
+def exportPageFilename(filename, page):
+    """Return output filename for page when exporting all pages.
+
+    The page number is added before the extension, e.g. plot_1.png
+    """
+    root, ext = os.path.splitext(filename)
+    return '%s_%i%s' % (root, page+1, ext)
+
+def exportDocument(vsz, expfn, allpages=False):
+    """Load document vsz and export it to expfn.
+
+    If allpages is set, export every page of the document
+    Returns number of pages exported."""
+
+    import veusz.document as document
+    doc = document.Document()
+    ci = document.CommandInterpreter(doc)
+    ci.Load(vsz)
+
+    if not allpages:
+        ci.interface.Export(expfn)
+        return 1
+
+    npages = doc.getNumberPages()
+    for page in xrange(npages):
+        ci.interface.Export(exportPageFilename(expfn, page), page=page)
+    return npages
+
+def runJob(vsz, expfn, allpages):
+    """Export a document, catching any errors.
+
+    Returns (success, time taken, message)."""
+
+    start = time.time()
+    try:
+        npages = exportDocument(vsz, expfn, allpages)
+    except Exception, e:
+        return (False, time.time()-start,
+                u'%s: %s' % (e.__class__.__name__, unicode(e)))
+    return (True, time.time()-start, u'%i page(s)' % npages)
+
+def _encodeFields(fields):
+    """Encode list of fields into a line to send between processes."""
+    return '\t'.join([unicode(f).encode('unicode_escape')
+                      for f in fields]) + '\n'
+
+def _decodeFields(line):
+    """Decode a line encoded by _encodeFields."""
+    return [f.decode('unicode_escape')
+            for f in line.rstrip('\r\n').split('\t')]
+
+def runWorker():
+    """Run export jobs read from stdin, writing results to stdout.
+
+    This is used by veusz with the --export-worker option."""
+
+    # stop any output from documents getting mixed with the results
+    results = sys.stdout
+    sys.stdout = sys.stderr
+
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        vsz, expfn, allpages = _decodeFields(line)
+        ok, secs, msg = runJob(vsz, expfn, allpages == u'1')
+        results.write( _encodeFields([ok and u'ok' or u'error',
+                                      repr(secs), msg]) )
+        results.flush()
+
+def workerCommand(unsafemode=False, plugins=[]):
+    """Return command line to start an export worker process."""
+
+    if getattr(sys, 'frozen', False):
+        # running from a standalone executable
+        cmd = [sys.executable]
+    else:
+        thisdir = os.path.dirname(os.path.abspath(__file__))
+        cmd = [sys.executable, os.path.join(thisdir, 'veusz_main.py')]
+
+    cmd.append('--export-worker')
+    if unsafemode:
+        cmd.append('--unsafe-mode')
+    for plugin in plugins:
+        cmd += ['--plugin', plugin]
+
+    # command line arguments have to be in the filesystem encoding
+    enc = sys.getfilesystemencoding() or 'utf-8'
+    return [unicode(a).encode(enc) for a in cmd]
+
+class _WorkerThread(threading.Thread):
+    """Thread to pass jobs from a queue to a worker process."""
+
+    def __init__(self, cmd, jobs, results):
+        threading.Thread.__init__(self)
+        self.jobs = jobs
+        self.results = results
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE)
+
+    def run(self):
+        while True:
+            try:
+                index, job = self.jobs.get_nowait()
+            except Queue.Empty:
+                break
+
+            vsz, expfn, allpages = job
+            try:
+                self.proc.stdin.write( _encodeFields(
+                        [vsz, expfn, allpages and u'1' or u'0']) )
+                self.proc.stdin.flush()
+                line = self.proc.stdout.readline()
+            except IOError:
+                line = ''
+
+            if not line:
+                # leave remaining jobs to the other workers
+                self.results[index] = (False, 0., u'Export process exited')
+                break
+
+            status, secs, msg = _decodeFields(line)
+            self.results[index] = (status == u'ok', float(secs), msg)
+
+        try:
+            self.proc.stdin.close()
+        except IOError:
+            pass
+        self.proc.wait()
+
+def writeReport(jobs, results, totaltime, stream):
+    """Write a report of the time taken and errors of each job."""
+
+    failed = 0
+    for index, (vsz, expfn, allpages) in enumerate(jobs):
+        ok, secs, msg = results[index]
+        if not ok:
+            failed += 1
+        line = u'%-5s %8.2fs  %s -> %s  (%s)\n' % (
+            ok and u'ok' or u'ERROR', secs, vsz, expfn, msg)
+        enc = getattr(stream, 'encoding', None) or 'utf-8'
+        stream.write( line.encode(enc, 'replace') )
+
+    stream.write('%i document(s) exported, %i failed, in %.2fs\n' % (
+            len(jobs)-failed, failed, totaltime))
+
+def batchExport(exports, vszfiles, numprocesses=1, allpages=False,
+                unsafemode=False, plugins=[], report=True):
+    """Export the documents vszfiles to the filenames in exports.
+
+    numprocesses: number of worker processes to use. If 1, the
+     documents are exported in this process.
+    allpages: export every page of each document
+    unsafemode, plugins: options passed to worker processes
+    report: write a report to stderr
+
+    Returns number of documents which failed to export."""
+
+    start = time.time()
+    jobs = [ (vsz, expfn, allpages)
+             for expfn, vsz in zip(exports, vszfiles) ]
+    results = {}
+
+    numprocesses = min(numprocesses, len(jobs))
+    if numprocesses <= 1:
+        for index, job in enumerate(jobs):
+            results[index] = runJob(*job)
+    else:
+        queue = Queue.Queue()
+        for job in enumerate(jobs):
+            queue.put(job)
+
+        cmd = workerCommand(unsafemode=unsafemode, plugins=plugins)
+        threads = [ _WorkerThread(cmd, queue, results)
+                    for i in xrange(numprocesses) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # jobs left if all the workers exited
+    for index in xrange(len(jobs)):
+        if index not in results:
+            results[index] = (False, 0., u'Not exported')
+
+    if report:
+        writeReport(jobs, results, time.time()-start, sys.stderr)
+    return len([r for r in results.itervalues() if not r[0]])
@@ -44,6 +44,7 @@ class CaptureDialog(VeuszDialog):
         self.timeStopEdit.setValidator(validator)
         self.updateIntervalsEdit.setValidator(validator)
         self.tailEdit.setValidator(validator)
+        self.tailTimeEdit.setValidator(validator)
 
         # add completion for filename if there is support in version of qt
         # (requires qt >= 4.3)
@@ -80,6 +81,8 @@ class CaptureDialog(VeuszDialog):
         # tail data
         self.connect(self.tailCheck, qt4.SIGNAL('toggled(bool)'),
                      self.tailEdit.setEnabled)
+        self.connect(self.tailTimeCheck, qt4.SIGNAL('toggled(bool)'),
+                     self.tailTimeEdit.setEnabled)
 
         # user starts capture
         self.captureButton = self.buttonBox.addButton(
@@ -144,6 +147,7 @@ class CaptureDialog(VeuszDialog):
         timeout = None
         updateinterval = None
         tail = None
+        tailtime = None
         try:
             stop = self.stopBG.checkedId()
             if stop == 1:
@@ -161,6 +165,10 @@ class CaptureDialog(VeuszDialog):
             if self.tailCheck.isChecked():
                 tail = int( self.tailEdit.text() )
 
+            # whether to only retain values from the last N seconds
+            if self.tailTimeCheck.isChecked():
+                tailtime = int( self.tailTimeEdit.text() )
+
         except ValueError:
             qt4.QMessageBox.critical(self, "Invalid number", "Invalid number")
             return
@@ -192,6 +200,9 @@ class CaptureDialog(VeuszDialog):
         stream.maxlines = maxlines
         stream.timeout = timeout
         simpleread.tail = tail
+        # read into buffers which only keep the values wanted
+        simpleread.datasets = document.CaptureDatasets(maxlength=tail,
+                                                       maxtime=tailtime)
         cd = CapturingDialog(self.document, simpleread, stream, self,
                              updateinterval=updateinterval)
         self.mainwindow.showDialog(cd)
@@ -224,7 +235,10 @@ class CapturingDialog(VeuszDialog):
         self.connect( self.cancelButton, qt4.SIGNAL('clicked()'),
                       self.slotCancel )
 
-        # timer which governs reading from source
+        # data are read in a separate thread
+        self.reader = document.CaptureReaderThread(simpleread, stream)
+
+        # timer which checks whether reading has finished
         self.readtimer = qt4.QTimer(self)
         self.connect( self.readtimer, qt4.SIGNAL('timeout()'),
                       self.slotReadTimer )
@@ -248,22 +262,28 @@ class CapturingDialog(VeuszDialog):
         # timer to update document
         self.updatetimer = qt4.QTimer(self)
         self.updateoperation = None
+        self.updatechangeset = None
         if updateinterval:
             self.connect( self.updatetimer, qt4.SIGNAL('timeout()'),
                           self.slotUpdateTimer )
             self.updatetimer.start(updateinterval*1000)
 
         # start display and read timers
+        self.reader.start()
         self.displaytimer.start(1000)
-        self.readtimer.start(10)
+        self.readtimer.start(100)
+
+    def done(self, r):
+        """Dialog is closed, so stop reading."""
+        if self.stream:
+            self.streamCaptureFinished('')
+        VeuszDialog.done(self, r)
 
     def slotReadTimer(self):
-        """Time to read more data."""
-        try:
-            self.simpleread.readData(self.stream)
-        except document.CaptureFinishException, e:
+        """Check whether the stream has finished."""
+        if self.reader.finished is not None:
             # stream tells us it's time to finish
-            self.streamCaptureFinished( unicode(e) )
+            self.streamCaptureFinished(self.reader.finished)
 
     def slotDisplayTimer(self):
         """Time to update information about data source."""
@@ -272,7 +292,11 @@ class CapturingDialog(VeuszDialog):
                                    self.starttime.elapsed() // 1000) )
 
         tree = self.datasetTreeWidget
-        cts = self.simpleread.getDatasetCounts()
+        self.reader.acquire()
+        try:
+            cts = self.simpleread.getDatasetCounts()
+        finally:
+            self.reader.release()
 
         # iterate over each dataset
         for name, length in cts.iteritems():
@@ -287,16 +311,25 @@ class CapturingDialog(VeuszDialog):
     def slotUpdateTimer(self):
         """Called to update document while data is being captured."""
 
-        # undo any previous update
-        if self.updateoperation:
-            self.updateoperation.undo(self.document)
-
-        # create new one
-        self.updateoperation = document.OperationDataCaptureSet(
-            self.simpleread)
-
-        # apply it (bypass history here - urgh)
-        self.updateoperation.do(self.document)
+        self.reader.acquire()
+        try:
+            # leave the datasets alone if nothing has been read
+            if self.reader.changeset == self.updatechangeset:
+                return
+            self.updatechangeset = self.reader.changeset
+
+            # undo any previous update
+            if self.updateoperation:
+                self.updateoperation.undo(self.document)
+
+            # create new one
+            self.updateoperation = document.OperationDataCaptureSet(
+                self.simpleread)
+
+            # apply it (bypass history here - urgh)
+            self.updateoperation.do(self.document)
+        finally:
+            self.reader.release()
         self.document.setModified()
 
     def streamCaptureFinished(self, message):
@@ -308,6 +341,7 @@ class CapturingDialog(VeuszDialog):
         self.displaytimer.stop()
         self.updatetimer.stop()
         if self.stream:
+            self.reader.stop()
             # update stats
             self.slotDisplayTimer()
             # close stream
@@ -42,6 +42,7 @@ class PreferencesDialog(VeuszDialog):
             setdb['plot_updatepolicy'])
         self.intervalCombo.setCurrentIndex(index)
         self.threadSpinBox.setValue( setdb['plot_numthreads'] )
+        self.historyMemorySpinBox.setValue( setdb['history_maxmemory'] )
 
         # disable thread option if not supported
         if not qt4.QFontDatabase.supportsThreadedFontRendering():
@@ -52,6 +53,10 @@ class PreferencesDialog(VeuszDialog):
         # use cwd for file dialogs
         self.cwdCheck.setChecked( setdb['dirname_usecwd'] )
 
+        # binary data in saved documents
+        self.binaryDataCheck.setChecked( setdb['file_binarydata'] )
+        self.compressBinaryCheck.setChecked( setdb['file_compressbinary'] )
+
         # set icon size
         self.iconSizeCombo.setCurrentIndex(
             self.iconSizeCombo.findText(
@@ -195,10 +200,15 @@ class PreferencesDialog(VeuszDialog):
         setdb['plot_antialias'] = self.antialiasCheck.isChecked()
         setdb['ui_english'] = self.englishCheck.isChecked()
         setdb['plot_numthreads'] = self.threadSpinBox.value()
+        setdb['history_maxmemory'] = self.historyMemorySpinBox.value()
 
         # use cwd
         setdb['dirname_usecwd'] = self.cwdCheck.isChecked()
 
+        # binary data in saved documents
+        setdb['file_binarydata'] = self.binaryDataCheck.isChecked()
+        setdb['file_compressbinary'] = self.compressBinaryCheck.isChecked()
+
         # update icon size if necessary
         iconsize = int( self.iconSizeCombo.currentText() )
         if iconsize != setdb['toolbar_size']:
@@ -0,0 +1,172 @@
+#    Copyright (C) 2011 Jeremy S. Sanders
+#    Email: Jeremy Sanders <jeremy@jeremysanders.net>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+###############################################################################
+
+"""Saving and loading dataset values in a binary file.
+
+The binary file is a numpy .npz file holding an array for each column
+of the saved datasets, named after the key of the dataset and the
+column (e.g. ds1_data, ds1_serr). Uncompressed arrays are memory
+mapped when loaded.
+
+Arrays are read here rather than by numpy.load, as older versions of
+numpy unpickle arrays of objects, which could run code from a file
+given with a document.
+"""
+
+import os
+import struct
+import cStringIO
+import zipfile
+import tempfile
+
+import numpy as N
+import numpy.lib.format
+
+# header of a file in a zip file, up to the file name
+_zipheader = struct.Struct('<4s5H3L2H')
+
+def binaryBlockFilename(docfilename):
+    """Return name of binary file used for document filename."""
+    return docfilename + '.npz'
+
+def _replaceFile(tempname, filename):
+    """Rename tempname to filename, replacing any existing file."""
+    if os.name == 'nt' and os.path.exists(filename):
+        # windows cannot rename over an existing file
+        os.remove(filename)
+    os.rename(tempname, filename)
+
+def saveBinaryBlock(filename, arrays, compress=False):
+    """Save dict of arrays to filename, optionally compressing them.
+
+    The arrays may be memory mapped from an existing filename (if the
+    document was loaded from it), so they are written to a temporary
+    file which then replaces filename. Writing over the mapped file
+    would truncate it under the arrays.
+    """
+
+    filename = os.path.abspath(filename)
+    fd, tempname = tempfile.mkstemp(suffix='.npz',
+                                    dir=os.path.dirname(filename))
+    try:
+        fileobj = os.fdopen(fd, 'wb')
+        try:
+            if compress:
+                N.savez_compressed(fileobj, **arrays)
+            else:
+                N.savez(fileobj, **arrays)
+        finally:
+            fileobj.close()
+
+        # mkstemp makes files only readable by the user
+        if os.path.exists(filename):
+            mode = os.stat(filename).st_mode & 0777
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0666 & ~umask
+        os.chmod(tempname, mode)
+
+        _replaceFile(tempname, filename)
+    except:
+        if os.path.exists(tempname):
+            os.remove(tempname)
+        raise
+
+def _readArrayHeader(fileobj):
+    """Read npy header from fileobj, returning shape, fortran, dtype.
+
+    Raises RuntimeError for arrays which cannot be read safely."""
+
+    version = numpy.lib.format.read_magic(fileobj)
+    if version == (1, 0):
+        header = numpy.lib.format.read_array_header_1_0(fileobj)
+    elif ( version == (2, 0) and
+           hasattr(numpy.lib.format, 'read_array_header_2_0') ):
+        header = numpy.lib.format.read_array_header_2_0(fileobj)
+    else:
+        raise RuntimeError, 'Unsupported array format version %i.%i' % version
+
+    if header[2].hasobject:
+        # these would have to be unpickled
+        raise RuntimeError, 'Arrays of objects are not allowed'
+    return header
+
+def _readArray(zipf, info):
+    """Read an array from a (possibly compressed) file in a zip file."""
+
+    fileobj = cStringIO.StringIO( zipf.read(info.filename) )
+    shape, fortran, dtype = _readArrayHeader(fileobj)
+
+    count = int(N.product(shape))
+    if count == 0:
+        return N.zeros(shape, dtype=dtype)
+    array = N.fromstring(fileobj.read(count*dtype.itemsize), dtype=dtype)
+    if len(array) != count:
+        raise RuntimeError, 'Array in binary file is truncated'
+    if fortran:
+        return array.reshape(shape[::-1]).transpose()
+    return array.reshape(shape)
+
+def _mapStoredArray(filename, fileobj, info):
+    """Memory map an uncompressed array in a zip file.
+
+    Returns None if the array cannot be mapped."""
+
+    # skip over zip header for file
+    fileobj.seek(info.header_offset)
+    header = _zipheader.unpack( fileobj.read(_zipheader.size) )
+    if header[0] != 'PK\x03\x04':
+        return None
+    fileobj.seek(header[-2] + header[-1], 1)
+
+    shape, fortran, dtype = _readArrayHeader(fileobj)
+
+    if N.product(shape) == 0:
+        # zero length files cannot be mapped
+        return N.zeros(shape, dtype=dtype)
+
+    # mapped copy-on-write, so that changes are not written to the file
+    return N.memmap(filename, dtype=dtype, mode='c', offset=fileobj.tell(),
+                    shape=shape, order=fortran and 'F' or 'C')
+
+def loadBinaryBlock(filename):
+    """Load arrays saved by saveBinaryBlock.
+
+    Returns a dict of arrays."""
+
+    out = {}
+    zipf = zipfile.ZipFile(filename)
+    fileobj = open(filename, 'rb')
+    try:
+        for info in zipf.infolist():
+            name = info.filename
+            if name[-4:] == '.npy':
+                name = name[:-4]
+
+            array = None
+            if info.compress_type == zipfile.ZIP_STORED:
+                array = _mapStoredArray(filename, fileobj, info)
+            if array is None:
+                # compressed, so read into memory
+                array = _readArray(zipf, info)
+            out[name] = array
+    finally:
+        fileobj.close()
+        zipf.close()
+    return out
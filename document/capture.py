@@ -22,6 +22,11 @@ import os
 import socket
 import platform
 import signal
+import threading
+import time
+from collections import deque
+
+import numpy as N
 
 import veusz.qtall as qt4
 import veusz.utils as utils
@@ -33,11 +38,17 @@ class CaptureFinishException(Exception):
 class CaptureStream(simpleread.Stream):
     """A special stream for capturing data."""
 
+    # maximum number of lines returned before StopIteration is raised
+    maxcontinuousreads = 1000
+
     def __init__(self):
         """Initialise the stream."""
 
         simpleread.Stream.__init__(self)
+        # incomplete last line read
         self.buffer = ''
+        # complete lines waiting to be returned
+        self.lines = deque()
         self.continuousreads = 0
         self.bytesread = 0
         self.linesread = 0
@@ -64,8 +75,8 @@ class CaptureStream(simpleread.Stream):
         """Return a new line of data.
 
         Either returns new line or
-        Raises StopIteration if there is no data, or more than 100 lines
-        have been read."""
+        Raises StopIteration if there is no data, or more than
+        maxcontinuousreads lines have been read."""
 
         while True:
             # we've reached the limit of lines or a timeout has occurred
@@ -75,18 +86,15 @@ class CaptureStream(simpleread.Stream):
                 raise CaptureFinishException("Maximum time period occurred")
 
             # stop reading continous data greater than this many lines
-            if self.continuousreads == 100:
+            if self.continuousreads == self.maxcontinuousreads:
                 self.continuousreads = 0
                 raise StopIteration
 
-            index = self.buffer.find('\n')
-            if index >= 0:
+            if self.lines:
                 # is there a line in the buffer?
-                retn = self.buffer[:index]
-                self.buffer = self.buffer[index+1:]
                 self.linesread += 1
                 self.continuousreads += 1
-                return retn
+                return self.lines.popleft()
             else:
                 # if not, then read some more data
                 data = self.getMoreData()
@@ -95,7 +103,11 @@ class CaptureStream(simpleread.Stream):
                     self.continuousreads = 0
                     raise StopIteration
                 self.bytesread += len(data)
-                self.buffer += data
+
+                # split into lines, keeping any incomplete line
+                lines = (self.buffer + data).split('\n')
+                self.buffer = lines.pop()
+                self.lines.extend(lines)
 
     def close(self):
         """Close any allocated object."""
@@ -221,7 +233,7 @@ class SocketCaptureStream(CaptureStream):
         i, o, e = select.select([self.socket], [], [], 0)
         if i:
             try:
-                retn = self.socket.recv(1024)
+                retn = self.socket.recv(65536)
             except socket.error, e:
                 self._handleSocketError(e)
             if len(retn) == 0:
@@ -233,3 +245,260 @@ class SocketCaptureStream(CaptureStream):
     def close(self):
         """Close the socket."""
         self.socket.close()
+
+class CaptureBuffer(object):
+    """A growable array of values read while capturing.
+
+    Space is allocated in increasing amounts, so appending values is
+    fast on average. Values already added are never changed, so the
+    (read only) arrays returned by values() can be used in datasets
+    while reading continues. If values which have been returned are
+    removed from the end, the values are moved to a new array before
+    more are added.
+
+    If keeptimes is set, the time each value was added is kept, so
+    that old values can be removed.
+    """
+
+    # minimum number of values to allocate space for
+    minsize = 1024
+
+    def __init__(self, keeptimes=False):
+        self.array = None
+        self.times = None
+        self.keeptimes = keeptimes
+        self.start = self.end = 0
+        # values before this index may be used in returned arrays
+        self.shared = 0
+
+    def _allocate(self, size, dtype):
+        """Move values into new arrays with space for size values."""
+        length = self.end - self.start
+        array = N.empty(size, dtype=dtype)
+        if self.array is not None:
+            array[:length] = self.array[self.start:self.end]
+        self.array = array
+
+        if self.keeptimes:
+            times = N.empty(size, dtype=N.float64)
+            if self.times is not None:
+                times[:length] = self.times[self.start:self.end]
+            self.times = times
+
+        self.start, self.end = 0, length
+        self.shared = 0
+
+    def _reserve(self, num, val):
+        """Make sure there is space for num more values like val."""
+        if self.array is None:
+            if isinstance(val, (float, int, long, N.number)):
+                dtype = N.float64
+            else:
+                dtype = object
+            self._allocate(max(self.minsize, num), dtype)
+        elif self.end + num > len(self.array) or self.end < self.shared:
+            length = self.end - self.start
+            self._allocate(max(self.minsize, 2*(length+num)),
+                           self.array.dtype)
+
+    def _makeObject(self):
+        """Convert values to objects if a non-number is added."""
+        self._allocate(len(self.array), object)
+
+    def append(self, val):
+        """Add a value to the end."""
+        self._reserve(1, val)
+        try:
+            self.array[self.end] = val
+        except (ValueError, TypeError):
+            self._makeObject()
+            self.array[self.end] = val
+        if self.keeptimes:
+            self.times[self.end] = time.time()
+        self.end += 1
+
+    def extend(self, vals):
+        """Add a sequence of values to the end."""
+        num = len(vals)
+        if num == 0:
+            return
+        self._reserve(num, vals[0])
+        try:
+            self.array[self.end:self.end+num] = vals
+        except (ValueError, TypeError):
+            self._makeObject()
+            self.array[self.end:self.end+num] = vals
+        if self.keeptimes:
+            self.times[self.end:self.end+num] = time.time()
+        self.end += num
+
+    def values(self):
+        """Return the values as a read only numpy array."""
+        if self.array is None:
+            return N.array([], dtype=N.float64)
+        vals = self.array[self.start:self.end]
+        vals.flags.writeable = False
+        self.shared = max(self.shared, self.end)
+        return vals
+
+    def numBefore(self, mintime):
+        """Return number of values added before time mintime."""
+        if not self.keeptimes or self.end == self.start:
+            return 0
+        return N.searchsorted(self.times[self.start:self.end], mintime)
+
+    def removeStart(self, num):
+        """Remove num values from the start."""
+        self.start = min(self.end, self.start + num)
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __iter__(self):
+        return iter(self.values())
+
+    def __getitem__(self, key):
+        return self.values()[key]
+
+    def __delitem__(self, key):
+        """Delete values.
+
+        Values are removed from the end (e.g. del buf[10:]) without
+        copying, otherwise the rest are copied, as values are never
+        changed."""
+        if ( isinstance(key, slice) and key.stop is None and
+             key.step is None and key.start is not None and
+             key.start >= 0 ):
+            self.end = self.start + min(key.start, len(self))
+            return
+
+        keep = N.ones(len(self), dtype=bool)
+        keep[key] = False
+        self.array = self.values()[keep].copy()
+        if self.keeptimes:
+            self.times = self.times[self.start:self.end][keep].copy()
+        self.start, self.end = 0, len(self.array)
+
+    def __array__(self, dtype=None):
+        vals = self.values()
+        if dtype is None or vals.dtype == dtype:
+            return vals
+        return vals.astype(dtype)
+
+class CaptureDatasets(dict):
+    """A dict of CaptureBuffer objects for reading captured data into.
+
+    This replaces the datasets of a SimpleRead object. Only the last
+    maxlength values, or the values read in the last maxtime seconds,
+    are retained by calling retain().
+    """
+
+    def __init__(self, maxlength=None, maxtime=None):
+        dict.__init__(self)
+        self.maxlength = maxlength
+        self.maxtime = maxtime
+
+    def __missing__(self, key):
+        buf = self[key] = CaptureBuffer(keeptimes=self.maxtime is not None)
+        return buf
+
+    def retain(self):
+        """Remove values which are no longer wanted, returning whether
+        any were removed.
+
+        The buffers of the values and errors of a dataset line up from
+        their starts, but can differ in length if the last line had
+        missing values. The same number of values is removed from the
+        start of each, so the rows stay aligned."""
+
+        mintime = None
+        if self.maxtime is not None:
+            mintime = time.time() - self.maxtime
+
+        # keys are the dataset name and part, separated by \0
+        groups = {}
+        for key, buf in self.iteritems():
+            groups.setdefault(key.split('\0')[0], []).append(buf)
+
+        removed = False
+        for bufs in groups.itervalues():
+            num = 0
+            if self.maxlength is not None:
+                num = min([len(buf) for buf in bufs]) - self.maxlength
+            if mintime is not None:
+                num = max(num, min([buf.numBefore(mintime) for buf in bufs]))
+            if num > 0:
+                for buf in bufs:
+                    buf.removeStart(num)
+                removed = True
+        return removed
+
+class CaptureReaderThread(threading.Thread):
+    """Read data from a capture stream into a SimpleRead object in a
+    separate thread.
+
+    acquire() and release() should be called around using the data in
+    the SimpleRead object. changeset is increased when the data change.
+    finished is set to a message when the stream is finished.
+    """
+
+    # time to wait when there is no data
+    idletime = 0.01
+
+    def __init__(self, simpleread, stream):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.simpleread = simpleread
+        self.stream = stream
+        self.lock = threading.Lock()
+        # held by other threads waiting for lock, so that this thread
+        # cannot take lock again straight after releasing it
+        self.turnstile = threading.Lock()
+        self.changeset = 0
+        self.finished = None
+        self.stopped = False
+
+    def stop(self):
+        """Stop reading and wait for the thread to end."""
+        self.stopped = True
+        self.join()
+
+    def acquire(self):
+        """Stop data being read, to use the data."""
+        self.turnstile.acquire()
+        try:
+            self.lock.acquire()
+        finally:
+            self.turnstile.release()
+
+    def release(self):
+        """Allow data to be read again."""
+        self.lock.release()
+
+    def run(self):
+        while not self.stopped and self.finished is None:
+            bytesread = self.stream.bytesread
+
+            # wait for any other thread wanting the data
+            self.turnstile.acquire()
+            self.turnstile.release()
+
+            self.lock.acquire()
+            try:
+                try:
+                    self.simpleread.readData(self.stream)
+                except CaptureFinishException, e:
+                    self.finished = unicode(e)
+                except EnvironmentError, e:
+                    self.finished = "Error: %s" % e.strerror
+                changed = self.stream.bytesread != bytesread
+                if isinstance(self.simpleread.datasets, CaptureDatasets):
+                    if self.simpleread.datasets.retain():
+                        changed = True
+                if changed:
+                    self.changeset += 1
+            finally:
+                self.lock.release()
+
+            if self.stream.bytesread == bytesread:
+                time.sleep(self.idletime)
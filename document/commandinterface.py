@@ -53,6 +53,7 @@ class CommandInterface(qt4.QObject):
         'GetChildren',
         'GetData',
         'GetDatasets',
+        'ImportBinaryBlock',
         'ImportFITSFile',
         'ImportFile',
         'ImportFile2D',
@@ -182,7 +183,8 @@ class CommandInterface(qt4.QObject):
 
     def CreateHistogram(self, inexpr, outbinsds, outvalsds, binparams=None,
                         binmanual=None, method='counts',
-                        cumulative = 'none', errors=False):
+                        cumulative = 'none', errors=False,
+                        streamfile=None):
         """Histogram an input expression.
 
         inexpr is input expression
@@ -194,11 +196,16 @@ class CommandInterface(qt4.QObject):
         cumulative is to calculate cumulative distributions which is
           'none', 'smalltolarge' or 'largetosmall'
         errors is to calculate Poisson error bars
+        streamfile is the name of a file to read values from in chunks,
+          in place of inexpr, for data too large to hold in memory. It
+          is a text file of values separated by whitespace, or a numpy
+          .npy file. Values appended to the file are counted when the
+          document is next updated.
         """
         op = dataset_histo.OperationDatasetHistogram(
             inexpr, outbinsds, outvalsds, binparams=binparams,
             binmanual=binmanual, method=method,
-            cumulative=cumulative, errors=errors)
+            cumulative=cumulative, errors=errors, streamfile=streamfile)
         self.document.applyOperation(op)
 
         if self.verbose:
@@ -292,10 +299,16 @@ class CommandInterface(qt4.QObject):
         else:
             return None
 
-    def Save(self, filename):
-        """Save the state to a file."""
+    def Save(self, filename, binarydata=False, compress=False):
+        """Save the state to a file.
+
+        If binarydata is True, dataset values are saved in a binary
+        file named filename + '.npz', which is compressed if compress
+        is set.
+        """
         f = open(filename, 'w')
-        self.document.saveToFile(f)
+        self.document.saveToFile(f, binarydata=binarydata,
+                                 compress=compress)
 
     def Set(self, var, val):
         """Set the value of a setting."""
@@ -675,6 +688,23 @@ class CommandInterface(qt4.QObject):
 
         return dsnames
 
+    def ImportBinaryBlock(self, filename, datasetkeys):
+        """Import datasets from a binary file saved with the document.
+
+        datasetkeys is a dict of dataset names and the keys of their
+        arrays in the file. Uncompressed files are memory mapped.
+        """
+
+        realfilename = self.findFileOnImportPath(filename)
+        op = operations.OperationDataImportBinaryBlock(realfilename,
+                                                       datasetkeys)
+        dsnames = self.document.applyOperation(op)
+
+        if self.verbose:
+            print "Imported datasets %s" % (' '.join(dsnames),)
+
+        return dsnames
+
     def ImportFITSFile(self, dsname, filename, hdu,
                        datacol = None, symerrcol = None,
                        poserrcol = None, negerrcol = None,
@@ -16,15 +16,25 @@
 #    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 ###############################################################################
 
+import os.path
+
 import numpy as N
-from datasets import Dataset, simpleEvalExpression
+from datasets import Dataset, DatasetExpression
+
+def _isPrefix(old, new):
+    """Are the values in array old the same as the start of new?"""
+    if len(old) > len(new):
+        return False
+    start = new[:len(old)]
+    return bool( N.all( (start == old) | (N.isnan(start) & N.isnan(old)) ) )
 
 class DatasetHistoGenerator(object):
     def __init__(self, document, inexpr,
                  binmanual = None, binparams = None,
                  method = 'counts',
                  cumulative = 'none',
-                 errors=False):
+                 errors=False,
+                 streamfile=None, chunksize=16777216):
         """
         inexpr = ds expression
         binmanual = None / [1,2,3,4,5]
@@ -32,6 +42,9 @@ class DatasetHistoGenerator(object):
         method = ('counts', 'density', or 'fractions')
         cumulative = ('none', 'smalltolarge', 'largetosmall')
         errors = True/False
+        streamfile = None / name of file to read values from, in place
+                     of inexpr
+        chunksize = number of bytes of streamfile read at once
         """
 
         self.changeset = -1
@@ -43,15 +56,183 @@ class DatasetHistoGenerator(object):
         self.method = method
         self.cumulative = cumulative
         self.errors = errors
+        self.streamfile = streamfile
+        self.chunksize = chunksize
+
+        # the input expression is evaluated by an expression dataset,
+        # which knows whether the datasets it uses have changed
+        self.inputds = DatasetExpression(data=inexpr)
+        self.inputds.document = document
+        self.inputversion = None
+
+        # state of histogram: the version is changed whenever the bins
+        # or counts change
+        self.version = 0
+        self.cacheddata = None
+        self.streampos = 0
+        self.datarange = None
+        self.ndata = 0
+        self.binlocs = N.array([])
+        self.counts = N.array([], dtype=N.int64)
+
+    def update(self):
+        """Update bins and counts if the input has changed."""
+        if self.document.changeset == self.changeset:
+            return
+        self.changeset = self.document.changeset
+
+        if self.streamfile is None:
+            self._updateFromData()
+        else:
+            try:
+                self._updateFromStream()
+            except (EnvironmentError, ValueError), e:
+                self.document.log("Error reading '%s' for histogram: %s" %
+                                  (self.streamfile, unicode(e)))
+                self.inputversion = None
+                self._rebin(lambda: [])
+
+    def _updateFromData(self):
+        """Update histogram from input expression.
+
+        If values have been appended to the input, only the new values
+        are counted, unless the bins change."""
+
+        version = self.inputds.dataVersion()
+        if version == self.inputversion:
+            return
+        self.inputversion = version
+
+        data = self.inputds.data
+        old = self.cacheddata
+        self.cacheddata = data
+        if old is not None and _isPrefix(old, data):
+            if len(data) == len(old):
+                return
+            newdata = data[len(old):]
+            if self._append(lambda: [newdata]):
+                return
+        self._rebin(lambda: [data])
+
+    def _updateFromStream(self):
+        """Update histogram from the values in the stream file.
+
+        The file is read in chunks, so it can be larger than the
+        available memory. Files which grow are assumed to have been
+        appended to, so only the new values are counted."""
+
+        stat = os.stat(self.streamfile)
+        version = (stat.st_size, stat.st_mtime)
+        if version == self.inputversion:
+            return
+        appended = ( self.inputversion is not None and
+                     version[0] >= self.inputversion[0] )
+        self.inputversion = version
+
+        if appended:
+            start = self.streampos
+            if self._append(lambda: self._streamChunks(start)):
+                return
+        self._rebin(lambda: self._streamChunks(0))
+
+    def _streamChunks(self, start):
+        """Iterate over arrays of values read from the stream file,
+        starting at position start.
+
+        Numpy .npy files are memory mapped, with the position the
+        index of the value. Other files are text, with values
+        separated by whitespace, and the position the byte offset.
+        Text after the last newline is not read, as it may be
+        incomplete.
+
+        self.streampos is set to the position after the values read.
+        """
 
-    def getData(self):
-        """Get data from input expression, caching result."""
-        if self.document.changeset != self.changeset:
-            self._cacheddata = simpleEvalExpression(self.document, self.inexpr)
-            self.changeset = self.document.changeset
-        return self._cacheddata
-
-    def binLocations(self):
+        if os.path.splitext(self.streamfile)[1].lower() == '.npy':
+            values = N.load(self.streamfile, mmap_mode='r').reshape(-1)
+            chunk = max(self.chunksize // values.itemsize, 1)
+            for i in xrange(start, len(values), chunk):
+                yield N.array(values[i:i+chunk], dtype=N.float64)
+            self.streampos = max(start, len(values))
+            return
+
+        fileobj = open(self.streamfile, 'rb')
+        fileobj.seek(start)
+        pos = start
+        text = ''
+        while True:
+            block = fileobj.read(self.chunksize)
+            if not block:
+                break
+            text += block
+            end = text.rfind('\n') + 1
+            if end > 0:
+                values = N.array(text[:end].split(), dtype=N.float64)
+                pos += end
+                text = text[end:]
+                yield values
+        fileobj.close()
+        self.streampos = pos
+
+    def _needRange(self):
+        """Are bins calculated from the range of the data?"""
+        return ( not self.binmanual and
+                 (self.binparams[1] == 'Auto' or self.binparams[2] == 'Auto') )
+
+    def _updateRange(self, data):
+        """Include finite values in data in range of data."""
+        data = data[N.isfinite(data)]
+        if len(data) == 0:
+            return
+        minval, maxval = data.min(), data.max()
+        if self.datarange is not None:
+            minval = min(minval, self.datarange[0])
+            maxval = max(maxval, self.datarange[1])
+        self.datarange = (minval, maxval)
+
+    def _count(self, data):
+        """Add values in data to counts."""
+        self.ndata += len(data)
+        if len(self.binlocs) > 1 and len(data) > 0:
+            self.counts += N.histogram(data, bins=self.binlocs)[0]
+
+    def _rebin(self, chunks):
+        """Recompute the bins and counts from scratch.
+
+        chunks is a function returning an iterable of arrays of the
+        input values."""
+
+        self.version += 1
+        self.ndata = 0
+        self.datarange = None
+        if self._needRange():
+            for data in chunks():
+                self._updateRange(data)
+        self.binlocs = self._binEdges()
+        self.counts = N.zeros(max(len(self.binlocs)-1, 0), dtype=N.int64)
+        for data in chunks():
+            self._count(data)
+
+    def _append(self, chunks):
+        """Add values appended to the input to the counts.
+
+        chunks is a function returning an iterable of arrays of the new
+        values. Returns False if the bins change, so that everything
+        needs to be rebinned."""
+
+        if self._needRange():
+            oldrange = self.datarange
+            for data in chunks():
+                self._updateRange(data)
+            if self.datarange != oldrange:
+                return False
+
+        self.version += 1
+        for data in chunks():
+            self._count(data)
+        return True
+
+    def _binEdges(self):
         """Compute locations of bins edges, giving N+1 items."""
         if self.binmanual:
             return N.array(self.binmanual)
@@ -59,13 +240,12 @@ class DatasetHistoGenerator(object):
             numbins, minval, maxval, islog = self.binparams
 
             if minval == 'Auto' or maxval == 'Auto':
-                data = self.getData()
-                if len(data) == 0:
+                if self.datarange is None:
                     return N.array([])
                 if minval == 'Auto':
-                    minval = N.nanmin(data)
+                    minval = self.datarange[0]
                 if maxval == 'Auto':
-                    maxval = N.nanmax(data)
+                    maxval = self.datarange[1]
 
             if not islog:
                 delta = (maxval - minval) / numbins
@@ -79,13 +259,19 @@ class DatasetHistoGenerator(object):
                 delta = (lmax - lmin) / numbins
                 return N.exp( N.arange(numbins+1)*delta + lmin )
 
+    def binLocations(self):
+        """Return locations of bins edges, giving N+1 items."""
+        self.update()
+        return self.binlocs.copy()
+
     def getBinLocations(self):
         """Return bin centre, -ve bin width, +ve bin width."""
 
-        if len(self.getData()) == 0:
+        self.update()
+        if self.ndata == 0 or len(self.binlocs) < 2:
             return (N.array([]), None, None)
 
-        binlocs = self.binLocations()
+        binlocs = self.binlocs
 
         if self.binparams and self.binparams[3]:
             # log bins
@@ -100,16 +286,16 @@ class DatasetHistoGenerator(object):
         perr = binlocs[1:] - data
         return data, nerr, perr
 
-    def getErrors(self, data, binlocs):
+    def getErrors(self):
         """Compute error bars if requried."""
 
-        hist, edges = N.histogram(data, bins=binlocs)
+        hist, edges = self.counts, self.binlocs
 
         # calculate scaling values for error bars
         if self.method == 'density':
             ratio = 1. / (hist.size*(edges[1]-edges[0]))
         elif self.method == 'fractions':
-            ratio = 1. / data.size
+            ratio = 1. / self.ndata
         else:
             ratio = 1.
 
@@ -128,16 +314,17 @@ class DatasetHistoGenerator(object):
     def getBinVals(self):
         """Return results for each bin."""
 
-        data = self.getData()
-        if len(data) == 0:
+        self.update()
+        if self.ndata == 0 or len(self.binlocs) < 2:
             return (N.array([]), None, None)
 
-        normed = self.method == 'density'
-        binlocs = self.binLocations()
-        hist, edges = N.histogram(data, bins=binlocs, normed=normed)
-        
-        if self.method == 'fractions':
-            hist = hist * (1./data.size)
+        hist = self.counts.copy()
+        if self.method == 'density':
+            # as numpy.histogram with normed=True
+            widths = N.diff(self.binlocs).astype(N.float64)
+            hist = hist / (hist*widths).sum()
+        elif self.method == 'fractions':
+            hist = hist * (1./self.ndata)
 
         # if cumulative wanted
         if self.cumulative == 'smalltolarge':
@@ -146,7 +333,7 @@ class DatasetHistoGenerator(object):
             hist = N.cumsum(hist[::-1])[::-1]
 
         if self.errors:
-            nerr, perr = self.getErrors(data, binlocs)
+            nerr, perr = self.getErrors()
         else:
             nerr, perr = None, None
 
@@ -170,13 +357,17 @@ class DatasetHistoGenerator(object):
         except (ValueError, AttributeError):
             valname = ''
 
+        stream = ''
+        if self.streamfile is not None:
+            stream = ', streamfile=%s' % repr(self.streamfile)
+
         fileobj.write( ("CreateHistogram(%s, %s, %s, binparams=%s, "
                         "binmanual=%s, method=%s, "
-                        "cumulative=%s, errors=%s)\n") %
+                        "cumulative=%s, errors=%s%s)\n") %
                        (repr(self.inexpr), repr(binname), repr(valname),
                         repr(self.binparams), repr(self.binmanual),
                         repr(self.method), repr(self.cumulative),
-                        repr(self.errors)) )
+                        repr(self.errors), stream) )
 
     def linkedInformation(self):
         """Informating about linking."""
@@ -188,6 +379,8 @@ class DatasetHistoGenerator(object):
                                               self.binparams[1],
                                               self.binparams[2])
 
+        if self.streamfile is not None:
+            return "Histogram of file '%s' with %s" % (self.streamfile, bins)
         return "Histogram of '%s' with %s" % (self.inexpr, bins)
 
 class DatasetHistoBins(Dataset):
@@ -199,14 +392,24 @@ class DatasetHistoBins(Dataset):
         self.linked = None
         self._invalidpoints = None
         self.changeset = -1
+        self.genversion = -1
+        self.updateVersion()
 
     def getData(self):
         """Get bin positions, caching results."""
         if self.changeset != self.generator.document.changeset:
             self.datacache = self.generator.getBinLocations()
             self.changeset = self.generator.document.changeset
+            if self.genversion != self.generator.version:
+                self.genversion = self.generator.version
+                self.updateVersion()
         return self.datacache
 
+    def dataVersion(self):
+        """Bins change when the histogram is recalculated."""
+        self.getData()
+        return self.version
+
     def saveToFile(self, fileobj, name):
         """Save dataset (counterpart does this)."""
         pass
@@ -229,14 +432,24 @@ class DatasetHistoValues(Dataset):
         self.linked = None
         self._invalidpoints = None
         self.changeset = -1
+        self.genversion = -1
+        self.updateVersion()
 
     def getData(self):
         """Get bin heights, caching results."""
         if self.changeset != self.generator.document.changeset:
             self.datacache = self.generator.getBinVals()
             self.changeset = self.generator.document.changeset
+            if self.genversion != self.generator.version:
+                self.genversion = self.generator.version
+                self.updateVersion()
         return self.datacache
 
+    def dataVersion(self):
+        """Values change when the histogram is recalculated."""
+        self.getData()
+        return self.version
+
     def saveToFile(self, fileobj, name):
         """Save dataset and its counterpart to a file."""
         self.generator.saveToFile(fileobj)
@@ -258,7 +471,7 @@ class OperationDatasetHistogram(object):
     def __init__(self, expr, outposns, outvalues,
                  binparams=None, binmanual=None, method='counts',
                  cumulative = 'none',
-                 errors=False):
+                 errors=False, streamfile=None):
         """
         inexpr = input dataset expression
         outposns = name of dataset for bin positions
@@ -268,6 +481,7 @@ class OperationDatasetHistogram(object):
         method = ('counts', 'density', or 'fractions')
         cumulative = ('none', 'smalltolarge', 'largetosmall')
         errors = True/False
+        streamfile = None / name of file to read values from
         """
 
         self.expr = expr
@@ -278,6 +492,7 @@ class OperationDatasetHistogram(object):
         self.method = method
         self.cumulative = cumulative
         self.errors = errors
+        self.streamfile = streamfile
 
     def do(self, document):
         """Create histogram datasets."""
@@ -287,7 +502,8 @@ class OperationDatasetHistogram(object):
             binmanual=self.binmanual,
             method=self.method,
             cumulative=self.cumulative,
-            errors=self.errors)
+            errors=self.errors,
+            streamfile=self.streamfile)
 
         if self.outvalues != '':
             self.oldvaluesds = document.data.get(self.outvalues, None)
@@ -20,6 +20,9 @@
 """Classes to represent datasets."""
 
 import re
+import types
+import bisect
+import itertools
 from itertools import izip
 
 import numpy as N
@@ -39,8 +42,9 @@ def _convertNumpy(a):
         # leave as None
         return None
     elif not isinstance(a, N.ndarray):
-        # convert to numpy array
-        return N.array(a, dtype=N.float64)
+        # convert to numpy array (objects which provide a float64
+        # array, e.g. capture buffers, are not copied)
+        return N.asarray(a, dtype=N.float64)
     else:
         # make conversion if numpy type is not correct
         if a.dtype != N.float64:
@@ -68,6 +72,19 @@ def _convertNumpyNegAbs(a):
         a = a.astype(N.float64)
     return -N.abs(a)
 
+def _shareArray(a):
+    """Return a read only view of array a for sharing between
+    datasets, or None.
+
+    Datasets copy read only arrays before modifying them (copy on
+    write). Array a itself is left writable, as it may belong to
+    whoever made the dataset."""
+    if a is None:
+        return None
+    a = a.view()
+    a.flags.writeable = False
+    return a
+
 def _copyOrNone(a):
     """Return a copy if not None, or None."""
     if a is None:
@@ -462,6 +479,18 @@ class DatasetException(Exception):
     """Raised with dataset errors."""
     pass
 
+# each state of each dataset is given a unique version number from this
+_datasetversions = itertools.count(1)
+
+def _documentDataVersion(ds):
+    """Return a version for a dataset which may change whenever its
+    document changes (e.g. if calculated from other datasets)."""
+    changeset = ds.document.changeset
+    if getattr(ds, '_versionchangeset', None) != changeset:
+        ds._versionchangeset = changeset
+        ds.updateVersion()
+    return ds.version
+
 class DatasetBase(object):
     """A base dataset class."""
 
@@ -485,6 +514,21 @@ class DatasetBase(object):
         # file this dataset is linked to
         self.linked = linked
 
+        # version number of the data (see dataVersion)
+        self.updateVersion()
+
+    def updateVersion(self):
+        """Give the dataset a new version number, to be called when the
+        data are modified."""
+        self.version = _datasetversions.next()
+
+    def dataVersion(self):
+        """Return a number which changes whenever the data change.
+
+        This is used to work out whether datasets which depend on
+        this one need to be updated."""
+        return self.version
+
     def saveLinksToSavedDoc(self, fileobj, savedlinks, relpath=None):
         '''Save the link to the saved document, if this dataset is linked.
 
@@ -499,6 +543,11 @@ class DatasetBase(object):
             savedlinks[self.linked] = True
             self.linked.saveToFile(fileobj, relpath=relpath)
 
+    def binaryColumns(self):
+        """Return a dict of column names and arrays for saving the
+        dataset in a binary file, or None if not possible."""
+        return None
+
     def name(self):
         """Get dataset name."""
         for name, ds in self.document.data.iteritems():
@@ -650,6 +699,15 @@ class Dataset2D(DatasetBase):
 
         fileobj.write("''')\n")
 
+    def binaryColumns(self):
+        """Return arrays for saving in binary file."""
+        # derived datasets save themselves in other ways
+        if self.linked is not None or type(self) is not Dataset2D:
+            return None
+        return { 'data': self.data,
+                 'xrange': N.array(self.xrange, dtype=N.float64),
+                 'yrange': N.array(self.yrange, dtype=N.float64) }
+
     def userSize(self):
         """Return dimensions of dataset for user."""
         return u'%i×%i' % self.data.shape
@@ -752,7 +810,7 @@ class Dataset(DatasetBase):
             text += ',+'
         if self.nerr is not None:
             text += ',-'
-        text += ' (length %i)' % len(self.data)
+        text += ' (length %i)' % len(self)
 
         if self.linked and showlinked:
             text += ' linked to %s' % self.linked.filename
@@ -823,6 +881,8 @@ class Dataset(DatasetBase):
         for x in (self.serr, self.nerr, self.perr):
             assert x is None or x.shape == s
 
+        self.updateVersion()
+        self.document.datasetValuesChanged(self)
         self.document.setModified(True)
 
     def saveToFile(self, fileobj, name):
@@ -857,6 +917,18 @@ class Dataset(DatasetBase):
 
         fileobj.write( "''')\n" )
 
+    def binaryColumns(self):
+        """Return arrays for saving in binary file."""
+        # derived datasets save themselves in other ways
+        if self.linked is not None or type(self) is not Dataset:
+            return None
+        out = {}
+        for col in self.columns:
+            array = getattr(self, col)
+            if array is not None:
+                out[col] = array
+        return out
+
     def deleteRows(self, row, numrows):
         """Delete numrows rows starting from row.
         Returns deleted rows as a dict of {column:data, ...}
@@ -865,9 +937,12 @@ class Dataset(DatasetBase):
         for col in self.columns:
             coldata = getattr(self, col)
             if coldata is not None:
-                retn[col] = coldata[row:row+numrows]
+                # copy, so the old column is not kept alive by the slice
+                retn[col] = N.array(coldata[row:row+numrows])
                 setattr(self, col, N.delete( coldata, N.s_[row:row+numrows] ))
-        
+
+        self.updateVersion()
+        self.document.datasetValuesChanged(self)
         return retn
 
     def insertRows(self, row, numrows, rowdata):
@@ -881,13 +956,28 @@ class Dataset(DatasetBase):
                 data[:len(rowdata[col])] = N.array(rowdata[col])
             if coldata is not None:
                 setattr(self, col, N.insert(coldata, [row]*numrows, data))
+        self.updateVersion()
+        self.document.datasetValuesChanged(self)
 
     def returnCopy(self):
         """Return version of dataset with no linking."""
-        return Dataset(data = _copyOrNone(self.data),
-                       serr = _copyOrNone(self.serr),
-                       perr = _copyOrNone(self.perr),
-                       nerr = _copyOrNone(self.nerr))
+        if type(self) is not Dataset:
+            # derived datasets may change their arrays
+            return Dataset(data = _copyOrNone(self.data),
+                           serr = _copyOrNone(self.serr),
+                           perr = _copyOrNone(self.perr),
+                           nerr = _copyOrNone(self.nerr))
+
+        # share the values with the copy, until either is modified
+        # (this dataset also switches to read only views, so it copies
+        # its values before changing them)
+        for col in self.columns:
+            setattr(self, col, _shareArray(getattr(self, col)))
+        ds = Dataset(data = _shareArray(self.data))
+        ds.serr = _shareArray(self.serr)
+        ds.perr = _shareArray(self.perr)
+        ds.nerr = _shareArray(self.nerr)
+        return ds
 
 class DatasetDateTime(Dataset):
     """Dataset holding dates and times."""
@@ -937,7 +1027,148 @@ class DatasetDateTime(Dataset):
 
     def returnCopy(self):
         """Returns version of dataset with no linking."""
-        return DatasetDateTime(data=N.array(self.data))
+        self.data = _shareArray(self.data)
+        return DatasetDateTime(data=_shareArray(self.data))
+
+class DatasetMemmap(Dataset):
+    """A dataset with values memory mapped from a file.
+
+    The mapped values are left in the type held in the file, and are
+    only read from disk and converted to 64 bit floating point values
+    when they are used. Ranges are found a block at a time, and taking
+    part of the dataset (e.g. ds[5:100]) converts only that part. If
+    the values are sorted, plotters can use valueIndexRange to read
+    only the visible part. The data attribute converts (and keeps)
+    all the values, so should be avoided for large files.
+    """
+
+    # number of values to process at a time when finding range
+    rangeblock = 1048576
+
+    def __init__(self, data, serr = None, nerr = None, perr = None,
+                 linked = None):
+        """data is a numpy memmap, errors are arrays or lists."""
+
+        DatasetBase.__init__(self, linked=linked)
+
+        self.mapped = data
+        self._data = None
+        self._sorted = None
+        self.serr = _convertNumpyAbs(serr)
+        self.perr = _convertNumpyAbs(perr)
+        self.nerr = _convertNumpyNegAbs(nerr)
+        for x in (self.serr, self.nerr, self.perr):
+            if x is not None and x.shape != data.shape:
+                raise DatasetException('Lengths of error data do not match data')
+
+        self._invalidpoints = None
+
+    def _getData(self):
+        """Get values, converting all the mapped values if necessary."""
+        if self._data is None:
+            self._data = _convertNumpy(self.mapped)
+        return self._data
+
+    def _setData(self, val):
+        """Replace values (these are no longer mapped)."""
+        self._data = val
+        self._sorted = None
+
+    data = property(_getData, _setData)
+
+    def _values(self):
+        """Return the values, without converting them if mapped."""
+        if self._data is not None:
+            return self._data
+        return self.mapped
+
+    def __len__(self):
+        return len(self._values())
+
+    def __getitem__(self, key):
+        """Return a dataset of part of this dataset.
+
+        Only the values in the part are converted."""
+        args = {}
+        for col in self.columns:
+            if col == 'data':
+                array = self._values()
+            else:
+                array = getattr(self, col)
+            if array is not None:
+                args[col] = array[key]
+        return Dataset(**args)
+
+    def userSize(self):
+        """Size of dataset."""
+        return str( len(self) )
+
+    def userPreview(self):
+        """Preview of data."""
+        return dsPreviewHelper(self._values())
+
+    def invalidDataPoints(self):
+        """Return a numpy bool detailing which datapoints are invalid."""
+        if self._invalidpoints is None:
+            values = self._values()
+            if values.dtype.kind == 'f':
+                invalid = N.logical_not(N.isfinite(values))
+            else:
+                # integers are always valid
+                invalid = N.zeros(values.shape, dtype=N.bool_)
+            for error in self.serr, self.perr, self.nerr:
+                if error is not None:
+                    invalid = N.logical_or(invalid,
+                                           N.logical_not(N.isfinite(error)))
+            self._invalidpoints = invalid
+
+        return self._invalidpoints
+
+    def getRange(self):
+        """Get total range of coordinates.
+
+        This converts a block of values at a time."""
+        minval = maxval = None
+        for i in xrange(0, len(self), self.rangeblock):
+            brange = self[i:i+self.rangeblock].getRange()
+            if brange is not None:
+                if minval is None:
+                    minval, maxval = brange
+                else:
+                    minval = min(minval, brange[0])
+                    maxval = max(maxval, brange[1])
+        if minval is None:
+            return None
+        return (minval, maxval)
+
+    def _checkSorted(self):
+        """Are the values sorted in increasing order?"""
+        values = self._values()
+        last = None
+        for i in xrange(0, len(values), self.rangeblock):
+            block = values[i:i+self.rangeblock]
+            if block.dtype.kind == 'f' and N.isnan(block).any():
+                return False
+            if not N.all(block[1:] >= block[:-1]):
+                return False
+            if last is not None and not block[0] >= last:
+                return False
+            last = block[-1]
+        return True
+
+    def valueIndexRange(self, minval, maxval):
+        """Return range of indices (start, stop) of values from minval
+        to maxval, or None if the values are not sorted.
+
+        This reads only the values needed to search for the range."""
+        if self._sorted is None:
+            self._sorted = self._checkSorted()
+        if not self._sorted:
+            return None
+
+        values = self._values()
+        return ( bisect.bisect_left(values, minval),
+                 bisect.bisect_right(values, maxval) )
 
 class DatasetText(DatasetBase):
     """Represents a text dataset: holding an array of strings."""
@@ -970,6 +1201,8 @@ class DatasetText(DatasetBase):
         else:
             raise ValueError, 'type does not contain an allowed value'
 
+        self.updateVersion()
+        self.document.datasetValuesChanged(self)
         self.document.setModified(True)
     
     def uiConvertToDataItem(self, val):
@@ -1002,6 +1235,8 @@ class DatasetText(DatasetBase):
         """
         retn = {'data': self.data[row:row+numrows]}
         del self.data[row:row+numrows]
+        self.updateVersion()
+        self.document.datasetValuesChanged(self)
         return retn
 
     def insertRows(self, row, numrows, rowdata):
@@ -1013,6 +1248,8 @@ class DatasetText(DatasetBase):
         insdata = data + (['']*(numrows-len(data)))
         for d in insdata[::-1]:
             self.data.insert(row, d)
+        self.updateVersion()
+        self.document.datasetValuesChanged(self)
 
     def returnCopy(self):
         """Returns version of dataset with no linking."""
@@ -1063,6 +1300,15 @@ def _substituteDatasets(datasets, expression, thispart):
 
     return ''.join(bits), dslist
 
+def _codeNames(code):
+    """Return the set of global names used by compiled code, including
+    those used by any functions it defines."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _codeNames(const)
+    return names
+
 def _evaluateDataset(datasets, dsname, dspart):
     """Return the dataset given.
 
@@ -1079,7 +1325,6 @@ def _evaluateDataset(datasets, dsname, dspart):
         raise DatasetExpressionException(
             'Internal error - invalid dataset part')
 
-_safeexpr = set()
 def simpleEvalExpression(doc, expr, part='data'):
     """Evaluate expression and return data.
 
@@ -1089,22 +1334,15 @@ def simpleEvalExpression(doc, expr, part='data'):
 
     expr = _substituteDatasets(doc.data, expr, part)[0]
 
-    if expr not in _safeexpr:
-        if ( not setting.transient_settings['unsafe_mode'] and
-             utils.checkCode(expr, securityonly=True) ):
-            doc.log("Unsafe expression: %s\n" % expr)
-            return N.array([])
-
-    # for speed, track safe expressions
-    _safeexpr.add(expr)
-
-    env = doc.eval_context.copy()
     def evaluateDataset(dsname, dspart):
         return _evaluateDataset(doc.data, dsname, dspart)
 
-    env['_DS_'] = evaluateDataset
     try:
-        evalout = eval(expr, env)
+        code = doc.compileCheckedExpression(expr)
+        if code is None:
+            doc.log("Unsafe expression: %s\n" % expr)
+            return N.array([])
+        evalout = doc.evalCode(code, {'_DS_': evaluateDataset})
     except Exception, ex:
         doc.log(unicode(ex))
         return N.array([])
@@ -1132,11 +1370,13 @@ class DatasetExpression(Dataset):
         self.expr['perr'] = perr
         self.parametric = parametric
 
-        self.cachedexpr = {}
-
         self.docchangeset = -1
         self.evaluated = {}
 
+        # inputs to the last evaluation, used to avoid reevaluating
+        # if the datasets and custom definitions used are unchanged
+        self.inputs = None
+
     def evaluateDataset(self, dsname, dspart):
         """Return the dataset given.
         
@@ -1145,22 +1385,22 @@ class DatasetExpression(Dataset):
         """
         return _evaluateDataset(self.document.data, dsname, dspart)
                     
-    def _evaluatePart(self, expr, part):
-        """Evaluate expression expr for part part."""
+    def _evaluatePart(self, expr, part, inputs):
+        """Evaluate expression expr for part part.
+
+        The datasets and names used are recorded in inputs."""
         # replace dataset names with calls
-        expr = _substituteDatasets(self.document.data, expr, part)[0]
+        expr, dsnames = _substituteDatasets(self.document.data, expr, part)
 
-        # check expression for nasties if it has changed
-        if self.cachedexpr.get(part) != expr:
-            if ( not setting.transient_settings['unsafe_mode'] and
-                 utils.checkCode(expr, securityonly=True) ):
-                raise DatasetExpressionException(
-                    "Unsafe expression '%s' in %s part of dataset" % (
-                        self.expr[part], part))
-            self.cachedexpr[part] = expr
+        # remember the versions of the datasets used
+        inputs['exprs'][part] = expr
+        for dsname in dsnames:
+            inputs['datasets'][dsname] = (
+                self.document.data[dsname].dataVersion() )
 
-        # set up environment to evaluate expressions in
-        environment = self.document.eval_context.copy()
+        # variables to evaluate expressions with
+        # this fn gets called to return the value of a dataset
+        localvars = {'_DS_': self.evaluateDataset}
 
         # create dataset using parametric expression
         if self.parametric:
@@ -1170,15 +1410,21 @@ class DatasetExpression(Dataset):
                 t = N.arange(p[2])*deltat + p[0]
             else:
                 t = N.array([p[0]])
-            environment['t'] = t
-
-        # this fn gets called to return the value of a dataset
-        environment['_DS_'] = self.evaluateDataset
+            localvars['t'] = t
 
         # actually evaluate the expression
         try:
-            result = eval(expr, environment)
+            # check expression for nasties
+            code = self.document.compileCheckedExpression(expr)
+            if code is None:
+                raise DatasetExpressionException(
+                    "Unsafe expression '%s' in %s part of dataset" % (
+                        self.expr[part], part))
+            inputs['names'] |= _codeNames(code)
+            result = self.document.evalCode(code, localvars)
             evalout = N.array(result, N.float64)
+        except DatasetExpressionException:
+            raise
         except Exception, ex:
             raise DatasetExpressionException(
                 "Error evaluating expression: %s\n"
@@ -1210,15 +1456,63 @@ class DatasetExpression(Dataset):
             # avoid infinite recursion!
             self.docchangeset = self.document.changeset
 
+            if not self._inputsChanged():
+                return
+
             # zero out previous values
             for part in self.columns:
                 self.evaluated[part] = None
+            self.inputs = None
+            self.updateVersion()
 
             # update all parts
+            inputs = {'exprs': {}, 'datasets': {}, 'names': set(),
+                      'customs': self.document.customschangeset}
             for part in self.columns:
                 expr = self.expr[part]
                 if expr is not None and expr.strip() != '':
-                    self._evaluatePart(expr, part)
+                    self._evaluatePart(expr, part, inputs)
+
+            inputs['usedcustoms'] = (
+                inputs['names'] & self.document.customnames )
+            self.inputs = inputs
+
+    def _inputsChanged(self):
+        """Have the datasets or custom definitions used in the last
+        evaluation changed?
+
+        Datasets which are expressions themselves are brought up to
+        date when checked, so changes propagate down chains of
+        expressions."""
+
+        inputs = self.inputs
+        if inputs is None:
+            return True
+
+        doc = self.document
+        for part, expr in inputs['exprs'].iteritems():
+            # the set of datasets in the document affects substitution
+            if _substituteDatasets(doc.data, self.expr[part],
+                                   part)[0] != expr:
+                return True
+
+        for dsname, version in inputs['datasets'].iteritems():
+            ds = doc.data.get(dsname)
+            if ds is None or ds.dataVersion() != version:
+                return True
+
+        if inputs['customs'] != doc.customschangeset:
+            # definitions have changed, so check whether any were used,
+            # or whether names used are now custom definitions
+            if inputs['usedcustoms'] or inputs['names'] & doc.customnames:
+                return True
+
+        return False
+
+    def dataVersion(self):
+        """Return version of data, reevaluating if necessary."""
+        self._propValues('data')
+        return self.version
 
     def _propValues(self, part):
         """Check whether expressions need reevaluating,
@@ -1417,9 +1711,6 @@ class Dataset2DXYZExpression(Dataset2D):
         self.expry = expry
         self.exprz = exprz
 
-        # cache x y and z expressions
-        self.cachedexpr = {}
-
     def evaluateDataset(self, dsname, dspart):
         """Return the dataset given.
         
@@ -1436,25 +1727,23 @@ class Dataset2DXYZExpression(Dataset2D):
 
         evaluated = {}
 
-        environment = self.document.eval_context.copy()
-        environment['_DS_'] = self.evaluateDataset
+        localvars = {'_DS_': self.evaluateDataset}
 
         # evaluate the x, y and z expressions
         for name in ('exprx', 'expry', 'exprz'):
             expr = _substituteDatasets(self.document.data, getattr(self, name),
                                        'data')[0]
 
-            # check expression if not checked before
-            if self.cachedexpr.get(name) != expr:
-                if ( not setting.transient_settings['unsafe_mode'] and
-                     utils.checkCode(expr, securityonly=True) ):
+            try:
+                # check expression for nasties
+                code = self.document.compileCheckedExpression(expr)
+                if code is None:
                     raise DatasetExpressionException(
                         "Unsafe expression '%s'" % (
                             expr))
-                self.cachedexpr[name] = expr
-
-            try:
-                evaluated[name] = eval(expr, environment)
+                evaluated[name] = self.document.evalCode(code, localvars)
+            except DatasetExpressionException:
+                raise
             except Exception, e:
                 raise DatasetExpressionException(
                     "Error evaluating expression: %s\n"
@@ -1480,6 +1769,10 @@ class Dataset2DXYZExpression(Dataset2D):
 
         return self.cacheddata
 
+    def dataVersion(self):
+        """Data may change whenever the document changes."""
+        return _documentDataVersion(self)
+
     @property
     def xrange(self):
         """Get x range of data as a tuple (min, max)."""
@@ -1543,7 +1836,6 @@ class Dataset2DExpression(Dataset2D):
 
         self.expr = expr
         self.lastchangeset = -1
-        self.cachedexpr = None
 
         if utils.checkCode(expr, securityonly=True) is not None:
             raise DatasetExpressionException("Unsafe expression '%s'" % expr)
@@ -1581,29 +1873,25 @@ class Dataset2DExpression(Dataset2D):
         if self.document.changeset == self.lastchangeset:
             return self._cacheddata
 
-        environment = self.document.eval_context.copy()
-
         def getdataset(dsname, dspart):
             """Return the dataset given in document."""
             return _evaluateDataset(self.document.data, dsname, dspart)
-        environment['_DS_'] = getdataset
 
         # substituted expression
         expr, datasets = _substituteDatasets(self.document.data, self.expr,
                                              'data')
 
-        # check expression if not checked before
-        if self.cachedexpr != expr:
-            if ( not setting.transient_settings['unsafe_mode'] and
-                 utils.checkCode(expr, securityonly=True) ):
+        # do evaluation
+        try:
+            # check expression for nasties
+            code = self.document.compileCheckedExpression(expr)
+            if code is None:
                 raise DatasetExpressionException(
                     "Unsafe expression '%s'" % (
                         expr))
-            self.cachedexpr = expr
-
-        # do evaluation
-        try:
-            evaluated = eval(expr, environment)
+            evaluated = self.document.evalCode(code, {'_DS_': getdataset})
+        except DatasetExpressionException:
+            raise
         except Exception, e:
             raise DatasetExpressionException(
                 "Error evaluating expression: %s\n"
@@ -1629,6 +1917,10 @@ class Dataset2DExpression(Dataset2D):
         self._cacheddata = evaluated, rangex, rangey
         return self._cacheddata
 
+    def dataVersion(self):
+        """Data may change whenever the document changes."""
+        return _documentDataVersion(self)
+
     def saveToFile(self, fileobj, name):
         '''Save expression to file.'''
         s = 'SetData2DExpression(%s, %s, linked=True)\n' % (
@@ -1690,8 +1982,6 @@ class Dataset2DXYFunc(Dataset2D):
         if self.document.changeset == self.lastchangeset:
             return self.cacheddata
 
-        env = self.document.eval_context.copy()
-
         xarange = N.arange(self.xstep[0], self.xstep[1]+self.xstep[2],
                            self.xstep[2])
         yarange = N.arange(self.ystep[0], self.ystep[1]+self.ystep[2],
@@ -1700,10 +1990,14 @@ class Dataset2DXYFunc(Dataset2D):
         xstep = xarange[xstep]
         ystep = yarange[ystep]
 
-        env['x'] = xstep
-        env['y'] = ystep
         try:
-            data = eval(self.expr, env)
+            code = self.document.compileCheckedExpression(self.expr)
+            if code is None:
+                raise DatasetExpressionException(
+                    "Unsafe expression '%s'" % self.expr)
+            data = self.document.evalCode(code, {'x': xstep, 'y': ystep})
+        except DatasetExpressionException:
+            raise
         except Exception, e:
             raise DatasetExpressionException("Error evaluating expression: %s\n"
                                              "Error: %s" % (self.expr, str(e)) )
@@ -1715,6 +2009,10 @@ class Dataset2DXYFunc(Dataset2D):
         self.lastchangeset = self.document.changeset
         return data
 
+    def dataVersion(self):
+        """Data may change whenever the document changes."""
+        return _documentDataVersion(self)
+
     def saveToFile(self, fileobj, name):
         '''Save expressions to file.
         '''
@@ -1742,6 +2040,10 @@ class _DatasetPlugin(object):
         self.pluginmanager.update()
         return getattr(self.pluginds, attr)
 
+    def dataVersion(self):
+        """Plugin data may change whenever the document changes."""
+        return _documentDataVersion(self)
+
     def linkedInformation(self):
         """Return information about how this dataset was created."""
 
@@ -26,6 +26,7 @@ import time
 import random
 import math
 import re
+import types
 import traceback
 from collections import defaultdict
 
@@ -36,6 +37,7 @@ import veusz.qtall as qt4
 import widgetfactory
 import datasets
 import painthelper
+import binaryblock
 
 import veusz.utils as utils
 import veusz.setting as setting
@@ -67,11 +69,95 @@ def getSuitableParent(widgettype, initialwidget):
         parent = parent.parent
     return parent
             
+def _findArrays(obj, arrays, depth=0):
+    """Find the numpy arrays held by obj, which may be an operation,
+    dataset, or a dict, list or tuple of them.
+
+    The arrays owning the memory are added to dict arrays, indexed by
+    their ids. Memory mapped arrays are ignored."""
+
+    if depth > 8:
+        return
+    if isinstance(obj, N.ndarray):
+        while isinstance(obj.base, N.ndarray):
+            obj = obj.base
+        if not isinstance(obj, N.memmap):
+            arrays[id(obj)] = obj
+    elif isinstance(obj, dict):
+        for val in obj.itervalues():
+            _findArrays(val, arrays, depth+1)
+    elif isinstance(obj, (list, tuple)):
+        if len(obj) <= 10000:
+            for val in obj:
+                _findArrays(val, arrays, depth+1)
+    elif ( isinstance(obj, datasets.DatasetBase) or
+           (hasattr(obj, 'do') and hasattr(obj, 'undo')) ):
+        # avoid evaluating datasets by looking at stored attributes
+        for val in getattr(obj, '__dict__', {}).itervalues():
+            _findArrays(val, arrays, depth+1)
+
+class DatasetDict(dict):
+    """A dict of the datasets in a document, which tells the document
+    when a dataset is added, replaced or removed."""
+
+    def __init__(self, document):
+        dict.__init__(self)
+        self.document = document
+
+    def __setitem__(self, name, dataset):
+        dict.__setitem__(self, name, dataset)
+        self.document.datasetChanged(name)
+
+    def __delitem__(self, name):
+        dict.__delitem__(self, name)
+        self.document.datasetChanged(name)
+
+    def update(self, *args, **kwargs):
+        for name, dataset in dict(*args, **kwargs).iteritems():
+            self[name] = dataset
+
+    def setdefault(self, name, dataset=None):
+        if name not in self:
+            self[name] = dataset
+        return self[name]
+
+    def pop(self, name, *default):
+        if name not in self and default:
+            return default[0]
+        dataset = self[name]
+        del self[name]
+        return dataset
+
+    def popitem(self):
+        name, dataset = dict.popitem(self)
+        self.document.datasetChanged(name)
+        return name, dataset
+
+    def clear(self):
+        names = self.keys()
+        dict.clear(self)
+        for name in names:
+            self.document.datasetChanged(name)
+
+    def replace(self, datasets):
+        """Replace contents with the datasets in dict datasets.
+
+        Only datasets which are added, replaced or removed are
+        notified."""
+        for name in self.keys():
+            if name not in datasets:
+                del self[name]
+        for name, dataset in datasets.iteritems():
+            if dict.get(self, name) is not dataset:
+                self[name] = dataset
+
 class Document( qt4.QObject ):
     """Document class for holding the graph data.
 
     Emits: sigModified when the document has been modified
            sigWiped when document is wiped
+           sigDatasetChanged(name) when the dataset with name is added,
+             replaced, removed or has its values changed
     """
 
     pluginsloaded = False
@@ -103,11 +189,16 @@ class Document( qt4.QObject ):
         # consists of tuples of (name, type, value)
         # type is constant or function
         self.customs = []
+        # increased when the custom definitions are changed
+        self.customschangeset = 0
         self.updateEvalContext()
 
+        # compiled expressions (see compileCheckedExpression)
+        self.exprcache = utils.LRUCache(512)
+
     def wipe(self):
         """Wipe out any stored data."""
-        self.data = {}
+        self.data = DatasetDict(self)
         self.basewidget = widgetfactory.thefactory.makeWidget(
             'document', None, None)
         self.basewidget.document = self
@@ -170,10 +261,41 @@ class Document( qt4.QObject ):
         else:
             # standard mode
             self.historyundo = self.historyundo[-9:] + [operation]
+            self.trimHistory(operation)
         self.historyredo = []
 
         return retn
 
+    def trimHistory(self, newoperation=None):
+        """Remove the oldest undo operations if the arrays they keep
+        alive use more memory than the history_maxmemory preference
+        (in MB). The newest operation is always kept.
+
+        newoperation is an operation just added, which if it holds no
+        arrays cannot have increased the memory used."""
+
+        if newoperation is not None:
+            arrays = {}
+            _findArrays(newoperation, arrays)
+            if not arrays:
+                return
+
+        # arrays still used by the document do not count
+        live = {}
+        for ds in self.data.itervalues():
+            _findArrays(ds, live)
+
+        maxbytes = setting.settingdb['history_maxmemory'] * 1048576
+        arrays = {}
+        for index in xrange(len(self.historyundo)-2, -1, -1):
+            _findArrays(self.historyundo[index+1], arrays)
+            _findArrays(self.historyundo[index], arrays)
+            used = sum([a.nbytes for key, a in arrays.iteritems()
+                        if key not in live])
+            if used > maxbytes:
+                del self.historyundo[:index+1]
+                break
+
     def batchHistory(self, batch):
         """Enable/disable batch history mode.
         
@@ -263,6 +385,7 @@ class Document( qt4.QObject ):
         """Set data to val, with symmetric or negative and positive errors."""
         self.data[name] = dataset
         dataset.document = self
+        dataset.updateVersion()
         self.setModified()
 
     def getLinkedFiles(self, filenames=None):
@@ -321,6 +444,17 @@ class Document( qt4.QObject ):
 
         self.setModified()
 
+    def datasetChanged(self, name):
+        """Tell listeners that the dataset with name has been added,
+        replaced, removed or had its values changed."""
+        self.emit( qt4.SIGNAL("sigDatasetChanged"), name )
+
+    def datasetValuesChanged(self, dataset):
+        """Tell listeners that the values of dataset have been changed."""
+        for name, ds in self.data.iteritems():
+            if ds is dataset:
+                self.datasetChanged(name)
+
     def getData(self, name):
         """Get data with name"""
         return self.data[name]
@@ -421,8 +555,13 @@ class Document( qt4.QObject ):
         self._writeFileHeader(fileobj, 'custom definitions')
         self.saveCustomDefinitions(fileobj)
 
-    def saveToFile(self, fileobj):
-        """Save the text representing a document to a file."""
+    def saveToFile(self, fileobj, binarydata=False, compress=False):
+        """Save the text representing a document to a file.
+
+        If binarydata is set, the values of datasets are saved in a
+        separate binary file next to the document, if fileobj has a
+        filename. This is optionally compressed.
+        """
 
         self._writeFileHeader(fileobj, 'saved document')
         
@@ -442,9 +581,31 @@ class Document( qt4.QObject ):
             dataset.saveLinksToSavedDoc(fileobj, savedlinks,
                                         relpath=reldirname)
 
+        # save the values of datasets to a binary file if requested
+        binarysaved = set()
+        if binarydata and getattr(fileobj, 'name', False):
+            arrays = {}
+            keys = {}
+            for name, dataset in sorted(self.data.items()):
+                columns = dataset.binaryColumns()
+                if columns is not None:
+                    key = 'ds%i' % len(keys)
+                    keys[name] = key
+                    for col, array in columns.iteritems():
+                        arrays['%s_%s' % (key, col)] = array
+            if keys:
+                filename = binaryblock.binaryBlockFilename(
+                    os.path.abspath(fileobj.name))
+                binaryblock.saveBinaryBlock(filename, arrays,
+                                            compress=compress)
+                fileobj.write('ImportBinaryBlock(%s, %s)\n' % (
+                        repr(os.path.basename(filename)), repr(keys)))
+                binarysaved.update(keys)
+
         # save the remaining datasets
         for name, dataset in sorted(self.data.items()):
-            dataset.saveToFile(fileobj, name)
+            if name not in binarysaved:
+                dataset.saveToFile(fileobj, name)
 
         # save the actual tree structure
         fileobj.write(self.basewidget.getSaveText())
@@ -693,6 +854,7 @@ class Document( qt4.QObject ):
         c['veusz_markercodes'] = tuple(utils.MarkerCodes)
 
         # custom definitions
+        base = dict(c)
         for ctype, name, val in self.customs:
             name = name.strip()
             val = val.strip()
@@ -703,6 +865,12 @@ class Document( qt4.QObject ):
             else:
                 raise ValueError, 'Invalid custom type'
 
+        # keep track of names defined by custom definitions, so that
+        # expressions using them know to update
+        self.customnames = set( [ name for name, val in c.iteritems()
+                                  if base.get(name) is not val ] )
+        self.customschangeset += 1
+
     def evalDatasetExpression(self, expr, part='data'):
         """Return results of evaluating a 1D dataset expression.
         part is 'data', 'serr', 'perr' or 'nerr' - these are the
@@ -710,6 +878,39 @@ class Document( qt4.QObject ):
         """
         return datasets.simpleEvalExpression(self, expr, part=part)
 
+    def compileCheckedExpression(self, expr):
+        """Check expression is safe and compile it.
+
+        Returns the code object, or None if the expression is unsafe
+        (unless in unsafe mode). Errors compiling are raised as
+        exceptions. Results are cached, keyed on the expression and
+        safe mode.
+        """
+        unsafe = setting.transient_settings['unsafe_mode']
+        key = (expr, unsafe)
+        code = self.exprcache.get(key, False)
+        if code is False:
+            if not unsafe and utils.checkCode(expr, securityonly=True):
+                code = None
+            else:
+                code = compile(expr, '<string>', 'eval')
+            self.exprcache[key] = code
+        return code
+
+    def evalCode(self, code, localvars):
+        """Evaluate compiled code in the document context.
+
+        localvars is a dict of extra variables to use. The context is
+        used directly rather than copied, unless the code defines
+        functions, which would not otherwise see localvars.
+        """
+        for const in code.co_consts:
+            if isinstance(const, types.CodeType):
+                env = self.eval_context.copy()
+                env.update(localvars)
+                return eval(code, env)
+        return eval(code, self.eval_context, localvars)
+
     def walkNodes(self, tocall, root=None,
                   nodetypes=('widget', 'setting', 'settings'),
                   _path=None):
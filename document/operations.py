@@ -35,9 +35,11 @@ import datasets
 import widgetfactory
 import simpleread
 import readcsv
+import binaryblock
 
 import veusz.utils as utils
 import veusz.plugins as plugins
+from veusz.setting import Reference
     
 ###############################################################################
 # Setting operations
@@ -316,6 +318,8 @@ class OperationWidgetMove(object):
             # convert negative index to normal index
             self.newindex = len(newparent.children)
 
+        Reference.treeChanged()
+
         if oldparent is newparent:
             # moving within same parent
             self.movemode = 'sameparent'
@@ -353,6 +357,7 @@ class OperationWidgetMove(object):
 
         # remove from new parent
         del newparent.children[self.newindex]
+        Reference.treeChanged()
         # restore parent
         oldparent.children.insert(self.oldchildindex, child)
         child.parent = oldparent
@@ -513,10 +518,12 @@ class OperationDatasetUnlinkFile(object):
         dataset = document.data[self.datasetname]
         self.oldfilelink = dataset.linked
         dataset.linked = None
+        document.datasetChanged(self.datasetname)
         
     def undo(self, document):
         dataset = document.data[self.datasetname]
         dataset.linked = self.oldfilelink
+        document.datasetChanged(self.datasetname)
 
 class OperationDatasetUnlinkRelation(object):
     """Remove association between dataset and another dataset.
@@ -781,6 +788,8 @@ class OperationDatasetUnlinkByFile(object):
             if ds.linked is not None and ds.linked.filename == self.filename:
                 self.oldlinks[name] = ds.linked
                 ds.linked = None
+        for name in self.oldlinks:
+            document.datasetChanged(name)
 
     def undo(self, document):
         """Restore links."""
@@ -789,6 +798,8 @@ class OperationDatasetUnlinkByFile(object):
                 document.data[name].linked = link
             except KeyError:
                 pass
+            else:
+                document.datasetChanged(name)
 
 class OperationDatasetDeleteByFile(object):
     """Delete all datasets associated with file."""
@@ -894,7 +905,7 @@ class OperationDataImport(object):
         """Undo import."""
         
         # restore old datasets
-        document.data = self.olddatasets
+        document.data.replace(self.olddatasets)
 
 class OperationDataImportCSV(object):
     """Import data from a CSV file."""
@@ -962,7 +973,7 @@ class OperationDataImportCSV(object):
         """Undo import."""
         
         # restore old datasets
-        document.data = self.olddatasets
+        document.data.replace(self.olddatasets)
         
 class OperationDataImport2D(object):
     """Import a 2D matrix from a file."""
@@ -1061,7 +1072,7 @@ class OperationDataImport2D(object):
         """Undo import."""
         
         # restore old datasets
-        document.data = self.olddatasets
+        document.data.replace(self.olddatasets)
     
 class OperationDataImportFITS(object):
     """Import 1d or 2d data from a fits file."""
@@ -1241,9 +1252,13 @@ class OperationDataImportPlugin(object):
         # save for undoing
         self.olddata = {}
 
+        # memory mapped data are always linked to the file
+        mapped = [d for d in results
+                  if isinstance(getattr(d, 'data', None), N.memmap)]
+
         # make link for file
         linked = None
-        if self.linked:
+        if self.linked or mapped:
             linked = datasets.LinkedFilePlugin(
                 self.pluginname, self.filename, self.params,
                 encoding=self.encoding, prefix=self.prefix,
@@ -1252,8 +1267,12 @@ class OperationDataImportPlugin(object):
         # convert results to real datasets
         for d in results:
             if isinstance(d, plugins.ImportDataset1D):
-                ds = datasets.Dataset(data=d.data, serr=d.serr, perr=d.perr,
-                                      nerr=d.nerr)
+                if isinstance(d.data, N.memmap):
+                    ds = datasets.DatasetMemmap(data=d.data, serr=d.serr,
+                                                perr=d.perr, nerr=d.nerr)
+                else:
+                    ds = datasets.Dataset(data=d.data, serr=d.serr,
+                                          perr=d.perr, nerr=d.nerr)
             elif isinstance(d, plugins.ImportDataset2D):
                 ds = datasets.Dataset2D(data=d.data, xrange=d.rangex,
                                         yrange=d.rangey)
@@ -1285,6 +1304,59 @@ class OperationDataImportPlugin(object):
         for name, dataset in self.olddata.iteritems():
             document.setData(name, dataset)
 
+class OperationDataImportBinaryBlock(object):
+    """Import datasets from a binary file written when saving."""
+
+    descr = 'import binary data'
+
+    def __init__(self, filename, datasetkeys):
+        """Setup operation.
+
+        datasetkeys is a dict of dataset names to the keys of their
+        arrays in the file.
+        """
+        self.filename = filename
+        self.datasetkeys = datasetkeys
+
+    def do(self, document):
+        """Do import."""
+
+        arrays = binaryblock.loadBinaryBlock(self.filename)
+
+        # save for undoing
+        self.olddata = {}
+
+        for name, key in sorted(self.datasetkeys.iteritems()):
+            cols = {}
+            for col in ('data', 'serr', 'perr', 'nerr', 'xrange', 'yrange'):
+                cols[col] = arrays.get('%s_%s' % (key, col))
+
+            if cols['data'] is None:
+                raise RuntimeError("Dataset '%s' not found in binary file"
+                                   % name)
+            elif cols['xrange'] is not None:
+                ds = datasets.Dataset2D(data=cols['data'],
+                                        xrange=tuple(cols['xrange']),
+                                        yrange=tuple(cols['yrange']))
+            else:
+                ds = datasets.Dataset(data=cols['data'], serr=cols['serr'],
+                                      perr=cols['perr'], nerr=cols['nerr'])
+
+            if name in document.data:
+                self.olddata[name] = document.data[name]
+            document.setData(name, ds)
+
+        self.datasetnames = sorted(self.datasetkeys.keys())
+        return self.datasetnames
+
+    def undo(self, document):
+        """Undo import."""
+
+        for name in self.datasetnames:
+            del document.data[name]
+        for name, dataset in self.olddata.iteritems():
+            document.setData(name, dataset)
+
 class OperationDataCaptureSet(object):
     """An operation for setting the results from a SimpleRead into the
     docunment's data from a data capture.
@@ -1352,6 +1424,14 @@ class OperationDatasetAddColumn(object):
         setattr(ds, self.columnname, None)
         document.setData(self.datasetname, ds)
         
+def _writableColumn(ds, columnname):
+    """Get column of dataset for modifying, copying it if its values are
+    shared with another dataset."""
+    datacol = getattr(ds, columnname)
+    if isinstance(datacol, N.ndarray) and not datacol.flags.writeable:
+        datacol = N.array(datacol)
+    return datacol
+
 class OperationDatasetSetVal(object):
     """Set a value in the dataset."""
 
@@ -1367,7 +1447,7 @@ class OperationDatasetSetVal(object):
     def do(self, document):
         """Set the value."""
         ds = document.data[self.datasetname]
-        datacol = getattr(ds, self.columnname)
+        datacol = _writableColumn(ds, self.columnname)
         self.oldval = datacol[self.row]
         datacol[self.row] = self.val
         ds.changeValues(self.columnname, datacol)
@@ -1375,7 +1455,7 @@ class OperationDatasetSetVal(object):
     def undo(self, document):
         """Restore the value."""
         ds = document.data[self.datasetname]
-        datacol = getattr(ds, self.columnname)
+        datacol = _writableColumn(ds, self.columnname)
         datacol[self.row] = self.oldval
         ds.changeValues(self.columnname, datacol)
     
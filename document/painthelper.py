@@ -36,7 +36,7 @@ class DrawState(object):
     def __init__(self, widget, bounds, clip, helper):
         """Initialise state for widget.
         bounds: tuple of (x1, y1, x2, y2)
-        clip: if clipping should be done, another tuple."""
+        clip: if clipping should be done, a QRectF."""
 
         self.widget = widget
         self.record = RecordPaintDevice(
@@ -45,6 +45,9 @@ class DrawState(object):
         self.bounds = bounds
         self.clip = clip
 
+        # key identifying widget output, if it can be reused
+        self.cachekey = None
+
         # controlgraphs belonging to widget
         self.cgis = []
 
@@ -60,13 +63,17 @@ class PaintHelper(object):
     """
 
     def __init__(self, pagesize, scaling=1., dpi=(100, 100),
-                 directpaint=None):
+                 directpaint=None, previous=None):
         """Initialise using page size (tuple of pixelw, pixelh).
 
         If directpaint is set to a painter, use this directly rather
         than creating separate layers for rendering later. The user
         will need to call restore() on the painter before ending, if
         using this mode, however.
+
+        previous is an optional earlier PaintHelper. The recorded
+        output of widgets which are unchanged since it was painted is
+        reused rather than drawing them again.
         """
 
         self.dpi = dpi
@@ -84,9 +91,23 @@ class PaintHelper(object):
         self.directpaint = directpaint
         self.directpainting = False
 
+        # whether output ends up as a bitmap, rather than vector output
+        self.bitmapoutput = ( directpaint is None or
+                              isinstance(directpaint.device(),
+                                         (qt4.QImage, qt4.QPixmap)) )
+
         # state for root widget
         self.rootstate = None
 
+        # states which can be reused from the previous helper
+        self.cachedstates = {}
+        if ( previous is not None and not directpaint and
+             not previous.directpaint and
+             previous.pagesize == self.pagesize and
+             previous.scaling == self.scaling and
+             previous.dpi == self.dpi ):
+            self.cachedstates = previous.states
+
     @property
     def maxsize(self):
         """Return maximum page dimension (using PaintHelper's DPI)."""
@@ -102,11 +123,35 @@ class PaintHelper(object):
         self.pagesize = ( setting.Distance.convertDistance(self, pagew),
                           setting.Distance.convertDistance(self, pageh) )
 
+    def drawWidget(self, widget, parentposn, outerbounds=None):
+        """Draw widget inside parentposn.
+
+        If the widget has not changed since it was drawn by the
+        previous helper, its recorded output is reused.
+        """
+
+        key = None
+        if not self.directpaint:
+            key = widget.renderCacheKey(parentposn, self, outerbounds)
+
+        if key is not None:
+            state = self.cachedstates.get(widget)
+            if state is not None and state.cachekey == key:
+                self.states[widget] = state
+                self.states[widget.parent].children.append(state)
+                return state.bounds
+
+        bounds = widget.draw(parentposn, self, outerbounds=outerbounds)
+
+        if key is not None and widget in self.states:
+            self.states[widget].cachekey = key
+        return bounds
+
     def painter(self, widget, bounds, clip=None):
         """Return a painter for use when drawing the widget.
         widget: widget object
         bounds: tuple (x1, y1, x2, y2) of widget bounds
-        clip: another tuple, if set clips drawing to this rectangle
+        clip: a QRectF, if set clips drawing to this rectangle
         """
         s = self.states[widget] = DrawState(widget, bounds, clip, self)
         if widget.parent is None:
@@ -129,6 +174,7 @@ class PaintHelper(object):
         p.pixperpt = self.pixperpt
         p.pagesize = self.pagesize
         p.dpi = self.dpi[1]
+        p.bitmapoutput = self.bitmapoutput
 
         if clip:
             p.setClipRect(clip)
@@ -139,20 +185,36 @@ class PaintHelper(object):
         """Records the control graph list for the widget given."""
         self.states[widget].cgis = cgis
 
-    def renderToPainter(self, painter):
+    def renderToPainter(self, painter, callback=None, rect=None):
         """Render saved output to painter.
+
+        If set, callback() is called before the output of each widget
+        is rendered. If it returns True, rendering is stopped.
+
+        If rect (a QRectF) is given, only part of the page is being
+        rendered, so the output of widgets clipped to outside it is
+        skipped.
+
+        Returns False if rendering was stopped.
         """
-        self._renderState(self.rootstate, painter)
+        return self._renderState(self.rootstate, painter, callback, rect)
 
-    def _renderState(self, state, painter):
+    def _renderState(self, state, painter, callback, rect):
         """Render state to painter."""
 
-        painter.save()
-        state.record.play(painter)
-        painter.restore()
+        if callback is not None and callback():
+            return False
+
+        # widgets which are not clipped may draw anywhere
+        if rect is None or not state.clip or rect.intersects(state.clip):
+            painter.save()
+            state.record.play(painter)
+            painter.restore()
 
         for child in state.children:
-            self._renderState(child, painter)
+            if not self._renderState(child, painter, callback, rect):
+                return False
+        return True
 
     def identifyWidgetAtPoint(self, x, y, antialias=True):
         """What widget has drawn at the point x,y?
@@ -20,24 +20,12 @@
 in an easy-to-use manner."""
 
 from collections import defaultdict
+import itertools
 import numpy as N
 
 import datasets
 import veusz.utils as utils
 
-class _FileReaderCols(object):
-    """Read a CSV file in rows. This acts as an iterator.
-
-    This is a very simple wrapper around the csv module
-    """
-
-    def __init__(self, csvreader):
-        self.csvreader = csvreader
-
-    def next(self):
-        """Return next row."""
-        return self.csvreader.next()
-
 class _FileReaderRows(object):
     """Read a CSV file in columns. This acts as an iterator.
 
@@ -54,6 +42,9 @@ class _FileReaderRows(object):
 
         self.counter = 0
 
+    def __iter__(self):
+        return self
+
     def next(self):
         """Return the next column."""
 
@@ -71,6 +62,61 @@ class _FileReaderRows(object):
         self.counter += 1
         return retn
 
+class _ColumnData(object):
+    """Values read for a dataset.
+
+    Values are stored as a list of blocks, numeric blocks being
+    converted to numpy arrays to save memory."""
+
+    def __init__(self, numeric):
+        self.numeric = numeric
+        self.blocks = []
+        self.values = []
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def append(self, val):
+        """Append a single value."""
+        self.values.append(val)
+        self.length += 1
+
+    def extend(self, block):
+        """Append a block of values (a list or numpy array)."""
+        self.flush()
+        self.blocks.append(block)
+        self.length += len(block)
+
+    def flush(self):
+        """Move single values into a block."""
+        if self.values:
+            block = self.values
+            if self.numeric:
+                try:
+                    block = N.array(block, dtype=N.float64)
+                except (ValueError, TypeError):
+                    pass
+            self.blocks.append(block)
+            self.values = []
+
+    def toArray(self):
+        """Return values as a numpy array.
+
+        A list is returned if there are any non-numeric values."""
+        self.flush()
+        for block in self.blocks:
+            if not isinstance(block, N.ndarray):
+                return self.toList()
+        if not self.blocks:
+            return N.array([], dtype=N.float64)
+        return N.concatenate(self.blocks)
+
+    def toList(self):
+        """Return values as a list."""
+        self.flush()
+        return list( itertools.chain(*self.blocks) )
+
 # list of codes which can be added to column descriptors
 typecodes = (
     ('(string)', 'string'),
@@ -85,6 +131,9 @@ typecodes = (
 class ReadCSV(object):
     """A class to import data from CSV files."""
 
+    # number of lines converted at a time when reading columns
+    blocklines = 4096
+
     def __init__(self, filename, readrows=False, 
                  delimiter=',', textdelimiter='"',
                  encoding='utf_8',
@@ -160,8 +209,115 @@ class ReadCSV(object):
         self.nametypes[colname] = coltype
         self.colnames[colnum] = colname
         self.colignore[colnum] = self.headerignore
-        if colname not in self.data:
-            self.data[colname] = []
+        if colname not in self.data or len(self.data[colname]) == 0:
+            self.data[colname] = _ColumnData(coltype != 'string')
+
+    def _readLine(self, line):
+        """Read the items from a line (or column)."""
+
+        # iterate over items on line
+        for colnum, col in enumerate(line):
+
+            if colnum >= len(self.coltypes) or self.coltypes[colnum] == '':
+                ctype = 'float'
+            else:
+                ctype = self.coltypes[colnum]
+
+            # ignore lines after headers
+            if colnum < len(self.coltypes) and self.colignore[colnum] > 0:
+                self.colignore[colnum] -= 1
+                continue
+
+            try:
+                # do any necessary conversion
+                if ctype == 'float':
+                    v = float(col)
+                elif ctype == 'date':
+                    v = utils.dateStringToDate(col)
+                elif ctype == 'string':
+                    v = col
+                else:
+                    raise RuntimeError, "Invalid type in CSV reader"
+
+            except ValueError:
+                if col.strip() == '':
+                    # skip blanks unless blanksaredata is set
+                    if self.blanksaredata and colnum < len(self.colnames):
+                        # assumes a numeric data type
+                        self.data[self.colnames[colnum]].append(N.nan)
+                elif ( colnum in self.colnames and
+                     len(self.data[self.colnames[colnum]]) == 0 ):
+                    # if dataset is empty, convert to a string dataset
+                    self._setNameAndType(colnum, self.colnames[colnum], 'string')
+                    self.data[self.colnames[colnum]].append(col)
+                else:
+                    # start a new dataset if conversion failed
+                    coltype, name = self._getNameAndColType(colnum, col)
+                    self._setNameAndType(colnum, name.strip(), coltype)
+
+            else:
+                # generate a name if required
+                if colnum not in self.colnames:
+                    self._setNameAndType(colnum, self._generateName(colnum),
+                                         'float')
+
+                # conversion okay
+                # append number to data
+                coldata = self.data[self.colnames[colnum]]
+                coldata.append(v)
+
+    def _readBlock(self, block):
+        """Read a block of lines, converting whole columns at once.
+
+        This is only possible if the lines have the same number of
+        items and each column converts to its current type without
+        any headers or blanks. Returns False if the block has to be
+        read line by line instead.
+        """
+
+        ncols = len(block[0])
+        for line in block:
+            if len(line) != ncols:
+                return False
+
+        names = []
+        blockvals = []
+        for colnum, vals in enumerate( itertools.izip(*block) ):
+            if colnum < len(self.coltypes) and self.colignore[colnum] > 0:
+                return False
+
+            if colnum in self.colnames:
+                name = self.colnames[colnum]
+                ctype = self.coltypes[colnum]
+            elif self.headerignore == 0:
+                # a name is generated for a new column, as in _readLine
+                name = self._generateName(colnum)
+                ctype = 'float'
+            else:
+                return False
+
+            try:
+                if ctype == 'float':
+                    vals = N.array(vals, dtype=N.float64)
+                elif ctype == 'date':
+                    vals = utils.dateStringsToFloats(vals)
+                else:
+                    vals = list(vals)
+            except ValueError:
+                return False
+
+            names.append(name)
+            blockvals.append(vals)
+
+        # columns writing to the same dataset are interleaved by line
+        if len(set(names)) != len(names):
+            return False
+
+        for colnum, (name, vals) in enumerate(itertools.izip(names, blockvals)):
+            if colnum not in self.colnames:
+                self._setNameAndType(colnum, name, 'float')
+            self.data[name].extend(vals)
+        return True
 
     def readData(self):
         """Read the data into the document."""
@@ -172,12 +328,6 @@ class ReadCSV(object):
                                        quotechar=self.textdelimiter,
                                        encoding=self.encoding )
 
-        # make in iterator for the file
-        if self.readrows:
-            it = _FileReaderRows(csvf)
-        else:
-            it = _FileReaderCols(csvf)
-
         # dataset names for each column
         self.colnames = {}
         # type of column (float, string or date)
@@ -187,63 +337,22 @@ class ReadCSV(object):
         # ignore lines after headers
         self.colignore = defaultdict(lambda: int(self.headerignore))
 
-        # iterate over each line (or column)
-        while True:
-            try:
-                line = it.next()
-            except StopIteration:
-                break
-
-            # iterate over items on line
-            for colnum, col in enumerate(line):
-
-                if colnum >= len(self.coltypes) or self.coltypes[colnum] == '':
-                    ctype = 'float'
-                else:
-                    ctype = self.coltypes[colnum]
-
-                # ignore lines after headers
-                if colnum < len(self.coltypes) and self.colignore[colnum] > 0:
-                    self.colignore[colnum] -= 1
-                    continue
-
-                try:
-                    # do any necessary conversion
-                    if ctype == 'float':
-                        v = float(col)
-                    elif ctype == 'date':
-                        v = utils.dateStringToDate(col)
-                    elif ctype == 'string':
-                        v = col
-                    else:
-                        raise RuntimeError, "Invalid type in CSV reader"
-
-                except ValueError:
-                    if col.strip() == '':
-                        # skip blanks unless blanksaredata is set
-                        if self.blanksaredata and colnum < len(self.colnames):
-                            # assumes a numeric data type
-                            self.data[self.colnames[colnum]].append(N.nan)
-                    elif ( colnum in self.colnames and
-                         len(self.data[self.colnames[colnum]]) == 0 ):
-                        # if dataset is empty, convert to a string dataset
-                        self._setNameAndType(colnum, self.colnames[colnum], 'string')
-                        self.data[self.colnames[colnum]].append(col)
-                    else:
-                        # start a new dataset if conversion failed
-                        coltype, name = self._getNameAndColType(colnum, col)
-                        self._setNameAndType(colnum, name.strip(), coltype)
-
-                else:
-                    # generate a name if required
-                    if colnum not in self.colnames:
-                        self._setNameAndType(colnum, self._generateName(colnum),
-                                             'float')
-
-                    # conversion okay
-                    # append number to data
-                    coldata = self.data[self.colnames[colnum]]
-                    coldata.append(v)
+        if self.readrows:
+            # iterate over each column
+            for line in _FileReaderRows(csvf):
+                self._readLine(line)
+        else:
+            # read the file a block of lines at a time, so that columns
+            # can be converted together without keeping the text in memory
+            while True:
+                block = list( itertools.islice(csvf, self.blocklines) )
+                if not block:
+                    break
+                if not self._readBlock(block):
+                    for line in block:
+                        self._readLine(line)
+                for coldata in self.data.itervalues():
+                    coldata.flush()
 
     def setData(self, document, linkedfile=None):
         """Set the read-in datasets in the document."""
@@ -259,9 +368,16 @@ class ReadCSV(object):
             dsnames.append(name)
 
             # get data and errors (if any)
+            dstype = self.nametypes[name]
             data = []
             for k in (name, name+'+-', name+'+', name+'-'):
-                data.append( self.data.get(k, None) )
+                coldata = self.data.get(k, None)
+                if coldata is not None:
+                    if dstype == 'string' and k == name:
+                        coldata = coldata.toList()
+                    else:
+                        coldata = coldata.toArray()
+                data.append(coldata)
 
             # make them have a maximum length by adding NaNs
             maxlen = max([len(x) for x in data if x is not None])
@@ -271,7 +387,6 @@ class ReadCSV(object):
                         ( data[i], N.zeros(maxlen-len(data[i]))*N.nan ) )
 
             # create dataset
-            dstype = self.nametypes[name]
             if dstype == 'string':
                 ds = datasets.DatasetText(data=data[0], linked=linkedfile)
             elif dstype == 'date':
@@ -34,6 +34,8 @@ class SelfTestPaintEngine(svg_export.SVGPaintEngine):
         svg_export.SVGPaintEngine.__init__(self, width_in, height_in)
         # ppm images are simple and should be same on all platforms
         self.imageformat = 'ppm'
+        # keep output the same as the comparison files
+        self.compatmode = True
 
     def drawTextItem(self, pt, textitem):
         """Write text directly in self test mode."""
@@ -151,6 +151,10 @@ $
 # a line starting with text
 text_start_re = re.compile( r'^[A-Za-z]' )
 
+# a line which can be split on whitespace without using split_re
+# (no quotes, comments, backticks or continuations)
+numeric_line_re = re.compile( r'^[0-9A-Za-z.+\- \t\r\n]*$' )
+
 # convert data type strings in descriptor to internal datatype
 datatype_name_convert = {
     'float': 'float',
@@ -383,6 +387,11 @@ class Stream(object):
         StopIteration is raised if there is no more data."""
         pass
 
+    def splitLine(self, line):
+        """Split a line into its items, removing comments."""
+        return [ x for x in self.split_re.findall(line) if
+                 x[0] not in '#!%;' ]
+
     def newLine(self):
         """Read in, and split the next line."""
 
@@ -395,8 +404,7 @@ class Stream(object):
                 return False
 
             # break up and append to buffer (removing comments)
-            self.remainingline += [ x for x in self.split_re.findall(line) if
-                                    x[0] not in '#!%;' ]
+            self.remainingline += self.splitLine(line)
 
             if self.remainingline and self.remainingline[-1] == '\\':
                 # this is a continuation: drop this item and read next line
@@ -433,7 +441,10 @@ class SimpleRead(object):
 
     tail attribute if set says to only use last tail data points when setting
     '''
-    
+
+    # number of lines converted at once when reading purely numeric data
+    numericblocksize = 4096
+
     def __init__(self, descriptor):
         self._parseDescriptor(descriptor)
         self.clearState()
@@ -469,7 +480,15 @@ class SimpleRead(object):
         allparts = self.parts
 
         # loop over lines
-        while stream.newLine():
+        while True:
+            if self._isNumericDescriptor():
+                # read numeric lines in blocks, stopping at a line which
+                # needs to be interpreted below
+                if not self._readNumericLines(stream):
+                    break
+            elif not stream.newLine():
+                break
+
             if stream.remainingline[:1] == ['descriptor']:
                 # a change descriptor statement
                 descriptor =  ' '.join(stream.remainingline[1:])
@@ -492,6 +511,120 @@ class SimpleRead(object):
         self.parts = allparts
         self.blocks = None
 
+    def _isNumericDescriptor(self):
+        """Are all the current descriptor parts numeric?"""
+        for p in self.parts:
+            if p.datatype not in (None, 'float'):
+                return False
+        return len(self.parts) > 0
+
+    def _numericColumns(self, numcols):
+        """Get list of (part, dataset name) for the first numcols
+        columns of a line."""
+
+        columns = []
+        for p in self.parts:
+            for index in xrange(p.startindex, p.stopindex+1):
+                if p.single:
+                    name = p.name
+                else:
+                    name = '%s_%i' % (p.name, index)
+                for col in p.columns:
+                    if len(columns) == numcols:
+                        return columns
+                    columns.append( (p, '%s\0%s' % (name, col)) )
+        return columns
+
+    def _readNumericLines(self, stream):
+        """Read lines of numeric data from the stream, converting them
+        in blocks.
+
+        Reading stops at a line which cannot be read this way, which is
+        left split in the stream. Returns False if the end of the
+        stream was reached."""
+
+        lines = []
+        try:
+            while True:
+                try:
+                    line = stream.readLine()
+                except StopIteration:
+                    return False
+
+                if numeric_line_re.match(line):
+                    items = line.split()
+                    if ( items and items[0] != 'descriptor' and
+                         not (self.ignoretext and
+                              text_start_re.match(items[0])) ):
+                        lines.append(items)
+                        if len(lines) == self.numericblocksize:
+                            self._readNumericBlock(stream, lines)
+                        continue
+                    elif not items:
+                        # blank lines contain no data
+                        continue
+
+                # this line needs processing item by item
+                self._readNumericBlock(stream, lines)
+                stream.remainingline = stream.splitLine(line)
+                if stream.remainingline[-1:] == ['\\']:
+                    # continuation, so read the rest of the line
+                    stream.remainingline.pop()
+                    if not stream.newLine():
+                        return False
+                return True
+        finally:
+            # make sure lines already read are not lost (e.g. a capture
+            # stream stopping)
+            self._readNumericBlock(stream, lines)
+
+    def _readNumericBlock(self, stream, lines):
+        """Convert a list of numeric lines (split into items) into
+        datasets, a run of lines with the same number of items at a
+        time."""
+
+        start = 0
+        while start < len(lines):
+            numcols = len(lines[start])
+            end = start + 1
+            while end < len(lines) and len(lines[end]) == numcols:
+                end += 1
+            run = lines[start:end]
+            start = end
+
+            try:
+                if not self._isNumericDescriptor():
+                    # a type was guessed as non-numeric in a previous run
+                    raise ValueError
+                vals = N.array(run, dtype=N.float64)
+            except ValueError:
+                # invalid values, so convert these one at a time
+                for items in run:
+                    stream.remainingline = list(items)
+                    for p in self.parts:
+                        p.readFromStream(stream, self.datasets)
+                    stream.flushLine()
+                continue
+
+            # columns for each dataset (ignored columns can share names)
+            names = []
+            indices = {}
+            for i, (part, name) in enumerate(self._numericColumns(numcols)):
+                part.datatype = 'float'
+                if name not in indices:
+                    names.append(name)
+                    indices[name] = []
+                indices[name].append(i)
+
+            for name in names:
+                try:
+                    dataset = self.datasets[name]
+                except KeyError:
+                    dataset = self.datasets[name] = []
+                dataset.extend( vals[:,indices[name]].ravel().tolist() )
+
+        del lines[:]
+
     def _readDataBlocked(self, stream, ignoretext):
         """Read in the data, using blocks."""
 
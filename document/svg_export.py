@@ -20,6 +20,8 @@
 and exporting text as paths for WYSIWYG."""
 
 import sys
+import re
+import numpy as N
 import veusz.qtall as qt4
 
 dpi = 90.
@@ -50,6 +52,75 @@ def fltStr(v, prec=2):
         val = '0'
     return val
 
+# for removing trailing zeros, decimal points and minus signs
+_trailingzeros_re = re.compile(r'(\.[0-9]*?)0+(?![0-9])')
+_trailingpoint_re = re.compile(r'\.(?![0-9])')
+_minuszero_re = re.compile(r'-0(?![.0-9])')
+
+def pointsStr(xvals, yvals, prefix=None, sep=''):
+    """Return string of points x,y separated by sep, using two decimal
+    places and removing trailing zeros.
+
+    If prefix is given, it is a list of strings to put before each
+    point. The points are formatted together rather than calling
+    fltStr for each value, so values are rounded normally."""
+
+    xy = N.column_stack( (xvals, yvals) ).astype(N.float64)
+    if prefix is None:
+        fmt = sep.join( ['%.2f,%.2f']*len(xy) )
+    else:
+        fmt = sep.join( [p + '%.2f,%.2f' for p in prefix] )
+
+    return _cleanNumbers( fmt % tuple(xy.ravel().tolist()) )
+
+def _cleanNumbers(text):
+    """Remove trailing zeros, decimal points and minus signs from
+    numbers formatted with %.2f in text."""
+    text = _trailingzeros_re.sub(r'\1', text)
+    text = _trailingpoint_re.sub('', text)
+    return _minuszero_re.sub('0', text)
+
+# number of marker uses to keep before writing them
+_maxuses = 4096
+
+# commands for each type of element in a path
+_pathcmds = {
+    qt4.QPainterPath.MoveToElement: 'm',
+    qt4.QPainterPath.LineToElement: 'l',
+    qt4.QPainterPath.CurveToElement: 'c',
+    qt4.QPainterPath.CurveToDataElement: ',',
+    }
+
+def createPathFast(path, scale):
+    """Convert qt path to svg path, formatting the coordinates together.
+
+    This produces the same output as createPath, except for the
+    rounding of the coordinates."""
+
+    count = path.elementCount()
+    if count == 0:
+        return ''
+
+    elements = [path.elementAt(i) for i in xrange(count)]
+    cmds = [_pathcmds[e.type] for e in elements]
+    xy = N.array([(e.x, e.y) for e in elements])*scale
+
+    # coordinates are relative to the end of the previous segment,
+    # where the last index is an origin at 0,0
+    xy = N.vstack( (xy, [[0., 0.]]) )
+    origin = N.zeros(count, dtype=N.intc)
+    last = count
+    for i, cmd in enumerate(cmds):
+        if cmd == 'c':
+            origin[i:i+3] = last
+            last = i+2
+        elif cmd != ',':
+            origin[i] = last
+            last = i
+    delta = xy[:count] - xy[origin]
+
+    return pointsStr(delta[:,0], delta[:,1], prefix=cmds)
+
 def createPath(path, scale):
     """Convert qt path to svg path.
 
@@ -105,6 +176,10 @@ class SVGPaintEngine(qt4.QPaintEngine):
 
         self.imageformat = 'png'
 
+        # compatibility mode writes the same output as older versions,
+        # formatting coordinates individually and not sharing paths
+        self.compatmode = False
+
     def begin(self, paintdevice):
         """Start painting."""
         self.device = paintdevice
@@ -115,6 +190,13 @@ class SVGPaintEngine(qt4.QPaintEngine):
         self.clippath = None
         self.clipnum = 0
         self.existingclips = {}
+        # paths which are reused with different translations
+        self.existingpaths = {}
+        # last reused path and its number, and (number, x, y) for
+        # each use not yet written
+        self.lastpath = None
+        self.lastpathnum = None
+        self.uses = []
         self.matrix = qt4.QMatrix()
         
         self.lastclip = None
@@ -140,6 +222,8 @@ class SVGPaintEngine(qt4.QPaintEngine):
         return True
 
     def end(self):
+        self.writeUses()
+
         # close any existing groups
         if self.laststate is not None:
             self.fileobj.write('</g>\n')
@@ -190,8 +274,11 @@ class SVGPaintEngine(qt4.QPaintEngine):
         if ss & qt4.QPaintEngine.DirtyTransform:
             self.matrix = state.matrix()
 
-    def getSVGState(self):
-        """Get state as svg group."""
+    def getSVGState(self, notranslate=False):
+        """Get state as svg group.
+
+        If notranslate is set, any translation is not included in
+        the state."""
         # these are the values to write into the attribute
         vals = {}
 
@@ -248,8 +335,9 @@ class SVGPaintEngine(qt4.QPaintEngine):
             m = self.matrix
             dx, dy = m.dx(), m.dy()
             if (m.m11(), m.m12(), m.m21(), m.m22()) == (1., 0., 0., 1):
-                vals['transform'] = 'translate(%s, %s)' % (fltStr(dx),
-                                                           fltStr(dy))
+                if not notranslate:
+                    vals['transform'] = 'translate(%s, %s)' % (
+                        fltStr(dx), fltStr(dy))
             else:
                 vals['transform'] = 'matrix(%s %s %s %s %s %s)' % (
                     fltStr(m.m11(), 4), fltStr(m.m12(), 4),
@@ -284,26 +372,33 @@ class SVGPaintEngine(qt4.QPaintEngine):
 
         return '<g clip-path="%s">\n' % url
 
-    def doStateUpdate(self):
+    def doStateUpdate(self, notranslate=False):
         """Handle changes of state, starting and stopping
-        groups to modify clipping and attributes."""
+        groups to modify clipping and attributes.
+
+        notranslate is set when drawing reused paths, which can be
+        added to any uses not yet written if the state is unchanged."""
+        if not notranslate:
+            self.writeUses()
         if not self.updatedstate:
             return
 
         clipgrp = self.getClipState()
-        state = self.getSVGState()
+        state = self.getSVGState(notranslate=notranslate)
 
         if clipgrp == self.lastclip and state == self.laststate:
             # do nothing if everything is unchanged
             pass
         elif clipgrp == self.lastclip:
             # if state has only changed
+            self.writeUses()
             if self.laststate is not None:
                 self.fileobj.write('</g>\n')
             self.fileobj.write(state)
             self.laststate = state
         else:
             # clip and state have changed
+            self.writeUses()
             if self.laststate is not None:
                 self.fileobj.write('</g>\n')
             if self.lastclip is not None:
@@ -314,23 +409,82 @@ class SVGPaintEngine(qt4.QPaintEngine):
             self.laststate = state
             self.lastclip = clipgrp
 
+    def isTranslation(self):
+        """Is the current matrix only a translation?"""
+        m = self.matrix
+        return ( (m.m11(), m.m12(), m.m21(), m.m22()) == (1., 0., 0., 1.) and
+                 (m.dx(), m.dy()) != (0., 0.) )
+
     def drawPath(self, path):
         """Draw a path on the output."""
-        self.doStateUpdate()
-        p = createPath(path, 1.)
+
+        if self.compatmode:
+            self.doStateUpdate()
+            p = createPath(path, 1.)
+        else:
+            if self.isTranslation():
+                # translated paths are usually markers, so are written
+                # once and reused, rather than changing the state
+                self.drawTranslatedPath(path)
+                return
+            self.doStateUpdate()
+            p = createPathFast(path, 1.)
 
         self.fileobj.write('<path d="%s"' % p)
         if path.fillRule() == qt4.Qt.WindingFill:
             self.fileobj.write(' fill-rule="nonzero"')
         self.fileobj.write('/>\n')
 
+    def drawTranslatedPath(self, path):
+        """Draw path with the current translation, referring to a
+        path in the defs section."""
+        self.doStateUpdate(notranslate=True)
+
+        # markers are drawn with the same path many times, which is
+        # quicker to compare with the last path than to convert
+        if self.lastpath is None or path != self.lastpath:
+            key = (createPathFast(path, 1.),
+                   path.fillRule() == qt4.Qt.WindingFill)
+            if key in self.existingpaths:
+                num = self.existingpaths[key]
+            else:
+                num = len(self.existingpaths)
+                self.existingpaths[key] = num
+                fillrule = ''
+                if key[1]:
+                    fillrule = ' fill-rule="nonzero"'
+                self.defs.append('<path id="p%i" d="%s"%s/>\n' % (
+                        num, key[0], fillrule))
+            self.lastpath = qt4.QPainterPath(path)
+            self.lastpathnum = num
+
+        self.uses.append( (self.lastpathnum, self.matrix.dx(),
+                           self.matrix.dy()) )
+        if len(self.uses) >= _maxuses:
+            self.writeUses()
+
+    def writeUses(self):
+        """Write uses of paths kept by drawTranslatedPath, formatting
+        their coordinates together."""
+        if not self.uses:
+            return
+
+        fmt = ''.join( ['<use xlink:href="#p%i" x="%%.2f" y="%%.2f"/>\n' %
+                        u[0] for u in self.uses] )
+        xy = N.array(self.uses)[:,1:]
+        self.fileobj.write( _cleanNumbers(fmt % tuple(xy.ravel().tolist())) )
+        self.uses = []
+
     def drawTextItem(self, pt, textitem):
         """Convert text to a path and draw it.
         """
         self.doStateUpdate()
         path = qt4.QPainterPath()
         path.addText(pt, textitem.font(), textitem.text())
-        p = createPath(path, 1.)
+        if self.compatmode:
+            p = createPath(path, 1.)
+        else:
+            p = createPathFast(path, 1.)
         self.fileobj.write('<path d="%s" fill="%s" stroke="none" '
                            'fill-opacity="%.3g"/>\n' % (
                 p, self.pen.color().name(), self.pen.color().alphaF() ))
@@ -338,29 +492,41 @@ class SVGPaintEngine(qt4.QPaintEngine):
     def drawLines(self, lines):
         """Draw multiple lines."""
         self.doStateUpdate()
-        paths = []
-        for line in lines:
-            path = 'M%s,%sl%s,%s' % (
-                fltStr(line.x1()), fltStr(line.y1()),
-                fltStr(line.x2()-line.x1()),
-                fltStr(line.y2()-line.y1()))
-            paths.append(path)
-        self.fileobj.write('<path d="%s"/>\n' % (''.join(paths)))
+        if self.compatmode:
+            paths = []
+            for line in lines:
+                path = 'M%s,%sl%s,%s' % (
+                    fltStr(line.x1()), fltStr(line.y1()),
+                    fltStr(line.x2()-line.x1()),
+                    fltStr(line.y2()-line.y1()))
+                paths.append(path)
+            path = ''.join(paths)
+        else:
+            # start and relative end point of each line
+            pts = N.array([(l.x1(), l.y1(), l.x2()-l.x1(), l.y2()-l.y1())
+                           for l in lines]).reshape( (-1, 2) )
+            prefix = ['M', 'l']*len(lines)
+            path = pointsStr(pts[:,0], pts[:,1], prefix=prefix)
+        self.fileobj.write('<path d="%s"/>\n' % path)
 
     def drawPolygon(self, points, mode):
         """Draw polygon on output."""
         self.doStateUpdate()
-        pts = []
-        for p in points:
-            pts.append( '%s,%s' % (fltStr(p.x()), fltStr(p.y())) )
+        if self.compatmode:
+            pts = []
+            for p in points:
+                pts.append( '%s,%s' % (fltStr(p.x()), fltStr(p.y())) )
+            pts = ' '.join(pts)
+        else:
+            xy = N.array([(p.x(), p.y()) for p in points]).reshape( (-1, 2) )
+            pts = pointsStr(xy[:,0], xy[:,1], sep=' ')
 
         if mode == qt4.QPaintEngine.PolylineMode:
             self.fileobj.write('<polyline fill="none" points="%s"/>\n' %
-                               ' '.join(pts))
+                               pts)
 
         else:
-            self.fileobj.write('<polygon points="%s"' %
-                               ' '.join(pts))
+            self.fileobj.write('<polygon points="%s"' % pts)
             if mode == qt4.Qt.WindingFill:
                 self.fileobj.write(' fill-rule="nonzero"')
             self.fileobj.write('/>\n')
@@ -37,6 +37,11 @@ time.sleep(60)
 g.Close()
 
 More than one embedded window can be opened at once
+
+If pipeline=True is passed to Embedded, commands which do not return
+values (e.g. Set and SetData) do not wait for the remote process to
+finish them. Any error in these commands is raised by the next
+command which waits.
 """
 
 import atexit
@@ -48,11 +53,20 @@ import new
 import cPickle
 import socket
 import subprocess
+import tempfile
 import time
 import uuid
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # check remote process has this API version
-API_VERSION = 1
+API_VERSION = 2
+
+# marker for a numpy array sent in a file rather than in the command
+SHARED_ARRAY = '__veusz_shared_array__'
 
 def Bind1st(function, arg):
     """Bind the first argument of a given function to the given
@@ -81,13 +95,26 @@ class Embedded(object):
 
     remote = None
 
-    def __init__(self, name = 'Veusz', copyof = None):
+    # arrays at least this size in bytes are sent using a file
+    sharedarraysize = 262144
+
+    # commands without return values which are not waited for in
+    # pipelined mode
+    pipelinecommands = ('Set', 'SetData', 'SetData2D', 'SetDataExpression',
+                        'SetDataRange', 'SetDataText', 'SetToReference',
+                        'To', 'Remove')
+
+    def __init__(self, name = 'Veusz', copyof = None, pipeline = False):
         """Initialse the embedded veusz window.
 
         name is the name of the window to show.
+        If pipeline is True, do not wait for commands which do not
+        return values (the pipeline attribute can also be changed)
         This method creates a new thread to run Qt if necessary
         """
 
+        self.pipeline = pipeline
+
         if not Embedded.remote:
             Embedded.startRemote()
 
@@ -266,10 +293,14 @@ class Embedded(object):
     @staticmethod
     def readLenFromSocket(socket, length):
         """Read length bytes from socket."""
-        s = ''
-        while len(s) < length:
-            s += socket.recv(length-len(s))
-        return s
+        chunks = []
+        while length > 0:
+            chunk = socket.recv(min(length, 1048576))
+            if not chunk:
+                raise RuntimeError, "Connection to remote Veusz closed"
+            chunks.append(chunk)
+            length -= len(chunk)
+        return ''.join(chunks)
 
     @staticmethod
     def writeToSocket(socket, data):
@@ -278,13 +309,46 @@ class Embedded(object):
             count += socket.send(data[count:])
 
     @classmethod
-    def sendCommand(cls, cmd):
-        """Send the command to the remote process."""
+    def shareArray(cls, val):
+        """If val is a large numpy array, write it to a temporary file
+        to be mapped by the remote process, returning a description of
+        the file. Otherwise val is returned."""
+
+        if ( numpy is None or not isinstance(val, numpy.ndarray) or
+             val.nbytes < cls.sharedarraysize or val.dtype.hasobject ):
+            return val
+
+        # use shared memory for the file if possible
+        shmdir = None
+        if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+            shmdir = '/dev/shm'
+
+        fd, filename = tempfile.mkstemp(prefix='veusz_embed_', dir=shmdir)
+        f = os.fdopen(fd, 'wb')
+        try:
+            numpy.ascontiguousarray(val).tofile(f)
+        finally:
+            f.close()
+        return (SHARED_ARRAY, filename, val.dtype.str, val.shape)
 
-        outs = cPickle.dumps(cmd)
+    @classmethod
+    def sendCommand(cls, cmd, reply=True):
+        """Send the command to the remote process.
+
+        If reply is False, do not wait for the command to finish."""
+
+        window, name, args, argsv = cmd
+        args = tuple([cls.shareArray(a) for a in args])
+        argsv = dict([(k, cls.shareArray(v)) for k, v in argsv.iteritems()])
 
-        cls.writeToSocket( cls.serv_socket, struct.pack('<I', len(outs)) )
-        cls.writeToSocket( cls.serv_socket, outs )
+        outs = cPickle.dumps( (window, name, args, argsv, reply),
+                              cPickle.HIGHEST_PROTOCOL )
+
+        cls.writeToSocket( cls.serv_socket,
+                           struct.pack('<I', len(outs)) + outs )
+
+        if not reply:
+            return None
 
         backlen = struct.unpack('<I', cls.readLenFromSocket(cls.serv_socket,
                                                             cls.cmdlen))[0]
@@ -298,7 +362,9 @@ class Embedded(object):
     def runCommand(self, cmd, *args, **args2):
         """Execute the given function in the Qt thread with the arguments
         given."""
-        return self.sendCommand( (self.winno, cmd, args[1:], args2) )
+        reply = not (self.pipeline and cmd in self.pipelinecommands)
+        return self.sendCommand( (self.winno, cmd, args[1:], args2),
+                                 reply=reply )
 
     @classmethod
     def exitQt(cls):
@@ -17,9 +17,14 @@
 ##############################################################################
 
 import sys
+import os
 import struct
 import cPickle
 import socket
+import select
+import time
+
+import numpy as N
 
 import veusz.qtall as qt4
 from veusz.windows.simplewindow import SimpleWindow
@@ -28,7 +33,39 @@ import veusz.document as document
 """Program to be run by embedding interface to run Veusz commands."""
 
 # embed.py module checks this is the same as its version number
-API_VERSION = 1
+API_VERSION = 2
+
+# marker for a numpy array sent in a file (see embed.py)
+SHARED_ARRAY = '__veusz_shared_array__'
+
+def unshareArray(val):
+    """Return array for a file description made by embed.shareArray.
+    The file is deleted after being mapped.
+
+    If val is not a description, val is returned."""
+
+    if not ( isinstance(val, tuple) and len(val) == 4 and
+             val[0] == SHARED_ARRAY ):
+        return val
+
+    filename, dtype, shape = val[1:]
+    try:
+        if N.product(shape) == 0:
+            # zero length files cannot be mapped
+            return N.zeros(shape, dtype=dtype)
+
+        # mapped copy-on-write, so that changes are not written to the file
+        array = N.memmap(filename, dtype=dtype, mode='c', shape=shape)
+        try:
+            os.unlink(filename)
+        except OSError:
+            # mapped files cannot be removed on Windows
+            array = N.array(array)
+            os.unlink(filename)
+        return array
+    finally:
+        if os.path.exists(filename):
+            os.unlink(filename)
 
 class EmbeddedClient(object):
     """An object for each instance of embedded window with document."""
@@ -157,6 +194,10 @@ class EmbedApplication(qt4.QApplication):
     # lengths of lengths sent to application
     cmdlenlen = struct.calcsize('<I')
 
+    # maximum time to spend running waiting commands before letting
+    # the event loop run (e.g. to redraw windows)
+    commandtime = 0.05
+
     def __init__(self, socket, args):
         qt4.QApplication.__init__(self, args)
         self.socket = socket
@@ -171,12 +212,19 @@ class EmbedApplication(qt4.QApplication):
         self.clients = {}
         self.clientcounter = 0
 
+        # error from a command the embed process did not wait for
+        self.pendingerror = None
+
     def readLenFromSocket(thesocket, length):
         """Read length bytes from socket."""
-        s = ''
-        while len(s) < length:
-            s += thesocket.recv(length-len(s))
-        return s
+        chunks = []
+        while length > 0:
+            chunk = thesocket.recv(min(length, 1048576))
+            if not chunk:
+                raise RuntimeError, "Connection to embedding process closed"
+            chunks.append(chunk)
+            length -= len(chunk)
+        return ''.join(chunks)
     readLenFromSocket = staticmethod(readLenFromSocket)
 
     def writeToSocket(thesocket, data):
@@ -211,18 +259,14 @@ class EmbedApplication(qt4.QApplication):
     def writeOutput(self, output):
         """Send output back to embed process."""
         # format return data
-        outstr = cPickle.dumps(output)
+        outstr = cPickle.dumps(output, cPickle.HIGHEST_PROTOCOL)
 
         # send return data to stdout
-        self.writeToSocket( self.socket, struct.pack('<I', len(outstr)) )
-        self.writeToSocket( self.socket, outstr )
+        self.writeToSocket( self.socket,
+                            struct.pack('<I', len(outstr)) + outstr )
 
-    def slotDataToRead(self, socketfd):
-        self.notifier.setEnabled(False)
-        self.socket.setblocking(1)
-        
-        # unpickle command and arguments
-        window, cmd, args, argsv = self.readCommand(self.socket)
+    def runCommand(self, window, cmd, args, argsv):
+        """Run a command, returning its return value or exception."""
 
         if cmd == '_NewWindow':
             retval = self.makeNewClient(args[0])
@@ -239,20 +283,54 @@ class EmbedApplication(qt4.QApplication):
 
             # window commands
             try:
+                args = [unshareArray(a) for a in args]
+                argsv = dict([(k, unshareArray(v))
+                              for k, v in argsv.iteritems()])
+
                 if cmd not in interpreter.cmds:
                     raise AttributeError, "No Veusz command %s" % cmd
 
                 retval = interpreter.cmds[cmd](*args, **argsv)
             except Exception, e:
                 retval = e
+        return retval
 
-        self.writeOutput(retval)
+    def slotDataToRead(self, socketfd):
+        self.notifier.setEnabled(False)
+        self.socket.setblocking(1)
 
-        # do quit after if requested
-        if cmd == '_Quit':
-            self.socket.shutdown(socket.SHUT_RDWR)
-            self.closeAllWindows()
-            self.quit()
+        # run the commands which are waiting, so that commands sent
+        # without waiting for replies are processed together, until
+        # the event loop needs to run (the notifier is triggered
+        # again if there are commands left)
+        stoptime = time.time() + self.commandtime
+        while True:
+            # unpickle command and arguments
+            window, cmd, args, argsv, reply = self.readCommand(self.socket)
+            retval = self.runCommand(window, cmd, args, argsv)
+
+            if not reply:
+                # keep first error to send with next reply
+                if ( isinstance(retval, Exception) and
+                     self.pendingerror is None ):
+                    self.pendingerror = retval
+            else:
+                if ( self.pendingerror is not None and
+                     not isinstance(retval, Exception) ):
+                    retval = self.pendingerror
+                self.pendingerror = None
+                self.writeOutput(retval)
+
+            # do quit after if requested
+            if cmd == '_Quit':
+                self.socket.shutdown(socket.SHUT_RDWR)
+                self.closeAllWindows()
+                self.quit()
+                return
+
+            if ( time.time() > stoptime or
+                 not select.select([self.socket], [], [], 0)[0] ):
+                break
 
         self.socket.setblocking(0)
         self.notifier.setEnabled(True)
@@ -256,6 +256,7 @@ struct Csite
     /* making the actual marks requires a bunch of other stuff */
     const double *x, *y, *z;    /* mesh coordinates and function values */
     double *xcp, *ycp;          /* output contour points */
+    int fixedtri;               /* triangle array will not be modified */
 };
 
 #if 0
@@ -1287,6 +1288,7 @@ cntr_new(void)
     site->data = NULL;
     site->reg = NULL;
     site->triangle = NULL;
+    site->fixedtri = 0;
     site->xcp = NULL;
     site->ycp = NULL;
     site->x = NULL;
@@ -1305,16 +1307,12 @@ cntr_init(Csite *site, long iMax, long jMax, double *x, double *y,
 
     site->imax = iMax;
     site->jmax = jMax;
-    site->data = (Cdata *) PyMem_Malloc(sizeof(Cdata) * nreg);
-    if (site->data == NULL)
-    {
-        PyMem_Free(site);
-        return -1;
-    }
+    /* the data array is allocated for each trace */
+    site->data = NULL;
+    site->fixedtri = 0;
     site->triangle = (short *) PyMem_Malloc(sizeof(short) * ijmax);
     if (site->triangle == NULL)
     {
-        PyMem_Free(site->data);
         PyMem_Free(site);
         return -1;
     }
@@ -1326,7 +1324,6 @@ cntr_init(Csite *site, long iMax, long jMax, double *x, double *y,
         if (site->reg == NULL)
         {
             PyMem_Free(site->triangle);
-            PyMem_Free(site->data);
             PyMem_Free(site);
             return -1;
         }
@@ -1460,15 +1457,25 @@ build_cntr_list_v2(long *np, double *xp, double *yp, int nparts, long ntotal)
    is 2, the set of polygons bounded by the levels will be returned.
    If points is True, the lines will be returned as a list of list
    of points; otherwise, as a list of tuples of vectors.
+
+   The trace works on a copy of the mesh site with its own data array,
+   so several levels can be traced at the same time. If the
+   triangulation has been fixed, the triangle array is not modified
+   and the global interpreter lock is released while tracing.
 */
 
 static PyObject *
-cntr_trace(Csite *site, double levels[], int nlevels, int points, long nchunk)
+cntr_trace(Csite *mesh, double levels[], int nlevels, int points, long nchunk)
 {
-    PyObject *c_list;
-    double *xp0;
-    double *yp0;
-    long *nseg0;
+    PyObject *c_list = NULL;
+    PyObject *errtype = NULL;
+    const char *errmsg = NULL;
+    PyThreadState *tstate = NULL;
+    Csite sitecopy;
+    Csite *site = &sitecopy;
+    double *xp0 = NULL;
+    double *yp0 = NULL;
+    long *nseg0 = NULL;
     int iseg;
 
     /* long nchunk = 30; was hardwired */
@@ -1478,6 +1485,22 @@ cntr_trace(Csite *site, double levels[], int nlevels, int points, long nchunk)
     long nparts2 = 0;
     long ntotal2 = 0;
 
+    if (mesh->triangle == NULL)
+    {
+        PyErr_SetString(PyExc_ValueError, "Contour engine not initialised");
+        return NULL;
+    }
+
+    /* tracing state is kept in a copy of the site */
+    sitecopy = *mesh;
+    site->data = (Cdata *) malloc(sizeof(Cdata) *
+                                  (mesh->imax * mesh->jmax + mesh->imax + 1));
+    if (site->data == NULL)
+        return PyErr_NoMemory();
+
+    if (mesh->fixedtri)
+        tstate = PyEval_SaveThread();
+
     site->zlevel[0] = levels[0];
     site->zlevel[1] = levels[0];
     if (nlevels == 2)
@@ -1504,10 +1527,15 @@ cntr_trace(Csite *site, double levels[], int nlevels, int points, long nchunk)
             ntotal -= n;
         }
     }
-    xp0 = (double *) PyMem_Malloc(ntotal * sizeof(double));
-    yp0 = (double *) PyMem_Malloc(ntotal * sizeof(double));
-    nseg0 = (long *) PyMem_Malloc(nparts * sizeof(long));
-    if (xp0 == NULL || yp0 == NULL || nseg0 == NULL) goto error;
+    xp0 = (double *) malloc((ntotal+1) * sizeof(double));
+    yp0 = (double *) malloc((ntotal+1) * sizeof(double));
+    nseg0 = (long *) malloc((nparts+1) * sizeof(long));
+    if (xp0 == NULL || yp0 == NULL || nseg0 == NULL)
+    {
+        errtype = PyExc_MemoryError;
+        errmsg = "Memory allocation failed in cntr_trace";
+        goto done;
+    }
 
     /* second pass */
     site->xcp = xp0;
@@ -1518,9 +1546,9 @@ cntr_trace(Csite *site, double levels[], int nlevels, int points, long nchunk)
         n = curve_tracer (site, 1);
         if (ntotal2 + n > ntotal)
         {
-            PyErr_SetString(PyExc_RuntimeError,
-                "curve_tracer: ntotal2, pass 2 exceeds ntotal, pass 1");
-            goto error;
+            errtype = PyExc_RuntimeError;
+            errmsg = "curve_tracer: ntotal2, pass 2 exceeds ntotal, pass 1";
+            goto done;
         }
         if (n == 0)
             break;
@@ -1535,14 +1563,21 @@ cntr_trace(Csite *site, double levels[], int nlevels, int points, long nchunk)
         }
         else
         {
-            PyErr_SetString(PyExc_RuntimeError,
-                "Negative n from curve_tracer in pass 2");
-            goto error;
+            errtype = PyExc_RuntimeError;
+            errmsg = "Negative n from curve_tracer in pass 2";
+            goto done;
         }
     }
 
+    done:
+    if (tstate != NULL)
+        PyEval_RestoreThread(tstate);
 
-    if (points)
+    if (errmsg != NULL)
+    {
+        PyErr_SetString(errtype, errmsg);
+    }
+    else if (points)
     {
         c_list = build_cntr_list_p(nseg0, xp0, yp0, nparts, ntotal);
     }
@@ -1550,14 +1585,9 @@ cntr_trace(Csite *site, double levels[], int nlevels, int points, long nchunk)
     {
         c_list = build_cntr_list_v2(nseg0, xp0, yp0, nparts, ntotal);
     }
-    PyMem_Free(xp0); PyMem_Free(yp0); PyMem_Free(nseg0);
-    site->xcp = NULL; site->ycp = NULL;
+    free(xp0); free(yp0); free(nseg0);
+    free(site->data);
     return c_list;
-
-    error:
-    PyMem_Free(xp0); PyMem_Free(yp0); PyMem_Free(nseg0);
-    site->xcp = NULL; site->ycp = NULL;
-    return NULL;
 }
 
 /******* Make an extension type.  Based on the tutorial.************/
@@ -1730,6 +1760,31 @@ Cntr_trace(Cntr *self, PyObject *args, PyObject *kwds)
     return cntr_trace(self->site, levels, nlevels, points, nchunk);
 }
 
+static PyObject *
+Cntr_fixtriangulation(Cntr *self)
+{
+    Csite *site = self->site;
+    long ij, ijmax;
+
+    if (site->triangle == NULL)
+    {
+        PyErr_SetString(PyExc_ValueError, "Contour engine not initialised");
+        return NULL;
+    }
+
+    /* choose the same direction for every undecided saddle zone */
+    ijmax = site->imax * site->jmax;
+    for (ij = 0; ij < ijmax; ij++)
+    {
+        if (site->triangle[ij] == 0)
+            site->triangle[ij] = 1;
+    }
+    site->fixedtri = 1;
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
 static PyMethodDef Cntr_methods[] = {
     {"trace", (PyCFunction)Cntr_trace, METH_VARARGS | METH_KEYWORDS,
      "Return a list of contour line segments or polygons.\n\n"
@@ -1742,6 +1797,11 @@ static PyMethodDef Cntr_methods[] = {
      "    Optional argument: nchunk; approximate number of grid points\n"
      "        per chunk. 0 (default) for no chunking.\n"
     },
+    {"fixtriangulation", (PyCFunction)Cntr_fixtriangulation, METH_NOARGS,
+     "Fix how saddle zones are divided for all levels.\n\n"
+     "    Afterwards the result of a trace does not depend on the levels\n"
+     "    traced before, and traces can run in several threads at once.\n"
+    },
     {NULL}  /* Sentinel */
 };
 
@@ -26,6 +26,7 @@
 #include <QVector>
 #include <QLineF>
 #include <QPen>
+#include <QTransform>
 
 namespace
 {
@@ -41,6 +42,11 @@ namespace
     return (a<b) ? a : b;
   }
 
+  template <class T> inline T min(T a, T b, T c)
+  {
+    return min( min(a, b), c );
+  }
+
   template <class T> inline T min(T a, T b, T c, T d)
   {
     return min( min(a, b), min(c, d) );
@@ -113,6 +119,126 @@ void plotPathsToPainter(QPainter& painter, QPainterPath& path,
     }
 }
 
+void plotScaledPathsToPainter(QPainter& painter, QPainterPath& path,
+			      const Numpy1DObj& x, const Numpy1DObj& y,
+			      const Numpy1DObj& scaling,
+			      const QRectF* clip)
+{
+  QRectF cliprect( QPointF(-32767,-32767), QPointF(32767,32767) );
+  if( clip != 0 )
+    {
+      qreal x1, y1, x2, y2;
+      clip->getCoords(&x1, &y1, &x2, &y2);
+      cliprect.setCoords(x1, y1, x2, y2);
+    }
+  const QRectF pathbox = path.boundingRect();
+
+  // each path is drawn with a translation and scaling applied on top
+  // of the existing transformation
+  const QTransform origtrans( painter.worldTransform() );
+
+  const int size = min(x.dim, y.dim, scaling.dim);
+  for(int i = 0; i < size; ++i)
+    {
+      const double s = scaling(i);
+      if( ! isFinite(s) )
+	continue;
+
+      // only draw if the scaled path overlaps the clipping rectangle
+      const QPointF pt(x(i), y(i));
+      const QRectF box = QRectF(pt.x() + pathbox.left()*s,
+				pt.y() + pathbox.top()*s,
+				pathbox.width()*s,
+				pathbox.height()*s).normalized();
+      if( cliprect.intersects(box) )
+	{
+	  painter.setWorldTransform( QTransform(s, 0, 0, s, pt.x(), pt.y()) *
+				     origtrans );
+	  painter.drawPath(path);
+	}
+    }
+
+  painter.setWorldTransform(origtrans);
+}
+
+namespace
+{
+  // number of sub-pixel positions sprites are made for in each direction
+  const int spritesteps = 4;
+}
+
+void plotPathSpritesToPainter(QPainter& painter, QPainterPath& path,
+			      const Numpy1DObj& x, const Numpy1DObj& y,
+			      const QRectF* clip)
+{
+  // sprites only make sense if they are drawn with pixel coordinates
+  if( ! painter.worldTransform().isIdentity() )
+    {
+      plotPathsToPainter(painter, path, x, y, clip);
+      return;
+    }
+
+  QRectF cliprect( QPointF(-32767,-32767), QPointF(32767,32767) );
+  if( clip != 0 )
+    {
+      qreal x1, y1, x2, y2;
+      clip->getCoords(&x1, &y1, &x2, &y2);
+      cliprect.setCoords(x1, y1, x2, y2);
+    }
+  QRectF pathbox = path.boundingRect();
+  cliprect.adjust(pathbox.left(), pathbox.top(),
+		  pathbox.bottom(), pathbox.right());
+
+  // area sprites cover relative to their point, allowing for the
+  // line width and sub-pixel offset
+  const QPen pen( painter.pen() );
+  const qreal lw = pen.style() == Qt::NoPen ? 0. :
+    ( pen.widthF() > 1. ? pen.widthF() : 1. );
+  pathbox.adjust(-lw, -lw, lw+1, lw+1);
+  const int offx = int(floor(pathbox.left()));
+  const int offy = int(floor(pathbox.top()));
+  const int width = int(ceil(pathbox.right())) - offx;
+  const int height = int(ceil(pathbox.bottom())) - offy;
+
+  // sprites are made when first needed for each sub-pixel offset
+  QVector<QImage> sprites(spritesteps*spritesteps);
+
+  const int size = min(x.dim, y.dim);
+  QPointF lastpt(-1e6, -1e6);
+  for(int i = 0; i < size; ++i)
+    {
+      const QPointF pt(x(i), y(i));
+      if( ! cliprect.contains(pt) || smallDelta(lastpt, pt) )
+	continue;
+      lastpt = pt;
+
+      // split position into whole pixels and sub-pixel steps
+      const double stepx = floor(pt.x()*spritesteps + 0.5);
+      const double stepy = floor(pt.y()*spritesteps + 0.5);
+      const double pixx = floor(stepx / spritesteps);
+      const double pixy = floor(stepy / spritesteps);
+      const int subx = int(stepx - pixx*spritesteps);
+      const int suby = int(stepy - pixy*spritesteps);
+
+      QImage& sprite = sprites[subx + suby*spritesteps];
+      if( sprite.isNull() )
+	{
+	  sprite = QImage(width, height, QImage::Format_ARGB32_Premultiplied);
+	  sprite.fill(0);
+	  QPainter spainter(&sprite);
+	  spainter.setRenderHints(painter.renderHints());
+	  spainter.setPen(pen);
+	  spainter.setBrush(painter.brush());
+	  spainter.translate(double(subx)/spritesteps - offx,
+			     double(suby)/spritesteps - offy);
+	  spainter.drawPath(path);
+	  spainter.end();
+	}
+
+      painter.drawImage(QPointF(pixx + offx, pixy + offy), sprite);
+    }
+}
+
 void plotLinesToPainter(QPainter& painter,
 			const Numpy1DObj& x1, const Numpy1DObj& y1,
 			const Numpy1DObj& x2, const Numpy1DObj& y2,
@@ -41,6 +41,15 @@ void plotPathsToPainter(QPainter& painter, QPainterPath& path,
 			const Numpy1DObj& x, const Numpy1DObj& y,
 			const QRectF* clip = 0);
 
+void plotScaledPathsToPainter(QPainter& painter, QPainterPath& path,
+			      const Numpy1DObj& x, const Numpy1DObj& y,
+			      const Numpy1DObj& scaling,
+			      const QRectF* clip = 0);
+
+void plotPathSpritesToPainter(QPainter& painter, QPainterPath& path,
+			      const Numpy1DObj& x, const Numpy1DObj& y,
+			      const QRectF* clip = 0);
+
 void plotLinesToPainter(QPainter& painter,
 			const Numpy1DObj& x1, const Numpy1DObj& y1,
 			const Numpy1DObj& x2, const Numpy1DObj& y2,
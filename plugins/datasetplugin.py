@@ -34,9 +34,12 @@ class DatasetPluginException(RuntimeError):
 
 def numpyCopyOrNone(data):
     """If data is None return None
-    Otherwise return a numpy array corresponding to data."""
+    Otherwise return a numpy array corresponding to data.
+    Memory mapped arrays are not copied, so they stay on disk."""
     if data is None:
         return None
+    if isinstance(data, N.memmap):
+        return data
     return N.array(data, dtype=N.float64)
 
 # these classes are returned from dataset plugins
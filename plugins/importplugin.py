@@ -333,11 +333,16 @@ def cnvtImportNumpyArray(name, val, errorsin2d=True):
         val.shape
     except AttributeError:
         raise ImportPluginException("Not the correct format file")
-    try:
-        val + 0.
-        val = val.astype(N.float64)
-    except TypeError:
-        raise ImportPluginException("Unsupported array type")
+    if isinstance(val, N.memmap):
+        # leave memory mapped data on disk (converted when used)
+        if val.dtype.kind not in 'biuf':
+            raise ImportPluginException("Unsupported array type")
+    else:
+        try:
+            val + 0.
+            val = val.astype(N.float64)
+        except TypeError:
+            raise ImportPluginException("Unsupported array type")
 
     if val.ndim == 1:
         return ImportDataset1D(name, val)
@@ -373,6 +378,10 @@ class ImportPluginNpy(ImportPlugin):
                             descr="Treat 2 and 3 column 2D arrays as\n"
                             "data with error bars",
                             default=True),
+            field.FieldBool("memmap",
+                            descr="Memory map file rather than reading\n"
+                            "it (data are linked to the file)",
+                            default=False),
             ]
 
     def getPreview(self, params):
@@ -381,7 +390,7 @@ class ImportPluginNpy(ImportPlugin):
         Returns (text, okaytoimport)
         """
         try:
-            retn = N.load(params.filename)
+            retn = N.load(params.filename, mmap_mode='r')
         except Exception, e:
             return "Cannot read file", False
 
@@ -402,8 +411,12 @@ class ImportPluginNpy(ImportPlugin):
         if not name:
             raise ImportPluginException("Please provide a name for the dataset")
 
+        mmap_mode = None
+        if params.field_results.get("memmap"):
+            mmap_mode = 'r'
+
         try:
-            retn = N.load(params.filename)
+            retn = N.load(params.filename, mmap_mode=mmap_mode)
         except Exception, e:
             raise ImportPluginException("Error while reading file: %s" %
                                         unicode(e))
@@ -494,7 +507,11 @@ class ImportPluginBinary(ImportPlugin):
             field.FieldCombo("endian", descr="Endian (byte order)",
                              items = ("little", "big"), editable=False),
             field.FieldInt("offset", descr="Offset (bytes)", default=0, minval=0),
-            field.FieldInt("length", descr="Length (values)", default=-1)
+            field.FieldInt("length", descr="Length (values)", default=-1),
+            field.FieldBool("memmap",
+                            descr="Memory map file rather than reading\n"
+                            "it (data are linked to the file)",
+                            default=False),
             ]
 
     def getNumpyDataType(self, params):
@@ -539,6 +556,20 @@ class ImportPluginBinary(ImportPlugin):
         if not name:
             raise ImportPluginException("Please provide a name for the dataset")
 
+        if params.field_results.get("memmap"):
+            # leave data on disk (converted when used)
+            length = params.field_results["length"]
+            try:
+                data = N.memmap(params.filename,
+                                dtype=self.getNumpyDataType(params),
+                                mode='r',
+                                offset=params.field_results["offset"],
+                                shape=length >= 0 and (length,) or None)
+            except (IOError, ValueError), e:
+                raise ImportPluginException("Error while mapping file: %s" %
+                                            unicode(e))
+            return [ ImportDataset1D(name, data) ]
+
         try:
             f = open(params.filename, "rb")
             f.seek( params.field_results["offset"] )
@@ -19,7 +19,9 @@
 
 """A widget for navigating datasets."""
 
+import sys
 import os.path
+import traceback
 import numpy as N
 
 import veusz.qtall as qt4
@@ -37,19 +39,185 @@ def datasetLinkFile(ds):
     else:
         return ds.linked.filename
 
-def pixmapAsHtml(pix):
-    """Get QPixmap as html image text."""
+def imageAsHtml(img):
+    """Get QImage as html image text."""
     ba = qt4.QByteArray()
     buf = qt4.QBuffer(ba)
     buf.open(qt4.QIODevice.WriteOnly)
-    pix.toImage().save(buf, "PNG")
+    img.save(buf, "PNG")
     b64 = str(buf.data().toBase64())
     return '<img src="data:image/png;base64,%s">' % b64
 
+def pixmapAsHtml(pix):
+    """Get QPixmap as html image text."""
+    return imageAsHtml(pix.toImage())
+
+def datasetIsDynamic(ds):
+    """Can the dataset change without the document being told
+    (e.g. if it is calculated from other datasets)?"""
+    return ( type(ds).dataVersion.im_func is not
+             document.DatasetBase.dataVersion.im_func )
+
+# size of dataset preview images
+previewsize = (140, 70)
+
+# html of preview images, indexed by dataset version
+_previewcache = utils.LRUCache(256)
+
+def previewPoints(ds, size):
+    """Calculate points to plot in preview image of dataset.
+
+    Returns (x, y, y0) giving the coordinates of the points and the
+    vertical position of the x axis, or None if no preview is possible
+    """
+    if ds.dimensions != 1 or ds.datatype != "numeric":
+        return None
+
+    try:
+        if len(ds.data) < size[1]:
+            y = ds.data
+        else:
+            intvl = len(ds.data)/size[1]+1
+            y = ds.data[::intvl]
+        x = N.arange(len(y))
+
+        minval, maxval = N.nanmin(y), N.nanmax(y)
+        y = (y-minval) / (maxval-minval) * size[1]
+        finite = N.isfinite(y)
+        x, y = x[finite], y[finite]
+        x = x * (1./len(x)) * size[0]
+    except (ValueError, ZeroDivisionError):
+        # zero sized array after filtering or min == max, so return None
+        return None
+
+    # draw x axis if span 0
+    if minval <= 0 and maxval > 0:
+        y0 = size[1] - (0-minval)/(maxval-minval)*size[1]
+    else:
+        y0 = size[1]
+    return x, size[1]-y, y0
+
+def paintPreview(points, size):
+    """Paint preview image of points from previewPoints.
+
+    This can be run outside the main thread, so returns a QImage."""
+    x, y, y0 = points
+
+    img = qt4.QImage(size[0], size[1], qt4.QImage.Format_ARGB32_Premultiplied)
+    img.fill(0)
+    p = qt4.QPainter(img)
+    p.setRenderHint(qt4.QPainter.Antialiasing)
+
+    poly = qt4.QPolygonF()
+    utils.addNumpyToPolygonF(poly, x, y)
+    p.setPen( qt4.QPen(qt4.Qt.blue) )
+    p.drawPolyline(poly)
+
+    p.setPen( qt4.QPen(qt4.Qt.black) )
+    p.drawLine(x[0], y0, x[-1], y0)
+    p.drawLine(x[0], 0, x[0], size[1])
+
+    p.end()
+    return img
+
+class DatasetPreviewer(qt4.QObject):
+    """Make preview images of datasets in a background thread.
+
+    The previews are cached for each version of each dataset.
+    Emits previewready() when a preview has been made.
+    """
+
+    def __init__(self, parent=None):
+        qt4.QObject.__init__(self, parent)
+        self.mutex = qt4.QMutex()
+        # jobs for thread: (dataset version, points)
+        self.jobs = []
+        self.running = False
+        # versions being made
+        self.pending = set()
+
+        self.previewthread = PreviewThread(self)
+        self.connect(self, qt4.SIGNAL("madepreview"), self.slotMadePreview)
+
+    def previewHtml(self, ds):
+        """Return html of preview image of dataset.
+
+        If the image has not been made, it is made in the background
+        and None is returned. None is also returned if there is no
+        preview for the dataset.
+        """
+        if ds.dimensions != 1 or ds.datatype != "numeric":
+            return None
+        version = ds.dataVersion()
+        html = _previewcache.get(version, False)
+        if html is not False:
+            return html
+        if version in self.pending:
+            return None
+
+        points = previewPoints(ds, previewsize)
+        if points is None:
+            _previewcache[version] = None
+            return None
+
+        self.pending.add(version)
+        self.mutex.lock()
+        self.jobs.append( (version, points) )
+        start = not self.running
+        self.running = True
+        self.mutex.unlock()
+
+        if start:
+            # thread may be just finishing
+            self.previewthread.wait()
+            self.previewthread.start()
+        return None
+
+    def makeNextPreview(self):
+        """Make the most recently requested preview.
+
+        Returns False if there were no previews to make."""
+
+        self.mutex.lock()
+        if not self.jobs:
+            self.running = False
+            self.mutex.unlock()
+            return False
+        version, points = self.jobs.pop()
+        self.mutex.unlock()
+
+        html = None
+        try:
+            html = imageAsHtml( paintPreview(points, previewsize) )
+        except Exception:
+            sys.stderr.write("Error making dataset preview\n")
+            traceback.print_exc(file=sys.stderr)
+
+        self.emit( qt4.SIGNAL("madepreview"), version, html )
+        return True
+
+    def slotMadePreview(self, version, html):
+        """Store preview made by thread."""
+        self.pending.discard(version)
+        _previewcache[version] = html
+        self.emit( qt4.SIGNAL("previewready") )
+
+class PreviewThread(qt4.QThread):
+    """Thread to make previews for a DatasetPreviewer.
+    The thread exits when there are no more previews to make."""
+
+    def __init__(self, previewer):
+        qt4.QThread.__init__(self)
+        self.previewer = previewer
+
+    def run(self):
+        while self.previewer.makeNextPreview():
+            pass
+
 class DatasetNode(TMNode):
     """Node for a dataset."""
 
-    def __init__(self, doc, dsname, cols, parent):
+    def __init__(self, doc, dsname, cols, parent, previewer=None):
         ds = doc.data[dsname]
         data = []
         assert cols[0] == "name"
@@ -66,55 +234,7 @@ class DatasetNode(TMNode):
         TMNode.__init__(self, tuple(data), parent)
         self.doc = doc
         self.cols = cols
-
-    def getPreviewPixmap(self, ds):
-        """Get a preview pixmap for a dataset."""
-        size = (140, 70)
-        if ds.dimensions != 1 or ds.datatype != "numeric":
-            return None
-
-        pixmap = qt4.QPixmap(*size)
-        pixmap.fill(qt4.Qt.transparent)
-        p = qt4.QPainter(pixmap)
-        p.setRenderHint(qt4.QPainter.Antialiasing)
-
-        # calculate data points
-        try:
-            if len(ds.data) < size[1]:
-                y = ds.data
-            else:
-                intvl = len(ds.data)/size[1]+1
-                y = ds.data[::intvl]
-            x = N.arange(len(y))
-
-            # plot data points on image
-            minval, maxval = N.nanmin(y), N.nanmax(y)
-            y = (y-minval) / (maxval-minval) * size[1]
-            finite = N.isfinite(y)
-            x, y = x[finite], y[finite]
-            x = x * (1./len(x)) * size[0]
-
-            poly = qt4.QPolygonF()
-            utils.addNumpyToPolygonF(poly, x, size[1]-y)
-            p.setPen( qt4.QPen(qt4.Qt.blue) )
-            p.drawPolyline(poly)
-
-            # draw x axis if span 0
-            p.setPen( qt4.QPen(qt4.Qt.black) )
-            if minval <= 0 and maxval > 0:
-                y0 = size[1] - (0-minval)/(maxval-minval)*size[1]
-                p.drawLine(x[0], y0, x[-1], y0)
-            else:
-                p.drawLine(x[0], size[1], x[-1], size[1])
-            p.drawLine(x[0], 0, x[0], size[1])
-
-        except (ValueError, ZeroDivisionError):
-            # zero sized array after filtering or min == max, so return None
-            p.end()
-            return None
-
-        p.end()
-        return pixmap
+        self.previewer = previewer
 
     def toolTip(self, column):
         """Return tooltip for column."""
@@ -128,11 +248,13 @@ class DatasetNode(TMNode):
             return qt4.QVariant(ds.description())
         elif c == "size" or (c == 'type' and 'size' not in self.cols):
             text = ds.userPreview()
-            # add preview of dataset if possible
-            pix = self.getPreviewPixmap(ds)
-            if pix:
+            # add preview of dataset if it has been made
+            html = None
+            if self.previewer is not None:
+                html = self.previewer.previewHtml(ds)
+            if html:
                 text = text.replace("\n", "<br>")
-                text = "<html>%s<br>%s</html>" % (text, pixmapAsHtml(pix))
+                text = "<html>%s<br>%s</html>" % (text, html)
             return qt4.QVariant(text)
         elif c == "linkfile" or c == "type":
             return qt4.QVariant(ds.linkedInformation())
@@ -151,7 +273,8 @@ class DatasetNode(TMNode):
 
     def cloneTo(self, newroot):
         """Make a clone of self at the root given."""
-        return self.__class__(self.doc, self.data[0], self.cols, newroot)
+        return self.__class__(self.doc, self.data[0], self.cols, newroot,
+                              previewer=self.previewer)
 
 class FilenameNode(TMNode):
     """A special node for holding filenames of files."""
@@ -175,15 +298,32 @@ class FilenameNode(TMNode):
             return qt4.QVariant(self.data[0])
         return qt4.QVariant()
 
-def treeFromList(nodelist, rootdata):
-    """Construct a tree from a list of nodes."""
-    tree = TMNode( rootdata, None )
-    for node in nodelist:
-        tree.insertChildSorted(node)
-    return tree
-
 class DatasetRelationModel(TreeModel):
-    """A model to show how the datasets are related to each file."""
+    """A model to show how the datasets are related to each file.
+
+    The tree is updated for the datasets the document says have
+    changed, rather than being rebuilt when the document is modified.
+    """
+
+    # for each grouping: column titles, items shown by DatasetNode,
+    # function of dataset to return group and class of group nodes
+    grpspecs = {
+        "none": ( ("Dataset", "Size", "Type", "File"),
+                  ("name", "size", "type", "linkfile"), None, None ),
+        "filename": ( ("Dataset", "Size", "Type"),
+                      ("name", "size", "type"),
+                      datasetLinkFile, FilenameNode ),
+        "size": ( ("Dataset", "Type", "Filename"),
+                  ("name", "type", "linkfile"),
+                  lambda ds: ds.userSize(), TMNode ),
+        "type": ( ("Dataset", "Size", "Filename"),
+                  ("name", "size", "linkfile"),
+                  lambda ds: ds.dstype, TMNode ),
+        }
+
+    # rebuild the whole tree if more datasets than this have changed
+    maxupdates = 100
+
     def __init__(self, doc, grouping="filename", readonly=False,
                  filterdims=None, filterdtype=None):
         """Model parameters:
@@ -201,9 +341,22 @@ class DatasetRelationModel(TreeModel):
         self.readonly = readonly
         self.filterdims = filterdims
         self.filterdtype = filterdtype
+
+        # nodes of datasets in tree, by name
+        self.dsnodes = {}
+        # names of datasets changed since tree last updated
+        self.changednames = set()
+        # names of datasets which can change without notification
+        self.dynamicnames = set()
+
+        self.previewer = DatasetPreviewer(self)
+
         self.refresh()
 
-        self.connect(doc, qt4.SIGNAL("sigModified"), self.refresh)
+        self.connect(doc, qt4.SIGNAL("sigDatasetChanged"),
+                     self.slotDatasetChanged)
+        self.connect(doc, qt4.SIGNAL("sigModified"), self.slotDocModified)
+        self.connect(doc, qt4.SIGNAL("sigWiped"), self.refresh)
 
     def datasetFilterOut(self, ds, node):
         """Should dataset be filtered out by filter options."""
@@ -222,67 +375,52 @@ class DatasetRelationModel(TreeModel):
 
         return filterout
 
-    def makeGrpTreeNone(self):
-        """Make tree with no grouping."""
-        tree = TMNode( ("Dataset", "Size", "Type", "File"), None )
-        for name, ds in self.doc.data.iteritems():
-            child = DatasetNode( self.doc, name,
-                                 ("name", "size", "type", "linkfile"),
-                                 None )
+    def makeDatasetNode(self, name, ds):
+        """Make node for dataset, if it is not filtered out.
 
-            # add if not filtered for filtering
-            if not self.datasetFilterOut(ds, child):
-                tree.insertChildSorted(child)
-        return tree
-        
-    def makeGrpTree(self, coltitles, colitems, grouper, GrpNodeClass):
-        """Make a tree grouping with function:
-        coltitles: tuple of titles of columns for user
-        colitems: tuple of items to lookup in DatasetNode
-        grouper: function of dataset to return text for grouping
-        GrpNodeClass: class for creating grouping nodes
-        """
+        Returns (node, group) where node is None if filtered out and
+        group is None if datasets are not grouped."""
+
+        coltitles, colitems, grouper, grpclass = self.grpspecs[self.grouping]
+        node = DatasetNode(self.doc, name, colitems, None,
+                           previewer=self.previewer)
+        if self.datasetFilterOut(ds, node):
+            return None, None
+        if grouper is None:
+            return node, None
+        return node, grouper(ds)
+
+    def makeTree(self):
+        """Make tree of all datasets with current grouping."""
+
+        coltitles, colitems, grouper, grpclass = self.grpspecs[self.grouping]
+        tree = TMNode(coltitles, None)
         grpnodes = {}
+        self.dynamicnames = set()
+
         for name, ds in self.doc.data.iteritems():
-            child = DatasetNode(self.doc, name, colitems, None)
-
-            # check whether filtered out
-            if not self.datasetFilterOut(ds, child):
-                # get group
-                grp = grouper(ds)
-                if grp not in grpnodes:
-                    grpnodes[grp] = GrpNodeClass( (grp,), None )
-                # add to group
-                grpnodes[grp].insertChildSorted(child)
-
-        return treeFromList(grpnodes.values(), coltitles)
-
-    def makeGrpTreeFilename(self):
-        """Make a tree of datasets grouped by linked file."""
-        return self.makeGrpTree(
-            ("Dataset", "Size", "Type"),
-            ("name", "size", "type"),
-            lambda ds: datasetLinkFile(ds),
-            FilenameNode
-            )
-
-    def makeGrpTreeSize(self):
-        """Make a tree of datasets grouped by dataset size."""
-        return self.makeGrpTree(
-            ("Dataset", "Type", "Filename"),
-            ("name", "type", "linkfile"),
-            lambda ds: ds.userSize(),
-            TMNode
-            )
-
-    def makeGrpTreeType(self):
-        """Make a tree of datasets grouped by dataset type."""
-        return self.makeGrpTree(
-            ("Dataset", "Size", "Filename"),
-            ("name", "size", "linkfile"),
-            lambda ds: ds.dstype,
-            TMNode
-            )
+            if datasetIsDynamic(ds):
+                self.dynamicnames.add(name)
+            child, grp = self.makeDatasetNode(name, ds)
+            if child is None:
+                continue
+
+            if grouper is None:
+                parent = tree
+            elif grp in grpnodes:
+                parent = grpnodes[grp]
+            else:
+                parent = grpnodes[grp] = grpclass( (grp,), tree )
+                tree.childnodes.append(parent)
+            child.parent = parent
+            parent.childnodes.append(child)
+
+        # sort nodes once, rather than inserting each in order
+        sortkey = lambda n: n.data
+        tree.childnodes.sort(key=sortkey)
+        for node in grpnodes.itervalues():
+            node.childnodes.sort(key=sortkey)
+        return tree
 
     def flags(self, idx):
         """Return model flags for index."""
@@ -308,17 +446,72 @@ class DatasetRelationModel(TreeModel):
         return True
 
     def refresh(self):
-        """Update tree of datasets when document changes."""
+        """Rebuild tree of datasets, e.g. if grouping or filter changed."""
+
+        self.changednames = set()
+        self.syncTree(self.makeTree())
+
+        # find nodes of datasets in updated tree
+        self.dsnodes = {}
+        for node in self.nodes.itervalues():
+            if isinstance(node, DatasetNode):
+                self.dsnodes[node.data[0]] = node
+
+    def slotDatasetChanged(self, name):
+        """Record dataset has changed, to update when document modified."""
+        self.changednames.add(name)
 
-        header = self.root.data
-        tree = {
-            "none": self.makeGrpTreeNone,
-            "filename": self.makeGrpTreeFilename,
-            "size": self.makeGrpTreeSize,
-            "type": self.makeGrpTreeType,
-            }[self.grouping]()
+    def slotDocModified(self, ismodified=True):
+        """Update tree for datasets which have changed."""
 
-        self.syncTree(tree)
+        if len(self.changednames) > self.maxupdates:
+            self.refresh()
+            return
+
+        names = list(self.changednames | self.dynamicnames)
+        names.sort()
+        self.changednames = set()
+        for name in names:
+            self.updateDataset(name)
+
+    def updateDataset(self, name):
+        """Update node in tree for dataset with name."""
+
+        oldnode = self.dsnodes.pop(name, None)
+        newnode = grp = None
+        self.dynamicnames.discard(name)
+        ds = self.doc.data.get(name)
+        if ds is not None:
+            if datasetIsDynamic(ds):
+                self.dynamicnames.add(name)
+            newnode, grp = self.makeDatasetNode(name, ds)
+
+        if oldnode is not None:
+            oldparent = oldnode.parent
+            if newnode is not None and ( (oldparent is self.root and
+                                          grp is None) or
+                                         oldparent.data == (grp,) ):
+                # still in same place, so update any changed columns
+                if oldnode.data != newnode.data:
+                    self.changeNodeData(oldnode, newnode.data)
+                self.dsnodes[name] = oldnode
+                return
+
+            self.removeNode(oldnode)
+            if oldparent is not self.root and not oldparent.childnodes:
+                # remove empty group
+                self.removeNode(oldparent)
+
+        if newnode is not None:
+            parent = self.root
+            if grp is not None:
+                parent = self.root.childWithData1(grp)
+                if parent is None:
+                    grpclass = self.grpspecs[self.grouping][3]
+                    parent = grpclass( (grp,), None )
+                    self.insertNodeSorted(self.root, parent)
+            self.insertNodeSorted(parent, newnode)
+            self.dsnodes[name] = newnode
 
 class DatasetsNavigatorTree(qt4.QTreeView):
     """Tree view for dataset names."""
@@ -358,6 +551,10 @@ class DatasetsNavigatorTree(qt4.QTreeView):
         for col in xrange(1, 4):
             hdr.setResizeMode(col, qt4.QHeaderView.ResizeToContents)
 
+        # show preview images in tooltips when they have been made
+        self.connect(self.model.previewer, qt4.SIGNAL("previewready"),
+                     self.slotPreviewReady)
+
         # when documents have finished opening, expand all nodes
         if mainwin is not None:
             self.connect(mainwin, qt4.SIGNAL("documentopened"), self.expandAll)
@@ -368,6 +565,17 @@ class DatasetsNavigatorTree(qt4.QTreeView):
                                  "const QItemSelection&)"),
                       self.slotNewSelection )
 
+    def slotPreviewReady(self):
+        """Show tooltip again if visible, to include new preview image."""
+        if not qt4.QToolTip.isVisible():
+            return
+        pos = qt4.QCursor.pos()
+        idx = self.indexAt( self.viewport().mapFromGlobal(pos) )
+        if idx.isValid():
+            tip = self.model.data(idx, qt4.Qt.ToolTipRole)
+            if tip.isValid():
+                qt4.QToolTip.showText(pos, tip.toString(), self.viewport())
+
     def changeGrouping(self, grouping):
         """Change the tree grouping behaviour."""
         self.model.grouping = grouping
@@ -23,6 +23,32 @@ import veusz.qtall as qt4
 import setting
 from settings import Settings
 
+def _memoize(settings, key, fn, *args):
+    """Return fn(*args), memoized in settings under key.
+
+    Memoized values are discarded when the value of any setting
+    changes or widgets are moved, as referenced settings may then
+    differ."""
+
+    memo = settings.__dict__.setdefault('_memo', {})
+    generation = (setting.Setting.modifications,
+                  setting.Reference.treegeneration)
+    if memo.get('_generation') != generation:
+        memo.clear()
+        memo['_generation'] = generation
+
+    try:
+        return memo[key]
+    except KeyError:
+        val = memo[key] = fn(*args)
+        return val
+
+def _painterKey(painter):
+    """Properties of painter used to convert distances."""
+    return ( getattr(painter, 'pixperpt', None),
+             getattr(painter, 'scaling', None),
+             getattr(painter, 'pagesize', None) )
+
 class Line(Settings):
     '''For holding properities of a line.'''
 
@@ -53,7 +79,10 @@ class Line(Settings):
         '''Make a QPen from the description.
         This currently ignores the hide attribute
         '''
+        return qt4.QPen( _memoize(self, ('pen', _painterKey(painthelper)),
+                                  self._makeQPen, painthelper) )
 
+    def _makeQPen(self, painthelper):
         color = qt4.QColor(self.color)
         color.setAlphaF( (100-self.transparency) / 100.)
         width = self.get('width').convert(painthelper)
@@ -128,7 +157,9 @@ class Brush(Settings):
         
     def makeQBrush(self):
         '''Make a qbrush from the settings.'''
+        return qt4.QBrush( _memoize(self, 'brush', self._makeQBrush) )
 
+    def _makeQBrush(self):
         color = qt4.QColor(self.color)
         color.setAlphaF( (100-self.transparency) / 100.)
         return qt4.QBrush( color, self.get('style').qtStyle() )
@@ -238,7 +269,10 @@ class Text(Settings):
 
     def makeQFont(self, painthelper):
         '''Return a qt4.QFont object corresponding to the settings.'''
-        
+        return qt4.QFont( _memoize(self, ('font', _painterKey(painthelper)),
+                                   self._makeQFont, painthelper) )
+
+    def _makeQFont(self, painthelper):
         size = self.get('size').convertPts(painthelper)
         weight = qt4.QFont.Normal
         if self.bold:
@@ -253,7 +287,8 @@ class Text(Settings):
 
     def makeQPen(self):
         """ Return a qt4.QPen object for the font pen """
-        return qt4.QPen(qt4.QColor(self.color))
+        return qt4.QPen( _memoize(self, 'pen', lambda:
+                                      qt4.QPen(qt4.QColor(self.color))) )
         
 class PointLabel(Text):
     """For labelling points on plots."""
@@ -30,6 +30,15 @@ class Reference(object):
     class ResolveException(Exception):
         pass
 
+    # incremented whenever widgets are added, removed, renamed or
+    # moved, so that the cached targets of references are resolved again
+    treegeneration = 0
+
+    def treeChanged(klass):
+        """Invalidate the cached targets of all references."""
+        klass.treegeneration += 1
+    treeChanged = classmethod(treeChanged)
+
     def __init__(self, value):
         """Initialise reference with value, which is a string as above."""
         self.value = value
@@ -43,6 +52,13 @@ class Reference(object):
         if self.resolved:
             return self.resolved
 
+        # the target is cached in the setting, as references can be
+        # shared between settings
+        cache = thissetting._refcache
+        if ( cache is not None and cache[0] is self and
+             cache[1] == Reference.treegeneration ):
+            return cache[2]
+
         item = thissetting.parent
         parts = list(self.split)
         if parts[0] == '':
@@ -78,5 +94,7 @@ class Reference(object):
         # hopefully this won't ever change
         if len(self.split) > 2 and self.split[1] == 'StyleSheet':
             self.resolved = item
+        else:
+            thissetting._refcache = (self, Reference.treegeneration, item)
 
         return item
@@ -41,6 +41,22 @@ import veusz.utils as utils
 class InvalidType(Exception):
     pass
 
+def _sameValue(old, new):
+    """Is the new stored value of a setting the same as the old one,
+    so that values derived from it do not change?"""
+    if type(old) is not type(new):
+        return False
+    try:
+        if isinstance(new, (list, dict)):
+            # the same object may have been modified in place
+            return old is not new and bool(old == new)
+        if isinstance(new, (basestring, int, long, float, bool, tuple)):
+            return bool(old == new)
+    except ValueError:
+        # comparing arrays inside the values
+        pass
+    return False
+
 class Setting(object):
     """A class to store a value with a particular type."""
 
@@ -49,6 +65,10 @@ class Setting(object):
 
     typename = 'setting'
 
+    # incremented whenever the value of any setting changes, so that values
+    # derived from settings can be memoized
+    modifications = 0
+
     def __init__(self, name, value, descr='', usertext='',
                  formatting=False, hidden=False):
         """Initialise the values.
@@ -69,6 +89,9 @@ class Setting(object):
         self.onmodified = qt4.QObject()
         self._val = None
 
+        # (reference, tree generation, target) if value is a reference
+        self._refcache = None
+
         # calls the set function for the val property
         self.val = value
 
@@ -119,12 +142,15 @@ class Setting(object):
     def set(self, v):
         """Set the value."""
 
+        oldval = self._val
         if isinstance(v, Reference):
             self._val = v
         else:
             # this also removes the linked value if there is one set
             self._val = self.convertTo(v)
 
+        if not _sameValue(oldval, self._val):
+            Setting.modifications += 1
         self.onmodified.emit(qt4.SIGNAL("onModified"), True)
 
     val = property(get, set, None,
@@ -301,7 +327,10 @@ class Setting(object):
         This shouldn't often be used as it defeats the automatic updation.
         Used for temporary modifications."""
 
+        oldval = self._val
         self._val = self.convertTo(val)
+        if not _sameValue(oldval, self._val):
+            Setting.modifications += 1
 
     def convertTo(self, val):
         """Convert for storage."""
@@ -668,6 +697,9 @@ def _distRatio(match, painter):
 
     return painter.maxsize * float(match.group(1))
 
+# conversion function and regexp match for (class, distance text)
+_distcache = {}
+
 class Distance(Setting):
     """A veusz distance measure, e.g. 1pt or 3%."""
 
@@ -766,15 +798,23 @@ class Distance(Setting):
         painter: painter to get metrics to convert physical sizes
         '''
 
-        # work out maximum size
-        dist = dist.strip()
+        # use previous parsing of text, if any
+        try:
+            fn, m = _distcache[(kls, dist)]
+        except KeyError:
+            pass
+        else:
+            return fn(m, painter)
 
         # compare string against each regexp
         for reg, fn, fninv in kls.distregexp:
-            m = reg.match(dist)
+            m = reg.match(dist.strip())
 
             # if there's a match, then call the appropriate conversion fn
             if m:
+                if len(_distcache) > 1024:
+                    _distcache.clear()
+                _distcache[(kls, dist)] = (fn, m)
                 return fn(m, painter)
 
         # none of the regexps match
@@ -61,6 +61,14 @@ defaultValues = {
 
     # use cwd as starting directory
     'dirname_usecwd': False,
+
+    # save dataset values in a binary file alongside documents
+    'file_binarydata': False,
+    'file_compressbinary': False,
+
+    # memory (MB) datasets kept for undo may use before old
+    # operations are discarded
+    'history_maxmemory': 512,
     }
 
 class _SettingDB(object):
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2011 Jeremy S. Sanders
+#    Email: Jeremy Sanders <jeremy@jeremysanders.net>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""Test saving and loading of dataset values in binary files.
+
+Arrays loaded from a binary file are memory mapped from it, so saving
+them again to the same file (as when a document loaded with binary
+data is saved) must not overwrite the mapped file. Arrays of objects,
+which would be unpickled, must be refused. The program returns
+the number of tests which failed.
+
+This program requires the veusz module to be on the PYTHONPATH.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as N
+
+from veusz.document import binaryblock
+
+def makeArrays():
+    """Make some arrays to save."""
+    return {
+        'ds0_data': N.arange(1000, dtype=N.float64),
+        'ds0_serr': N.linspace(0., 1., 1000),
+        'ds1_data': N.array([], dtype=N.float64),
+        'ds2_data': N.arange(12, dtype=N.int32).reshape(3, 4),
+        }
+
+def checkArrays(arrays, expected):
+    """Check dict of arrays matches the expected ones."""
+    if sorted(arrays.keys()) != sorted(expected.keys()):
+        return False
+    for name, array in expected.iteritems():
+        if ( arrays[name].shape != array.shape or
+             not N.all(arrays[name] == array) ):
+            return False
+    return True
+
+def testLoadSaveReload(dirname, compress):
+    """Load a binary file, save the loaded arrays to the same file and
+    load them again."""
+
+    expected = makeArrays()
+    filename = binaryblock.binaryBlockFilename(
+        os.path.join(dirname, 'test.vsz'))
+    binaryblock.saveBinaryBlock(filename, expected)
+
+    loaded = binaryblock.loadBinaryBlock(filename)
+    if not checkArrays(loaded, expected):
+        return False
+
+    # the loaded arrays are mapped from the file being replaced
+    binaryblock.saveBinaryBlock(filename, loaded, compress=compress)
+    if not checkArrays(loaded, expected):
+        return False
+
+    return checkArrays(binaryblock.loadBinaryBlock(filename), expected)
+
+def testObjectArray(dirname, compress):
+    """Check a file with an array of objects is refused."""
+
+    filename = os.path.join(dirname, 'test.vsz.npz')
+    arrays = makeArrays()
+    arrays['ds3_data'] = N.array([{}, 'a'], dtype=object)
+    if compress:
+        N.savez_compressed(filename, **arrays)
+    else:
+        N.savez(filename, **arrays)
+
+    try:
+        binaryblock.loadBinaryBlock(filename)
+    except RuntimeError:
+        return True
+    return False
+
+def runTests():
+    fails = 0
+    tests = (
+        ('load, save and reload', testLoadSaveReload),
+        ('refuse object arrays', testObjectArray),
+        )
+    for testname, testfn in tests:
+        for compress in (False, True):
+            name = '%s (compress=%s)' % (testname, compress)
+            dirname = tempfile.mkdtemp()
+            try:
+                ok = testfn(dirname, compress)
+            finally:
+                shutil.rmtree(dirname)
+
+            if ok:
+                print "%s: PASS" % name
+            else:
+                print "%s: FAIL" % name
+                fails += 1
+    return fails
+
+if __name__ == '__main__':
+    sys.exit(runTests())
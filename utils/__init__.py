@@ -32,9 +32,11 @@ from formatting import *
 
 try:
     from veusz.helpers.qtloops import addNumpyToPolygonF, plotPathsToPainter, \
+        plotScaledPathsToPainter, plotPathSpritesToPainter, \
         plotLinesToPainter, plotClippedPolyline, polygonClip, \
         plotClippedPolygon, plotBoxesToPainter
 except ImportError:
     from slowfuncs import addNumpyToPolygonF, plotPathsToPainter, \
+        plotScaledPathsToPainter, plotPathSpritesToPainter, \
         plotLinesToPainter, plotClippedPolyline, polygonClip, \
         plotClippedPolygon, plotBoxesToPainter
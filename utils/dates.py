@@ -80,6 +80,56 @@ def dateStringToDate(datestr):
     else:
         return N.nan
 
+# fixed width ISO formats which can be converted by numpy directly:
+# length of string, positions of digits and positions of separators
+_isoformats = {
+    10: (range(0,4)+range(5,7)+range(8,10), ((4,u'-'), (7,u'-'))),
+    19: (range(0,4)+range(5,7)+range(8,10)+range(11,13)+range(14,16)+
+         range(17,19),
+         ((4,u'-'), (7,u'-'), (10,u'T'), (13,u':'), (16,u':'))),
+    }
+
+def _isoDateStringsToFloats(strings):
+    """Convert fixed width ISO date strings using numpy.
+
+    Returns None if the strings cannot be converted this way."""
+
+    try:
+        chars = N.array(strings, dtype=N.unicode_)
+        length = chars.dtype.itemsize // N.dtype('U1').itemsize
+        digits, seps = _isoformats[length]
+        # split strings into characters and check format
+        chars = chars.view('U1').reshape( (len(strings), length) )
+        for pos, sep in seps:
+            if sep == u'T':
+                if not N.all( (chars[:,pos] == u'T') |
+                              (chars[:,pos] == u' ') ):
+                    return None
+            elif not N.all(chars[:,pos] == sep):
+                return None
+        digitchars = chars[:,digits]
+        if not N.all( (digitchars >= u'0') & (digitchars <= u'9') ):
+            return None
+
+        # separator must be T for numpy
+        if length == 19:
+            chars[:,10] = u'T'
+        secs = chars.view('U%i' % length).ravel().astype('datetime64[s]')
+        offset = N.datetime64('2009-01-01T00:00:00', 's')
+        return (secs - offset).astype(N.float64)
+    except (KeyError, TypeError, ValueError, AttributeError):
+        # unsupported format, invalid dates or old numpy
+        return None
+
+def dateStringsToFloats(strings):
+    """Interpret a sequence of date strings, returning a numpy array
+    of Veusz-format date values."""
+    if len(strings) > 0:
+        vals = _isoDateStringsToFloats(strings)
+        if vals is not None:
+            return vals
+    return N.array([dateStringToDate(s) for s in strings], dtype=N.float64)
+
 def floatToDateTime(f):
     """Convert float to datetime."""
     days = int(f/24/60/60)
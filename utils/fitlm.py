@@ -28,16 +28,71 @@ try:
 except:
     import scipy.linalg as NLA
 
+def numericalDerivs(func, params, xvals, funcvals, deltaderiv=1e-5,
+                    batch=True, check=False):
+    """Estimate the derivatives of func with respect to each parameter
+    by finite differences.
+
+    funcvals are the values of func(params, xvals).
+
+    If batch is set, func is first evaluated for every changed
+    parameter at once. It is passed an array of parameters with shape
+    (nparams, nparams, 1), where column i has parameter i changed,
+    and should return an array of shape (nparams, len(xvals)) (this is
+    the case if the parameters are broadcast against the x values). If
+    check is set, one row of the result is compared with evaluating
+    func normally.
+
+    Returns (derivs, batch), where derivs has shape
+    (nparams, len(xvals)) and batch is whether batched evaluation
+    worked.
+    """
+
+    nparams = len(params)
+    if batch:
+        allparams = ( params[:,N.newaxis] +
+                      N.identity(nparams)*deltaderiv )[:,:,N.newaxis]
+        try:
+            newvals = N.asarray( func(allparams, xvals), dtype=N.float64 )
+        except Exception:
+            newvals = None
+
+        if newvals is None or newvals.shape != (nparams, len(xvals)):
+            batch = False
+        elif check:
+            single = func(allparams[:,0,0], xvals)
+            same = N.logical_or(
+                N.abs(newvals[0]-single) <= 1e-8*(N.abs(single)+1.),
+                N.logical_and(N.isnan(newvals[0]), N.isnan(single)) )
+            batch = bool( same.all() )
+
+        if batch:
+            newvals -= funcvals
+            newvals *= 1. / deltaderiv
+            return newvals, True
+
+    # evaluate with each parameter changed in turn
+    derivs = N.empty( (nparams, len(xvals)), dtype=N.float64 )
+    for i in xrange(nparams):
+        newparams = params.copy()
+        newparams[i] += deltaderiv
+        derivs[i] = func(newparams, xvals)
+    derivs -= funcvals
+    derivs *= 1. / deltaderiv
+    return derivs, False
+
 def fitLM(func, params, xvals, yvals, errors,
           stopdeltalambda = 1e-5,
-          deltaderiv = 1e-5, maxiters = 20, Lambda = 1e-4):
+          deltaderiv = 1e-5, maxiters = 20, Lambda = 1e-4,
+          derivfunc = None):
 
     """
     Use Marquardt method as described in Bevington & Robinson to fit data
 
     func is a python function to evaluate. It takes two parameters, the
     parameters to fit as a numpy, and the values of x to evaluate the
-    function at
+    function at. If possible, it is called with all the parameter
+    changes for estimating derivatives at once (see numericalDerivs).
 
     params is a numpy of parameters to fit for. These are passed to
     the function.
@@ -50,6 +105,10 @@ def fitLM(func, params, xvals, yvals, errors,
     deltaderiv: change to make in parameters to calculate derivative
     maxiters: maximum number of better fitting solutions before stopping
     Lambda: starting lambda value (as described in Bevington)
+    derivfunc: optional function taking the same parameters as func,
+     returning a sequence of the derivatives of func with respect to
+     each parameter (arrays of len(xvals) or scalars). If not given,
+     derivatives are estimated numerically.
     """
 
     # only use finite values for fitting
@@ -60,6 +119,9 @@ def fitLM(func, params, xvals, yvals, errors,
     yvals = yvals[finite]
     errors = errors[finite]
 
+    params = N.array(params, dtype=N.float64)
+    nparams = len(params)
+
     # optimisation to avoid computing this all the time
     inve2 = 1. / errors**2
 
@@ -67,47 +129,49 @@ def fitLM(func, params, xvals, yvals, errors,
     oldfunc = func(params, xvals)
     chi2 = ( (oldfunc - yvals)**2 * inve2 ).sum()
 
-    # initialise temporary space
-    beta = N.zeros( len(params), dtype='float64' )
-    alpha = N.zeros( (len(params), len(params)), dtype='float64' )
-    derivs = N.zeros( (len(params), len(xvals)), dtype='float64' )
+    # try evaluating all the parameter changes at once, checking the
+    # first time that this gives the right answer
+    batch = True
+    checkbatch = True
+    newderivs = True
 
     done = False
     iters = 0
     while iters < maxiters and not done:
-        # iterate over each of the parameters and calculate the derivatives
-        # of chi2 to populate the beta vector
-
-        # also calculate the derivative of the function at each of the points
-        # wrt the parameters
-
-        for i in range( len(params) ):
-            params[i] += deltaderiv
-            new_func = func(params, xvals)
-            chi2_new = ((new_func - yvals)**2 * inve2).sum()
-            params[i] -= deltaderiv
-
-            beta[i] = chi2_new - chi2
-            derivs[i] = new_func - oldfunc
-
-        # beta is now dchi2 / dparam
-        beta *= (-0.5 / deltaderiv)
-        derivs *= (1. / deltaderiv)
-
-        # calculate alpha matrix
-        # FIXME: stupid - must be a better way to avoid this iteration
-        for j in range( len(params) ):
-            for k in range(j+1):
-                v = (derivs[j]*derivs[k] * inve2).sum()
-                alpha[j][k] = v
-                alpha[k][j] = v
+        if newderivs:
+            # calculate the derivative of the function at each of the
+            # points wrt the parameters
+            if derivfunc is not None:
+                rows = derivfunc(params, xvals)
+                if len(rows) != nparams:
+                    raise ValueError, ( 'Expected %i derivatives, got %i' %
+                                        (nparams, len(rows)) )
+                derivs = N.empty( (nparams, len(xvals)), dtype=N.float64 )
+                for i, row in enumerate(rows):
+                    derivs[i] = row
+            else:
+                derivs, batch = numericalDerivs(
+                    func, params, xvals, oldfunc, deltaderiv=deltaderiv,
+                    batch=batch, check=checkbatch)
+                checkbatch = False
+
+            # beta is -0.5 * dchi2 / dparam, and alpha the curvature
+            # matrix of chi2
+            wderivs = derivs * inve2
+            beta = N.dot(wderivs, yvals - oldfunc)
+            alpha = N.dot(wderivs, derivs.T)
+            del wderivs
+            newderivs = False
 
         # twiddle alpha using lambda
-        alpha *= 1. + N.identity(len(params), dtype='float64')*Lambda
+        twiddled = alpha * (1. + N.identity(nparams, dtype='float64')*Lambda)
 
         # now work out deltas on parameters to get better fit
-        epsilon = NLA.inv( alpha )
-        deltas = N.dot(beta, epsilon)
+        try:
+            deltas = NLA.solve(twiddled, beta)
+        except NLA.LinAlgError:
+            sys.stderr.write('Singular matrix in fit. Aborting fit.\n')
+            break
 
         # new solution
         new_params = params+deltas
@@ -131,6 +195,7 @@ def fitLM(func, params, xvals, yvals, errors,
             params = new_params
             oldfunc = new_func
             Lambda *= 0.1
+            newderivs = True
 
             # format new parameters
             iters += 1
@@ -147,4 +212,3 @@ def fitLM(func, params, xvals, yvals, errors,
     print "chi^2 = %g, dof = %i, reduced-chi^2 = %g" % (chi2, dof, redchi2)
 
     return (params, chi2, dof)
-
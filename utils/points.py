@@ -18,15 +18,15 @@
 #    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 ###############################################################################
 
-from itertools import izip
-
 import veusz.qtall as qt4
 import numpy as N
 
 try:
-    from veusz.helpers.qtloops import plotPathsToPainter
+    from veusz.helpers.qtloops import plotPathsToPainter, \
+        plotScaledPathsToPainter, plotPathSpritesToPainter
 except ImportError:
-    from slowfuncs import plotPathsToPainter
+    from slowfuncs import plotPathsToPainter, \
+        plotScaledPathsToPainter, plotPathSpritesToPainter
 
 """This is the symbol plotting part of Veusz
 
@@ -409,21 +409,15 @@ def plotMarkers(painter, xpos, ypos, markername, markersize, scaling=None,
         # turn off brush
         painter.setBrush( qt4.QBrush() )
 
-    # split up into two loops as this is a critical path
-    if scaling is None:
-        plotPathsToPainter(painter, path, xpos, ypos, clip)
-    else:
+    if scaling is not None:
         # plot markers, scaling each one
-        s = painter.scale
-        t = painter.translate
-        d = painter.drawPath
-        r = painter.resetTransform
-        for x, y, sc in izip(xpos, ypos, scaling):
-            t(x, y)
-            s(sc, sc)
-            d(path)
-            r()
-    
+        plotScaledPathsToPainter(painter, path, xpos, ypos, scaling, clip)
+    elif getattr(painter, 'bitmapoutput', False):
+        # reuse rendered images of the marker if output is a bitmap
+        plotPathSpritesToPainter(painter, path, xpos, ypos, clip)
+    else:
+        plotPathsToPainter(painter, path, xpos, ypos, clip)
+
     painter.restore()
 
 def plotMarker(painter, xpos, ypos, markername, markersize):
@@ -72,6 +72,32 @@ def plotPathsToPainter(painter, path, x, y, clip=None):
             painter.drawPath(path)
             painter.translate(-pt)
 
+def plotScaledPathsToPainter(painter, path, x, y, scaling, clip=None):
+    """Plot array of x, y points, scaling each path by scaling."""
+
+    if clip is None:
+        clip = qt4.QRectF(qt4.QPointF(-32767,-32767),qt4.QPointF(32767,32767))
+    pathbox = path.boundingRect()
+
+    origtrans = painter.worldTransform()
+    for xp, yp, sc in izip(x, y, scaling):
+        if not N.isfinite(sc):
+            continue
+        box = qt4.QRectF(xp + pathbox.left()*sc, yp + pathbox.top()*sc,
+                         pathbox.width()*sc, pathbox.height()*sc).normalized()
+        if clip.intersects(box):
+            painter.setWorldTransform(
+                qt4.QTransform(sc, 0, 0, sc, xp, yp) * origtrans )
+            painter.drawPath(path)
+    painter.setWorldTransform(origtrans)
+
+def plotPathSpritesToPainter(painter, path, x, y, clip=None):
+    """Plot array of x, y points using pre-rendered images of path.
+
+    There is no benefit doing this in Python, so the paths are drawn
+    directly."""
+    plotPathsToPainter(painter, path, x, y, clip)
+
 def plotLinesToPainter(painter, x1, y1, x2, y2, clip=None, autoexpand=True):
     """Plot lines given in numpy arrays to painter."""
     lines = []
@@ -21,10 +21,13 @@
 
 import math
 import re
+import threading
 
 import numpy as N
 import veusz.qtall as qt4
 
+from utilfuncs import LRUCache
+
 # this definition is monkey-patched when veusz is running in self-test
 # mode as we need to hack the metrics - urgh
 FontMetrics = qt4.QFontMetricsF
@@ -177,7 +180,7 @@ symbols = {
 class RenderState(object):
     """Holds the state of the rendering."""
     def __init__(self, font, painter, x, y, alignhorz,
-                 actually_render=True):
+                 actually_render=True, widths=None):
         self.font = font
         self.painter = painter
         self.device = painter.device()
@@ -187,6 +190,12 @@ class RenderState(object):
         self.actually_render = actually_render
         self.maxlines = 1 # maximim number of lines drawn
 
+        # widths of parts (e.g. lines) measured when not rendering,
+        # indexed by part, so that part trees can be shared
+        if widths is None:
+            widths = {}
+        self.widths = widths
+
     def fontMetrics(self):
         """Returns font metrics object."""
         return FontMetrics(self.font, self.device)
@@ -233,15 +242,12 @@ class PartText(Part):
 class PartLines(Part):
     """Render multiple lines."""
 
-    def __init__(self, children):
-        Part.__init__(self, children)
-        self.widths = []
-
     def render(self, state):
         """Render multiple lines."""
         # record widths of individual lines
         if not state.actually_render:
-            self.widths = []
+            state.widths[self] = []
+        widths = state.widths.get(self, [])
 
         height = state.fontMetrics().height()
         inity = state.y
@@ -251,18 +257,18 @@ class PartLines(Part):
 
         # iterate over lines (reverse as we draw from bottom up)
         for i, part in enumerate(self.children):
-            if state.actually_render and self.widths:
-                xwidth = max(self.widths)
+            if state.actually_render and widths:
+                xwidth = max(widths)
                 # if we're rendering, use max width to justify line
                 if state.alignhorz < 0:
                     # left alignment
                     state.x = initx
                 elif state.alignhorz == 0:
                     # centre alignment
-                    state.x = initx + (xwidth - self.widths[i])*0.5
+                    state.x = initx + (xwidth - widths[i])*0.5
                 elif state.alignhorz > 0:
                     # right alignment
-                    state.x = initx + (xwidth - self.widths[i])
+                    state.x = initx + (xwidth - widths[i])
             else:
                 # if not, just left justify to get widths
                 state.x = initx
@@ -272,13 +278,13 @@ class PartLines(Part):
 
             # record width if we're not rendering
             if not state.actually_render:
-                self.widths.append( state.x - initx )
+                widths.append( state.x - initx )
             # move up a line
             state.y += height
 
         # move on x posn
-        if self.widths:
-            state.x = initx + max(self.widths)
+        if widths:
+            state.x = initx + max(widths)
         else:
             state.x = initx
         state.y = inity
@@ -326,33 +332,34 @@ class PartFrac(Part):
 
         # keep track of width above and below line
         if not state.actually_render:
-            self.widths = []
+            state.widths[self] = []
+        widths = state.widths.get(self, [])
 
         initx = state.x
         inity = state.y
 
         # render bottom of fraction
-        if state.actually_render and len(self.widths) == 2:
+        if state.actually_render and len(widths) == 2:
             # centre line
-            state.x = initx + (max(self.widths) - self.widths[0])*0.5
+            state.x = initx + (max(widths) - widths[0])*0.5
         self.children[1].render(state)
         if not state.actually_render:
             # get width if not rendering
-            self.widths.append(state.x - initx)
+            widths.append(state.x - initx)
 
         # render top of fraction
         m = state.fontMetrics()
         state.y -= (m.ascent() + m.descent())
-        if state.actually_render and len(self.widths) == 2:
+        if state.actually_render and len(widths) == 2:
             # centre line
-            state.x = initx + (max(self.widths) - self.widths[1])*0.5
+            state.x = initx + (max(widths) - widths[1])*0.5
         else:
             state.x = initx
         self.children[0].render(state)
         if not state.actually_render:
-            self.widths.append(state.x - initx)
+            widths.append(state.x - initx)
 
-        state.x = initx + max(self.widths)
+        state.x = initx + max(widths)
         state.y = inity
 
         # restore font
@@ -361,18 +368,19 @@ class PartFrac(Part):
         height = state.fontMetrics().ascent()
 
         # draw line between lines with 0.5pt thickness
-        painter.save()
-        pen = painter.pen()
-        painter.setPen( qt4.QPen(painter.pen().brush(),
-                                 state.getPixelsPerPt()*0.5) )
-        painter.setPen(pen)
+        if state.actually_render:
+            painter.save()
+            pen = painter.pen()
+            painter.setPen( qt4.QPen(painter.pen().brush(),
+                                     state.getPixelsPerPt()*0.5) )
+            painter.setPen(pen)
 
-        painter.drawLine(qt4.QPointF(initx,
-                                     inity-height/2.),
-                         qt4.QPointF(initx+max(self.widths),
-                                     inity-height/2))
+            painter.drawLine(qt4.QPointF(initx,
+                                         inity-height/2.),
+                             qt4.QPointF(initx+max(widths),
+                                         inity-height/2))
 
-        painter.restore()
+            painter.restore()
 
 class PartSubScript(Part):
     """Represents subscripted part."""
@@ -691,6 +699,36 @@ def makePartTree(partlist):
     else:
         return PartLines(lines)
 
+# part trees of text, and layouts of text for particular fonts and
+# devices, shared between renderers (hits and misses can be examined)
+parsecache = LRUCache(4096)
+layoutcache = LRUCache(4096)
+_cachelock = threading.Lock()
+
+def _cacheGet(cache, key):
+    """Look up key in cache, returning None if not found."""
+    _cachelock.acquire()
+    try:
+        return cache.get(key)
+    finally:
+        _cachelock.release()
+
+def _cacheSet(cache, key, val):
+    """Set key in cache to val."""
+    _cachelock.acquire()
+    try:
+        cache[key] = val
+    finally:
+        _cachelock.release()
+
+def getPartTree(text):
+    """Return tree of parts for text, which may be shared."""
+    tree = _cacheGet(parsecache, text)
+    if tree is None:
+        tree = makePartTree( makePartList(text) )
+        _cacheSet(parsecache, text, tree)
+    return tree
+
 class Renderer(object):
     """A class for rendering text.
 
@@ -722,9 +760,11 @@ class Renderer(object):
         self.angle = angle
         self.usefullheight = usefullheight
 
-        #self.text = text
-        partlist = makePartList(text)
-        self.parttree = makePartTree(partlist)
+        if not isinstance(text, basestring):
+            text = unicode(text)
+        self.text = text
+        self.parttree = None
+        self.widths = None
 
         self.x = x
         self.y = y
@@ -742,6 +782,32 @@ class Renderer(object):
         # work out total width and height
         self.painter.setFont(self.font)
 
+        # the layout is the same if the text is drawn elsewhere
+        device = self.painter.device()
+        key = ( self.text, self.font.key(), device.__class__,
+                device.logicalDpiX(), device.logicalDpiY(),
+                getattr(self.painter, 'scaling', None), self.angle,
+                self.alignhorz, self.alignvert, self.usefullheight )
+        layout = _cacheGet(layoutcache, key)
+        if layout is None:
+            layout = self._layout()
+            _cacheSet(layoutcache, key, layout)
+
+        self.parttree, self.widths, bounds, xi, yi = layout
+        self.xi = self.x + xi
+        self.yi = self.y + yi
+        self.calcbounds = [self.x+bounds[0], self.y+bounds[1],
+                           self.x+bounds[2], self.y+bounds[3]]
+        return self.calcbounds
+
+    def _layout(self):
+        """Measure text, with the text position at the origin.
+
+        Returns (part tree, widths of parts, bounds, x and y
+        positions to start drawing text)."""
+
+        parttree = getPartTree(self.text)
+
         # work out height of box, and
         # make the bounding box a bit bigger if we want to include descents
 
@@ -765,7 +831,7 @@ class Renderer(object):
             dy = 0
 
         # work out width
-        self.parttree.render(state)
+        parttree.render(state)
         totalwidth = state.x
         totalheight += fm.height()*(state.maxlines-1)
 
@@ -788,29 +854,29 @@ class Renderer(object):
 
         # use rotated bounding box to find position of start text posn
         if self.alignhorz < 0:
-            xr = ( self.x, self.x+(newbound[2]-newbound[0]) )
-            self.xi = self.x + (newx[0] - newbound[0])
+            xr = ( 0, newbound[2]-newbound[0] )
+            xi = newx[0] - newbound[0]
         elif self.alignhorz > 0:
-            xr = ( self.x-(newbound[2]-newbound[0]), self.x )
-            self.xi = self.x + (newx[0] - newbound[2])
+            xr = ( -(newbound[2]-newbound[0]), 0 )
+            xi = newx[0] - newbound[2]
         else:
-            xr = ( self.x+newbound[0], self.x+newbound[2] )
-            self.xi = self.x + newx[0]
+            xr = ( newbound[0], newbound[2] )
+            xi = newx[0]
 
         # y alignment
         # adjust y by these values to ensure proper alignment
         if self.alignvert < 0:
-            yr = ( self.y + (newbound[1]-newbound[3]), self.y )
-            self.yi = self.y + (newy[0] - newbound[3])
+            yr = ( newbound[1]-newbound[3], 0 )
+            yi = newy[0] - newbound[3]
         elif self.alignvert > 0:
-            yr = ( self.y, self.y + (newbound[3]-newbound[1]) )
-            self.yi = self.y + (newy[0] - newbound[1])
+            yr = ( 0, newbound[3]-newbound[1] )
+            yi = newy[0] - newbound[1]
         else:
-            yr = ( self.y+newbound[1], self.y+newbound[3] )
-            self.yi = self.y + newy[0]
+            yr = ( newbound[1], newbound[3] )
+            yi = newy[0]
 
-        self.calcbounds = [xr[0], yr[0], xr[1], yr[1]]
-        return self.calcbounds
+        return ( parttree, state.widths, (xr[0], yr[0], xr[1], yr[1]),
+                 xi, yi )
 
     def ensureInBox(self, minx = -32767, maxx = 32767,
                     miny = -32767, maxy = 32767, extraspace = False):
@@ -869,7 +935,7 @@ class Renderer(object):
 
         state = RenderState(self.font, self.painter,
                             self.xi, self.yi,
-                            self.alignhorz)
+                            self.alignhorz, widths=self.widths)
 
         # if the text is rotated, change the coordinate frame
         if self.angle != 0:
@@ -212,7 +212,7 @@ class TreeModel(qt4.QAbstractItemModel):
             if k in todelete:
                 todelete.remove(k)
                 self.beginRemoveRows(parentidx, i, i)
-                del self.nodes[c[i]._idx]
+                self._removeNodes(c[i])
                 del c[i]
                 self.endRemoveRows()
                 continue
@@ -235,7 +235,11 @@ class TreeModel(qt4.QAbstractItemModel):
                     clone = nlookup[k].cloneTo(root)
                     idx = clookup[k]._idx
                     clone._idx = idx
+                    clone.childnodes = c[i].childnodes
+                    for child in clone.childnodes:
+                        child.parent = clone
                     self.nodes[idx] = clone
+                    c[i] = clone
 
                     self.emit(qt4.SIGNAL('dataChanged(const QModelIndex &, '
                                          'const QModelIndex &)'),
@@ -261,3 +265,56 @@ class TreeModel(qt4.QAbstractItemModel):
         if toreset:
             self.root.data = newroot.data
             self.endResetModel()
+
+    def nodeIndex(self, node):
+        """Return index of the first column of node."""
+        if node is self.root:
+            return qt4.QModelIndex()
+        row = node.parent.childnodes.index(node)
+        return self.createIndex(row, 0, node._idx)
+
+    def _addNodes(self, node):
+        """Give node and its children indices in the model."""
+        node._idx = self.nodeindex
+        self.nodeindex += 1
+        self.nodes[node._idx] = node
+        for c in node.childnodes:
+            self._addNodes(c)
+
+    def _removeNodes(self, node):
+        """Remove indices of node and its children from the model."""
+        del self.nodes[node._idx]
+        for c in node.childnodes:
+            self._removeNodes(c)
+
+    def insertNodeSorted(self, parent, node):
+        """Insert node (and any children) as a child of parent node
+        in the displayed tree, keeping the children sorted."""
+        cdata = [c.data for c in parent.childnodes]
+        row = bisect.bisect_left(cdata, node.data)
+
+        self.beginInsertRows(self.nodeIndex(parent), row, row)
+        node.parent = parent
+        parent.childnodes.insert(row, node)
+        self._addNodes(node)
+        self.endInsertRows()
+
+    def removeNode(self, node):
+        """Remove node (and any children) from the displayed tree."""
+        parent = node.parent
+        row = parent.childnodes.index(node)
+
+        self.beginRemoveRows(self.nodeIndex(parent), row, row)
+        del parent.childnodes[row]
+        self._removeNodes(node)
+        self.endRemoveRows()
+
+    def changeNodeData(self, node, data):
+        """Change data of node in the displayed tree.
+
+        The node is not moved, so the first column should not change."""
+        node.data = data
+        idx = self.nodeIndex(node)
+        self.emit(qt4.SIGNAL('dataChanged(const QModelIndex &, '
+                             'const QModelIndex &)'),
+                  idx, self.createIndex(idx.row(), len(data)-1, node._idx))
@@ -221,7 +221,8 @@ class NonBlockingReaderThread(threading.Thread):
         threading.Thread.__init__(self)
         self.fileobject = fileobject
         self.lock = threading.Lock()
-        self.data = ''
+        # chunks of data read, or an exception if reading failed
+        self.data = []
         self.done = False
 
     def getNewData(self):
@@ -233,13 +234,14 @@ class NonBlockingReaderThread(threading.Thread):
         self.lock.acquire()
         data = self.data
         done = self.done
-        self.data = ''
+        if not isinstance(data, Exception):
+            self.data = []
         self.lock.release()
         if isinstance(data, Exception):
             # if the reader errored somewhere
             raise data
         else:
-            return data, done
+            return ''.join(data), done
 
     def run(self):
         """Do the reading from the file object."""
@@ -262,7 +264,7 @@ class NonBlockingReaderThread(threading.Thread):
                 break
 
             self.lock.acquire()
-            self.data += data
+            self.data.append(data)
             self.lock.release()
 
 # standard python encodings
@@ -316,12 +318,14 @@ class UnicodeCSVReader:
     """
 
     def __init__(self, f, dialect=csv.excel, encoding='utf-8', **kwds):
-        f = UTF8Recoder(f, encoding)
+        # UTF-8 files can be read directly without recoding
+        if codecs.lookup(encoding).name != 'utf-8':
+            f = UTF8Recoder(f, encoding)
         self.reader = csv.reader(f, dialect=dialect, **kwds)
 
     def next(self):
         row = self.reader.next()
-        return [unicode(s, 'utf-8') for s in row]
+        return [unicode(s, 'utf-8', 'ignore') for s in row]
 
     def __iter__(self):
         return self
@@ -386,6 +390,60 @@ def positionFloatingPopup(popup, widget):
     popup.move(x, y)
     popup.setFocus()
 
+class LRUCache(object):
+    """A dict-like cache which holds up to maxsize items, throwing
+    away the least recently used items when it becomes full.
+
+    The hits and misses attributes count the results of lookups.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.clear()
+
+    def clear(self):
+        """Remove all items and reset counters."""
+        # items are stored as [value, time last used]
+        self.items = {}
+        self.time = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Return value for key, or default if not present."""
+        try:
+            item = self.items[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.time += 1
+        item[1] = self.time
+        return item[0]
+
+    def __setitem__(self, key, value):
+        self.time += 1
+        self.items[key] = [value, self.time]
+
+        if len(self.items) > self.maxsize:
+            # keep the most recently used three quarters of the items
+            times = sorted( [i[1] for i in self.items.itervalues()] )
+            oldest = times[-max(1, self.maxsize*3//4)]
+            for k, item in self.items.items():
+                if item[1] < oldest:
+                    del self.items[k]
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def stats(self):
+        """Return string describing cache use."""
+        return 'LRUCache: %i items, %i hits, %i misses' % (
+            len(self.items), self.hits, self.misses)
+
 class BasicPaintHelper(object):
     """Basic helper used when painting widgets.
     Holds the scaling, dpi and size of the page.
@@ -95,14 +95,22 @@ def listen(args, quiet):
     from veusz.veusz_listen import openWindow
     openWindow(args, quiet=quiet)
 
-def export(exports, args):
-    '''A shortcut to load a set of files and export them.'''
-    import veusz.document as document
-    for expfn, vsz in zip(exports, args[1:]):
-        doc = document.Document()
-        ci = document.CommandInterpreter(doc)
-        ci.Load(vsz)
-        ci.run('Export(%s)' % repr(expfn))
+def export(exports, args, options):
+    '''A shortcut to load a set of files and export them.
+
+    Returns number of files which could not be exported.'''
+    from veusz.batchexport import batchExport
+    return batchExport(exports, args[1:],
+                       numprocesses=options.export_processes,
+                       allpages=options.export_all_pages,
+                       unsafemode=options.unsafe_mode,
+                       plugins=options.plugin or [],
+                       report=not options.quiet)
+
+def exportWorker():
+    '''Run as a worker process for exporting documents.'''
+    from veusz.batchexport import runWorker
+    runWorker()
 
 def mainwindow(args):
     '''Open the main window with any loaded files.'''
@@ -164,10 +172,20 @@ def run():
                       ' replacing veusz_listen')
     parser.add_option('--quiet', action='store_true',
                       help='if in listening mode, do not open a window but'
-                      ' execute commands quietly')
+                      ' execute commands quietly. If exporting, do not'
+                      ' write a report')
     parser.add_option('--export', action='append', metavar='FILE',
                       help='export the next document to this'
                       ' output image file, exiting when finished')
+    parser.add_option('--export-processes', type='int', metavar='N',
+                      default=1,
+                      help='number of processes to use when exporting'
+                      ' documents')
+    parser.add_option('--export-all-pages', action='store_true',
+                      help='export every page of each document, adding'
+                      ' the page number to the output filename')
+    parser.add_option('--export-worker', action='store_true',
+                      help=optparse.SUPPRESS_HELP)
     parser.add_option('--embed-remote', action='store_true',
                       help=optparse.SUPPRESS_HELP)
     parser.add_option('--plugin', action='append', metavar='FILE',
@@ -179,7 +197,7 @@ def run():
     args = convertArgsUnicode(args)
 
     splash = None
-    if options.listen or options.export:
+    if options.listen or options.export or options.export_worker:
         # do not show splash screen
         spash = None
     else:
@@ -210,7 +228,14 @@ def run():
         if len(options.export) != len(args)-1:
             parser.error(
                 'export option needs same number of documents and output files')
-        export(options.export, args)
+        if options.export_processes < 1:
+            parser.error('number of export processes should be at least 1')
+        if export(options.export, args, options) > 0:
+            sys.exit(1)
+        return
+    elif options.export_worker:
+        # export documents for another veusz process
+        exportWorker()
         return
     else:
         # standard start main window
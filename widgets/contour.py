@@ -24,6 +24,8 @@ as a C routine (taken from matplotlib) is used to trace the contours.
 
 from itertools import izip
 import sys
+import threading
+import Queue
 
 import veusz.qtall as qt4
 import numpy as N
@@ -43,6 +45,67 @@ def finitePoly(poly):
         out.append( line[validrows] )
     return out
 
+def meshCoordinates(data):
+    """Return arrays of the x and y coordinates of the pixel centres of
+    a 2d dataset."""
+
+    rangex, rangey = data.getDataRanges()
+    yw, xw = data.data.shape
+
+    xpts = N.empty( (yw, xw) )
+    xpts[:,:] = (N.arange(xw)+0.5)*((rangex[1]-rangex[0])/xw) + rangex[0]
+    ypts = N.empty( (yw, xw) )
+    ypts[:,:] = ( (N.arange(yw)+0.5)*((rangey[1]-rangey[0])/yw) +
+                  rangey[0] )[:,N.newaxis]
+    return xpts, ypts
+
+def traceContours(cntr, keys, numthreads=1):
+    """Trace contours using Cntr object cntr.
+
+    keys is a list of contour levels, or (level1, level2) tuples for
+    polygons between levels. If numthreads > 1, the levels are traced
+    in that number of threads (the triangulation of cntr should be
+    fixed first).
+
+    Returns a dict mapping each key to a list of Nx2 coordinate arrays.
+    """
+
+    out = {}
+    queue = Queue.Queue()
+    for key in keys:
+        queue.put(key)
+    errors = []
+
+    def tracer():
+        while True:
+            try:
+                key = queue.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                if isinstance(key, tuple):
+                    linelist = cntr.trace(key[0], key[1])
+                else:
+                    linelist = cntr.trace(key)
+                out[key] = finitePoly(linelist)
+            except Exception, e:
+                errors.append(e)
+
+    numthreads = min(numthreads, len(keys))
+    if numthreads <= 1:
+        tracer()
+    else:
+        threads = [threading.Thread(target=tracer)
+                   for i in xrange(numthreads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    return out
+
 class ContourFills(setting.Settings):
     """Settings for contour fills."""
     def __init__(self, name, **args):
@@ -139,6 +202,12 @@ class Contour(plotters.GenericPlotter):
         self._cachedpolygons = None
         self._cachedsubcontours = None
 
+        # contour engine for the dataset, the dataset and version it
+        # was made from, and the lines traced using it for each level
+        self._cntr = None
+        self._cntrdata = None
+        self._tracecache = {}
+
         if type(self) == Contour:
             self.readDefaults()
 
@@ -388,15 +457,20 @@ class Contour(plotters.GenericPlotter):
             s.levelsOut = []
             return False
 
+        # line and fill styles are not included, so changing these
+        # does not retrace the contours
         contsettings = ( s.min, s.max, s.numLevels, s.scaling,
                          s.SubLines.numLevels,
+                         len(s.Lines.lines) == 0,
                          len(s.Fills.fills) == 0 or s.Fills.hide,
                          len(s.SubLines.lines) == 0 or s.SubLines.hide,
                          tuple(s.manualLevels) )
 
-        if data is not self.lastdataset or contsettings != self.contsettings:
+        lastdataset = (data, data.dataVersion())
+        if ( lastdataset != self.lastdataset or
+             contsettings != self.contsettings ):
             self.updateContours()
-            self.lastdataset = data
+            self.lastdataset = lastdataset
             self.contsettings = contsettings
 
         return True
@@ -442,53 +516,74 @@ class Contour(plotters.GenericPlotter):
         minval, maxval, levels = self.calculateLevels()
         sublevels = self.calculateSubLevels(minval, maxval, levels)
 
-        # find coordinates of image coordinate bounds
         data = d.data[s.data]
-        rangex, rangey = data.getDataRanges()
         yw, xw = data.data.shape
 
-        if xw == 0 or yw == 0:
+        self._cachedcontours = None
+        self._cachedpolygons = None
+        self._cachedsubcontours = None
+
+        if xw == 0 or yw == 0 or self.Cntr is None:
+            return
+
+        self.updateContourEngine(data)
+
+        # work out which levels and polygons between levels are needed
+        linekeys = polykeys = subkeys = None
+        if len(s.Lines.lines) != 0:
+            linekeys = [float(l) for l in levels]
+        if len(s.Fills.fills) != 0 and len(levels) > 1 and not s.Fills.hide:
+            polykeys = [ (float(l1), float(l2))
+                         for l1, l2 in izip(levels[:-1], levels[1:]) ]
+        if len(sublevels) > 0:
+            subkeys = [float(l) for l in sublevels]
+
+        allkeys = set()
+        for keys in linekeys, polykeys, subkeys:
+            if keys is not None:
+                allkeys.update(keys)
+
+        # trace anything which has not been traced before
+        missing = [k for k in allkeys if k not in self._tracecache]
+        numthreads = 1
+        if hasattr(self._cntr, 'fixtriangulation'):
+            numthreads = qt4.QThread.idealThreadCount()
+        self._tracecache.update(
+            traceContours(self._cntr, missing, numthreads=numthreads) )
+
+        # forget levels no longer used
+        for key in self._tracecache.keys():
+            if key not in allkeys:
+                del self._tracecache[key]
+
+        if linekeys is not None:
+            self._cachedcontours = [self._tracecache[k] for k in linekeys]
+        if polykeys is not None:
+            self._cachedpolygons = [self._tracecache[k] for k in polykeys]
+        if subkeys is not None:
+            self._cachedsubcontours = [self._tracecache[k] for k in subkeys]
+
+    def updateContourEngine(self, data):
+        """Make a new contour engine if the dataset has changed."""
+
+        cntrdata = ( data, data.dataVersion(), data.data.shape,
+                     tuple(data.getDataRanges()) )
+        if self._cntr is not None and cntrdata == self._cntrdata:
             return
 
         # arrays containing coordinates of pixels in x and y
-        xpts = N.fromfunction(lambda y,x:
-                              (x+0.5)*((rangex[1]-rangex[0])/xw) + rangex[0],
-                              (yw, xw))
-        ypts = N.fromfunction(lambda y,x:
-                              (y+0.5)*((rangey[1]-rangey[0])/yw) + rangey[0],
-                              (yw, xw))
+        xpts, ypts = meshCoordinates(data)
 
         # only keep finite data points
         mask = N.logical_not(N.isfinite(data.data))
 
-        # iterate over the levels and trace the contours
-        self._cachedcontours = None
-        self._cachedpolygons = None
-        self._cachedsubcontours = None
-
-        if self.Cntr is not None:
-            c = self.Cntr(xpts, ypts, data.data, mask)
-
-            # trace the contour levels
-            if len(s.Lines.lines) != 0:
-                self._cachedcontours = []
-                for level in levels:
-                    linelist = c.trace(level)
-                    self._cachedcontours.append( finitePoly(linelist) )
-
-            # trace the polygons between the contours
-            if len(s.Fills.fills) != 0 and len(levels) > 1 and not s.Fills.hide:
-                self._cachedpolygons = []
-                for level1, level2 in izip(levels[:-1], levels[1:]):
-                    linelist = c.trace(level1, level2)
-                    self._cachedpolygons.append( finitePoly(linelist) )
-
-            # trace sub-levels
-            if len(sublevels) > 0:
-                self._cachedsubcontours = []
-                for level in sublevels:
-                    linelist = c.trace(level)
-                    self._cachedsubcontours.append( finitePoly(linelist) )
+        self._cntr = self.Cntr(xpts, ypts, data.data, mask)
+        if hasattr(self._cntr, 'fixtriangulation'):
+            # make the contours of each level independent of which
+            # levels were traced before, so they can be cached
+            self._cntr.fixtriangulation()
+        self._cntrdata = cntrdata
+        self._tracecache = {}
 
     def plotContourLabel(self, painter, number, xplt, yplt, showline):
         """Draw a label on a contour.
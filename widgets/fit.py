@@ -21,14 +21,17 @@
 
 import re
 import sys
+import os
+import time
 
 import numpy as N
 
+import veusz.qtall as qt4
 import veusz.document as document
 import veusz.setting as setting
 import veusz.utils as utils
 
-from function import FunctionPlotter
+from function import FunctionPlotter, FunctionChecker
 import widget
 
 try:
@@ -36,6 +39,11 @@ try:
 except ImportError:
     minuit = None
 
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
 def minuitFit(evalfunc, params, names, values, xvals, yvals, yserr):
     """Do fitting with minuit (if installed)."""
 
@@ -101,6 +109,114 @@ def minuitFit(evalfunc, params, names, values, xvals, yvals, yserr):
     vals = m.values
     return vals, retchi2, dof
 
+# function, derivative function and data for batch fits, inherited
+# by the worker processes when they are forked
+_batchfitstate = None
+# set while runBatchFits is running
+_batchfitrunning = False
+
+def _batchFitWorkerInit():
+    """Discard output from fits in batch fitting worker processes."""
+    sys.stdout = sys.stderr = open(os.devnull, 'w')
+
+def _batchFit(state, job):
+    """Do one fit of a batch fit.
+
+    state is (function, derivative function, data for each dataset)
+    job is (index of data, starting parameters)
+    Returns (index, fitted parameters or None, chi2, dof)."""
+
+    evalfunc, derivfunc, fitdata = state
+    index, params = job
+    try:
+        xvals, yvals, yserr = fitdata[index]
+        retn, chi2, dof = utils.fitLM(evalfunc, params, xvals, yvals, yserr,
+                                      derivfunc=derivfunc)
+    except Exception:
+        # a bad dataset or function should not stop the other fits
+        return index, None, N.inf, 0
+    return index, retn, chi2, dof
+
+def _batchFitJob(job):
+    """Do one fit of a batch fit in a worker process."""
+    return _batchFit(_batchfitstate, job)
+
+def runBatchFits(evalfunc, derivfunc, fitdata, jobs):
+    """Do fits of function evalfunc (with derivatives derivfunc or None).
+
+    fitdata is a list of (xvals, yvals, yserr) for each dataset
+    jobs is a list of (index in fitdata, starting parameters)
+
+    If possible, the fits are done by a pool of worker processes.
+    These are forked from this process, so they must only do the
+    fitting: forking copies just the calling thread, and anything the
+    other threads (e.g. rendering or capturing) were doing, or any Qt
+    state, cannot be used safely in the workers.
+
+    Progress is written to stdout. Qt events, other than user input,
+    are processed while waiting for results. Only one batch fit can be
+    run at a time.
+
+    Returns a list of (index, fitted parameters or None, chi2, dof)
+    in the order the fits finished.
+    """
+
+    global _batchfitstate, _batchfitrunning
+    if _batchfitrunning:
+        raise RuntimeError, 'A batch fit is already running'
+    state = (evalfunc, derivfunc, fitdata)
+
+    # the workers need to be forked to get the data and functions
+    numprocs = 1
+    if multiprocessing is not None and hasattr(os, 'fork'):
+        numprocs = min(multiprocessing.cpu_count(), len(jobs))
+
+    app = qt4.QCoreApplication.instance()
+    results = []
+    lastreport = [time.time()]
+    def progress():
+        if app is not None:
+            # the document should not be modified while fitting
+            app.processEvents(qt4.QEventLoop.ExcludeUserInputEvents)
+        if time.time() - lastreport[0] > 1.:
+            print 'Done %i of %i fits' % (len(results), len(jobs))
+            lastreport[0] = time.time()
+
+    _batchfitrunning = True
+    try:
+        if numprocs <= 1:
+            null = open(os.devnull, 'w')
+            for job in jobs:
+                oldout, olderr = sys.stdout, sys.stderr
+                sys.stdout = sys.stderr = null
+                try:
+                    result = _batchFit(state, job)
+                finally:
+                    sys.stdout, sys.stderr = oldout, olderr
+                results.append(result)
+                progress()
+            null.close()
+        else:
+            _batchfitstate = state
+            pool = multiprocessing.Pool(numprocs, _batchFitWorkerInit)
+            try:
+                resultiter = pool.imap_unordered(_batchFitJob, jobs)
+                while len(results) < len(jobs):
+                    try:
+                        results.append( resultiter.next(timeout=0.1) )
+                    except multiprocessing.TimeoutError:
+                        pass
+                    progress()
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+    finally:
+        _batchfitstate = None
+        _batchfitrunning = False
+
+    return results
+
 class Fit(FunctionPlotter):
     """A plotter to fit a function to data."""
 
@@ -114,9 +230,17 @@ class Fit(FunctionPlotter):
         if type(self) == Fit:
             self.readDefaults()
 
+        # checks and compiles derivative expression
+        self.derivchecker = FunctionChecker()
+
         self.addAction( widget.Action('fit', self.actionFit,
                                       descr = 'Fit function',
                                       usertext = 'Fit function') )
+        self.addAction( widget.Action('batchfit', self.actionBatchFit,
+                                      descr = 'Fit function to each of the '
+                                      'batch datasets, from one or more '
+                                      'starting points',
+                                      usertext = 'Batch fit') )
 
     @classmethod
     def addSettings(klass, s):
@@ -156,6 +280,30 @@ class Fit(FunctionPlotter):
                              usertext='Fit reduced &chi;<sup>2</sup>'),
                8, readonly=True )
 
+        s.add( setting.Str('derivatives', '',
+                           descr = 'Optional expression giving a list of '
+                           'the derivatives of the function with respect to '
+                           'each parameter, in alphabetical order of the '
+                           'parameters (e.g. [1, x] for a + b*x). Not used '
+                           'with Minuit.',
+                           usertext='Derivatives') )
+        s.add( setting.Datasets('batchData', (),
+                                descr = 'Datasets to fit separately in a '
+                                'batch fit, in place of the y dataset (x '
+                                'dataset if the variable is y)',
+                                usertext='Batch datasets') )
+        s.add( setting.Int('batchStarts', 1,
+                           minval = 1,
+                           descr = 'Number of starting points for each '
+                           'batch fit. Extra starting parameters are chosen '
+                           'randomly around the parameter values',
+                           usertext='Batch starts') )
+        s.add( setting.Str('batchOutput', 'fit_',
+                           descr = 'Prefix of names of datasets to hold the '
+                           'fitted parameters, chi2 and dof of each batch '
+                           'fit (blank for none)',
+                           usertext='Batch output') )
+
         f = s.get('function')
         f.newDefault('a + b*x')
         f.descr = 'Function to fit'
@@ -180,13 +328,13 @@ class Fit(FunctionPlotter):
                 axrange[1] = max(axrange[1], drange[1])
 
     def initEnviron(self):
-        """Copy data into environment."""
-        env = self.document.eval_context.copy()
-        env.update( self.settings.values )
-        return env
+        """Copy fit parameters into variables."""
+        return dict( self.settings.values )
 
-    def actionFit(self):
-        """Fit the data."""
+    def checkFunctions(self):
+        """Check and compile the function and derivative expressions.
+
+        Returns (okay, function to evaluate derivatives or None)."""
 
         s = self.settings
 
@@ -195,12 +343,26 @@ class Fit(FunctionPlotter):
             self.checker.check(s.function, s.variable)
         except RuntimeError, e:
             self.logEvalError(e)
-            return
+            return False, None
 
-        # populate the input parameters
-        names = s.values.keys()
-        names.sort()
-        params = N.array( [s.values[i] for i in names] )
+        # optional derivatives of function
+        derivfunc = None
+        if s.derivatives.strip():
+            try:
+                self.derivchecker.check(s.derivatives, s.variable)
+            except RuntimeError, e:
+                self.logEvalError(e)
+                return False, None
+            derivfunc = self.evalderivs
+        return True, derivfunc
+
+    def getFitData(self, depname):
+        """Get the data to fit, with depname the name of the dataset
+        of dependent values (y values if fitting a function of x).
+
+        Returns (xvals, yvals, yserr) or None if there is an error."""
+
+        s = self.settings
 
         # FIXME: loads of error handling!!
         d = self.document
@@ -208,14 +370,11 @@ class Fit(FunctionPlotter):
         # choose dataset depending on fit variable
         if s.variable == 'x':
             xvals = d.getData(s.xData).data
-            ydata = d.getData(s.yData)
-            yvals = ydata.data
-            yserr = ydata.serr
         else:
             xvals = d.getData(s.yData).data
-            ydata = d.getData(s.xData)
-            yvals = ydata.data
-            yserr = ydata.serr
+        ydata = d.getData(depname)
+        yvals = ydata.data
+        yserr = ydata.serr
 
         # if there are no errors on data
         if yserr is None:
@@ -263,13 +422,42 @@ class Fit(FunctionPlotter):
         # various error checks
         if len(xvals) == 0:
             sys.stderr.write('No data values. Not fitting.\n')
-            return
+            return None
         if len(xvals) != len(yvals) or len(xvals) != len(yserr):
             sys.stderr.write('Fit data not equal in length. Not fitting.\n')
-            return
-        if len(params) > len(xvals):
+            return None
+        if len(s.values) > len(xvals):
             sys.stderr.write('No degrees of freedom for fit. Not fitting\n')
+            return None
+
+        return xvals, yvals, yserr
+
+    def dependentDataName(self):
+        """Name of dataset of values the function is fitted to."""
+        s = self.settings
+        if s.variable == 'x':
+            return s.yData
+        else:
+            return s.xData
+
+    def actionFit(self):
+        """Fit the data."""
+
+        s = self.settings
+
+        okay, derivfunc = self.checkFunctions()
+        if not okay:
+            return
+
+        # populate the input parameters
+        names = s.values.keys()
+        names.sort()
+        params = N.array( [s.values[i] for i in names] )
+
+        fitdata = self.getFitData(self.dependentDataName())
+        if fitdata is None:
             return
+        xvals, yvals, yserr = fitdata
 
         # actually do the fit, either via Minuit or our own LM fitter
         chi2 = 1
@@ -279,13 +467,30 @@ class Fit(FunctionPlotter):
             vals, chi2, dof = minuitFit(self.evalfunc, params, names, s.values, xvals, yvals, yserr)
         else:
             print 'Minuit not available, falling back to simple L-M fitting:'
-            retn, chi2, dof = utils.fitLM(self.evalfunc, params,
-                                          xvals,
-                                          yvals, yserr)
+            try:
+                retn, chi2, dof = utils.fitLM(self.evalfunc, params,
+                                              xvals,
+                                              yvals, yserr,
+                                              derivfunc=derivfunc)
+            except (RuntimeError, ValueError), e:
+                # errors in derivatives
+                self.logEvalError(e)
+                return
             vals = {}
             for i, v in zip(names, retn):
                 vals[i] = float(v)
 
+        # actually change all the settings
+        self.document.applyOperation(
+            document.OperationMultiple(
+                self.fitResultOperations(vals, chi2, dof), descr='fit') )
+
+    def fitResultOperations(self, vals, chi2, dof):
+        """Return list of operations to set the settings to the results
+        of a fit."""
+
+        s = self.settings
+
         # list of operations do we can undo the changes
         operations = []
                                       
@@ -306,13 +511,85 @@ class Fit(FunctionPlotter):
         expr = self.generateOutputExpr(vals)
         operations.append( document.OperationSettingSet(s.get('outExpr'), expr) )
 
-        # actually change all the settings
-        d.applyOperation(
-            document.OperationMultiple(operations, descr='fit') )
-    
-    def evalfunc(self, params, xvals):
+        return operations
+
+    def actionBatchFit(self):
+        """Fit the function to each of the batch datasets, starting
+        from one or more sets of parameters."""
+
+        s = self.settings
+
+        okay, derivfunc = self.checkFunctions()
+        if not okay:
+            return
+
+        names = s.values.keys()
+        names.sort()
+        params = N.array( [s.values[i] for i in names], dtype=N.float64 )
+
+        # data for each dataset, or None if it cannot be fitted
+        depnames = list(s.batchData)
+        if not depnames:
+            depnames = [self.dependentDataName()]
+        fitdata = [self.getFitData(name) for name in depnames]
+
+        # starting parameters, with extra ones chosen randomly around
+        # the current values
+        starts = [params]
+        scale = N.where(params == 0., 1., N.abs(params))
+        randstate = N.random.RandomState(0)
+        for i in xrange(s.batchStarts-1):
+            starts.append( params + randstate.normal(size=len(params))*scale )
+
+        jobs = [ (i, start) for i, data in enumerate(fitdata)
+                 if data is not None for start in starts ]
+        if not jobs:
+            return
+
+        if _batchfitrunning:
+            print 'A batch fit is already running'
+            return
+
+        print 'Batch fitting %i dataset(s) from %i starting point(s)' % (
+            len(jobs) / len(starts), len(starts))
+        results = runBatchFits(self.evalfunc, derivfunc, fitdata, jobs)
+
+        # keep the best fit for each dataset
+        best = {}
+        for index, retn, chi2, dof in results:
+            if ( retn is not None and N.isfinite(chi2) and
+                 (index not in best or chi2 < best[index][1]) ):
+                best[index] = (retn, chi2, dof)
+
+        print 'Fitted %i of %i dataset(s)' % (len(best), len(depnames))
+        if not best:
+            return
+
+        operations = []
+
+        # datasets of results for each dataset fitted
+        if s.batchOutput:
+            outvals = N.zeros( (len(names)+2, len(depnames)) ) + N.nan
+            for index, (retn, chi2, dof) in best.iteritems():
+                outvals[:,index] = list(retn) + [chi2, dof]
+            for name, vals in zip(names + ['chi2', 'dof'], outvals):
+                operations.append( document.OperationDatasetSet(
+                        s.batchOutput + name, document.Dataset(data=vals)) )
+
+        # settings from the first dataset fitted
+        retn, chi2, dof = best[min(best.keys())]
+        vals = {}
+        for i, v in zip(names, retn):
+            vals[i] = float(v)
+        operations += self.fitResultOperations(vals, chi2, dof)
+
+        self.document.applyOperation(
+            document.OperationMultiple(operations, descr='batch fit') )
+
+    def fitEnviron(self, params, xvals):
+        """Make an environment to evaluate the function for the
+        parameters and x values given."""
 
-        # make an environment
         env = self.initEnviron()
         s = self.settings
         env[s.variable] = xvals
@@ -322,12 +599,29 @@ class Fit(FunctionPlotter):
         names.sort()
         for name, val in zip(names, params):
             env[name] = val
+        return env
+
+    def evalfunc(self, params, xvals):
+
+        # make an environment
+        env = self.fitEnviron(params, xvals)
 
         try:
-            return eval(self.checker.compiled, env) + xvals*0.
+            return ( self.document.evalCode(self.checker.compiled, env) +
+                     xvals*0. )
         except:
             return N.nan
 
+    def evalderivs(self, params, xvals):
+        """Evaluate the derivatives of the function with respect to
+        each parameter."""
+
+        env = self.fitEnviron(params, xvals)
+        try:
+            return self.document.evalCode(self.derivchecker.compiled, env)
+        except Exception, e:
+            raise RuntimeError('Cannot evaluate derivatives: %s' % unicode(e))
+
     def generateOutputExpr(self, vals):
         """Try to generate text form of output expression.
         
@@ -194,7 +194,8 @@ class FunctionPlotter(GenericPlotter):
         env = self.initEnviron()
         env[s.variable] = points
         try:
-            vals = eval(self.checker.compiled, env) + points*0.
+            vals = ( self.document.evalCode(self.checker.compiled, env) +
+                     points*0. )
         except:
             # something wrong in the evaluation
             return
@@ -290,8 +291,9 @@ class FunctionPlotter(GenericPlotter):
             painter.drawLine( qt4.QPointF(x, yp), qt4.QPointF(x+width, yp) )
 
     def initEnviron(self):
-        """Set up function environment."""
-        return self.document.eval_context.copy()
+        """Set up variables for evaluating function (in addition to
+        the document context)."""
+        return {}
 
     def getIndependentPoints(self, axes, posn):
         """Calculate the real and screen points to plot for the independent axis"""
@@ -352,7 +354,8 @@ class FunctionPlotter(GenericPlotter):
         env = self.initEnviron()
         env[s.variable] = axispts
         try:
-            results = eval(self.checker.compiled, env) + N.zeros(axispts.shape)
+            results = ( self.document.evalCode(self.checker.compiled, env) +
+                        N.zeros(axispts.shape) )
             resultpts = axis2.dataToPlotterCoords(posn, results)
         except Exception, e:
             self.logEvalError(e)
@@ -324,7 +324,7 @@ class Grid(widget.Widget):
                 coutbound[3] = parentposn[3]
 
         # draw widget
-        child.draw(bounds, phelper, outerbounds=coutbound)
+        phelper.drawWidget(child, bounds, outerbounds=coutbound)
 
         # debugging
         #painter.setPen(qt4.QPen(qt4.Qt.red))
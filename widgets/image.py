@@ -20,7 +20,6 @@
 
 import string
 import os.path
-import struct
 
 import veusz.qtall as qt4
 import numpy as N
@@ -50,32 +49,41 @@ def applyScaling(data, mode, minval, maxval):
     # catch naughty people by hardcoding a range
     if minval == maxval:
         minval, maxval = 0., 1.
-        
+
+    # the transformation is done in place in a single copy of the data
+    data = N.array(data, dtype=N.float64)
+
     if mode == 'linear':
         # linear scaling
-        data = (data - minval) / (maxval - minval)
+        data -= minval
+        data *= 1. / (maxval - minval)
 
     elif mode == 'sqrt':
         # sqrt scaling
         # translate into fractions of range
-        data = (data - minval) / (maxval - minval)
+        data -= minval
+        data *= 1. / (maxval - minval)
         # clip off any bad sqrts
-        data[data < 0.] = 0.
+        N.maximum(data, 0., data)
         # actually do the sqrt transform
-        data = N.sqrt(data)
+        N.sqrt(data, data)
 
     elif mode == 'log':
         # log scaling of image
         # clip any values less than lowermin
         lowermin = data < minval
-        data = N.log(data - (minval - 1)) / N.log(maxval - (minval - 1))
+        data -= minval - 1
+        N.log(data, data)
+        data *= 1. / N.log(maxval - (minval - 1))
         data[lowermin] = 0.
 
     elif mode == 'squared':
         # squared scaling
         # clip any negative values
         lowermin = data < minval
-        data = (data-minval)**2 / (maxval-minval)**2
+        data -= minval
+        N.square(data, data)
+        data *= 1. / (maxval-minval)**2
         data[lowermin] = 0.
 
     else:
@@ -83,60 +91,196 @@ def applyScaling(data, mode, minval, maxval):
 
     return data
 
-def slowNumpyToQImage(img, cmap, transparencyimg):
-    """Slow version of routine to convert numpy array to QImage
-    This is hard work in Python, but it was like this originally.
+class ColorMapLUT(object):
+    """A lookup table to convert values between 0 and 1 to colours.
 
-    img: numpy array to convert to QImage
-    cmap: 2D array of colors (BGRA rows)
-    forcetrans: force image to have alpha component."""
+    The table holds a 32 bit QImage pixel value for each of a set of
+    equally spaced values, and transparent pixels for non-finite
+    values.
+    """
 
-    if struct.pack("h", 1) == "\000\001":
-        # have to swap colors for big endian architectures
-        cmap2 = cmap.copy()
-        cmap2[:,0] = cmap[:,3]
-        cmap2[:,1] = cmap[:,2]
-        cmap2[:,2] = cmap[:,1]
-        cmap2[:,3] = cmap[:,0]
-        cmap = cmap2
+    def __init__(self, cmap, trans):
+        """cmap is a colour map (numpy array of BGRalpha quads)
+        trans is a transparency percentage to apply to the colours."""
 
-    fracs = N.clip(N.ravel(img), 0., 1.)
+        # apply transparency
+        if trans != 0:
+            cmap = cmap.copy()
+            cmap[:,3] = (cmap[:,3].astype(N.float32) * (100-trans) /
+                         100.).astype(N.intc)
+        self.cmap = N.ascontiguousarray(cmap)
+        self.hasalpha = bool( N.any(cmap[:,3] != 255) )
+        self._table = None
+
+    def _getTable(self):
+        """Make the lookup table if necessary."""
+        if self._table is not None:
+            return self._table
+
+        # use enough entries to make colours differ by at most a
+        # level from interpolating between the bands
+        cmap = self.cmap
+        numbands = max(1, cmap.shape[0]-1)
+        size = max(1024, numbands*256)
+
+        # linearly interpolate between the band and the next band
+        vals = N.arange(size) * (1./(size-1))
+        bands = N.clip( (vals*numbands).astype(N.intc), 0, numbands-1 )
+        deltas = (vals*numbands - bands)[:,N.newaxis]
+        bands2 = N.minimum(bands+1, cmap.shape[0]-1)
+        cols = ( (1.-deltas)*cmap[bands] +
+                 deltas*cmap[bands2] ).astype(N.uint32)
+
+        # combine into QRgb values, with a final transparent entry
+        table = N.zeros(size+1, dtype=N.uint32)
+        table[:size] = ( (cols[:,3] << 24) | (cols[:,2] << 16) |
+                         (cols[:,1] << 8) | cols[:,0] )
+        self._table = table
+        return table
+
+    def toQImage(self, fracs, transimg=None):
+        """Convert 2d numpy array of values between 0 and 1 to a QImage.
+
+        transimg is an optional 2d array with the fraction of each
+        pixel's alpha to keep
+        """
 
-    # Work out which is the minimum colour map. Assumes we have <255 bands.
-    numbands = cmap.shape[0]-1
-    bands = (fracs*numbands).astype(N.uint8)
-    bands = N.clip(bands, 0, numbands-1)
+        if not slowfuncs:
+            img = numpyToQImage(fracs, self.cmap, transimg is not None)
+            if transimg is not None:
+                applyImageTransparancy(img, transimg)
+            return img
+
+        table = self._getTable()
+        size = len(table) - 1
+
+        # QImage rows go from the top, so reverse the rows
+        fracs = fracs[::-1]
+
+        # convert values to indices in table, using the last
+        # transparent entry for non-finite values
+        indices = N.clip(fracs, 0., 1.)
+        indices *= size - 1
+        N.rint(indices, indices)
+        indices[ ~N.isfinite(fracs) ] = size
+        pixels = N.empty(fracs.shape, dtype=N.uint32)
+        table.take(indices.astype(N.intp), out=pixels)
+
+        if transimg is not None:
+            # scale alpha of overlapping pixels by transparency values
+            yw = min(fracs.shape[0], transimg.shape[0])
+            xw = min(fracs.shape[1], transimg.shape[1])
+            region = pixels[::-1][:yw, :xw]
+            tvals = N.clip(transimg[:yw, :xw], 0., 1.)
+            tvals[ ~N.isfinite(tvals) ] = 0.
+            alpha = ( (region >> 24) * tvals ).astype(N.uint32)
+            region &= 0xffffff
+            region |= alpha << 24
+
+        fmt = qt4.QImage.Format_RGB32
+        if self.hasalpha or transimg is not None:
+            # any transparency
+            fmt = qt4.QImage.Format_ARGB32
+
+        s = pixels.tostring()
+        img = qt4.QImage(s, fracs.shape[1], fracs.shape[0], fmt)
+
+        # hack to ensure string isn't freed before QImage
+        img.veusz_string = s
+        return img
 
-    # work out fractional difference of data from band to next band
-    deltafracs = (fracs - bands * (1./numbands)) * numbands
+# recently used colour map lookup tables
+_lutcache = utils.LRUCache(16)
 
-    # need to make a 2-dimensional array to multiply against triplets
-    deltafracs.shape = (deltafracs.shape[0], 1)
+def getColorMapLUT(cmap, trans):
+    """Get a (possibly cached) ColorMapLUT for the colour map and
+    transparency given."""
 
-    # calculate BGRalpha quadruplets
-    # this is a linear interpolation between the band and the next band
-    quads = (deltafracs*cmap[bands+1] +
-             (1.-deltafracs)*cmap[bands]).astype(N.uint8)
+    key = (cmap.shape, cmap.tostring(), trans)
+    lut = _lutcache.get(key)
+    if lut is None:
+        lut = _lutcache[key] = ColorMapLUT(cmap, trans)
+    return lut
 
-    # apply transparency if a transparency image is set
-    if transparencyimg is not None and transparencyimg.shape == img.shape:
-        quads[:,3] = ( N.clip(N.ravel(transparencyimg), 0., 1.) *
-                       quads[:,3] ).astype(N.uint8)
+def reduceImage(data, mode):
+    """Halve the size of a 2d array in each direction.
 
-    # convert 32bit quads to a Qt QImage
-    s = quads.tostring()
+    Each 2x2 block of values is combined using mode ('mean', 'min' or
+    'max'), ignoring non-finite values. An odd final row or column is
+    combined with a copy of itself.
+    """
 
-    fmt = qt4.QImage.Format_RGB32
-    if N.any(cmap[:,3] != 255) or transparencyimg is not None:
-        # any transparency
-        fmt = qt4.QImage.Format_ARGB32
+    if data.shape[0] % 2 != 0:
+        data = N.vstack( (data, data[-1:,:]) )
+    if data.shape[1] % 2 != 0:
+        data = N.hstack( (data, data[:,-1:]) )
+
+    blocks = ( data[0::2,0::2], data[0::2,1::2],
+               data[1::2,0::2], data[1::2,1::2] )
+
+    if mode == 'min':
+        return N.fmin( N.fmin(blocks[0], blocks[1]),
+                       N.fmin(blocks[2], blocks[3]) )
+    elif mode == 'max':
+        return N.fmax( N.fmax(blocks[0], blocks[1]),
+                       N.fmax(blocks[2], blocks[3]) )
+    elif mode == 'mean':
+        total = N.zeros(blocks[0].shape)
+        count = N.zeros(blocks[0].shape)
+        for block in blocks:
+            finite = N.isfinite(block)
+            total[finite] += block[finite]
+            count += finite
+        total[count == 0] = N.nan
+        return total / N.where(count == 0, 1, count)
+    else:
+        raise RuntimeError, 'Invalid reduction mode "%s"' % mode
+
+class ImagePyramid(object):
+    """A 2d array with copies at successively halved resolutions.
+
+    The reduced levels are made when they are first needed.
+    """
 
-    img = qt4.QImage(s, img.shape[1], img.shape[0], fmt)
-    img = img.mirrored()
+    def __init__(self, data, mode):
+        """data is the full resolution array, and mode is the method
+        to combine values (see reduceImage)."""
+        self.levels = [data]
+        self.mode = mode
 
-    # hack to ensure string isn't freed before QImage
-    img.veusz_string = s
-    return img
+    def getLevel(self, level):
+        """Get data at level (0 is full resolution).
+
+        Returns (level, data), where level may be lower than
+        requested if the data cannot be reduced further."""
+
+        while len(self.levels) <= level:
+            last = self.levels[-1]
+            if last.shape[0] <= 1 and last.shape[1] <= 1:
+                break
+            self.levels.append( reduceImage(last, self.mode) )
+
+        level = min(level, len(self.levels)-1)
+        return level, self.levels[level]
+
+def visiblePixels(coord0, pixsize, numpix, minpos, maxpos):
+    """Find which pixels in a row of pixels are visible.
+
+    coord0 is the plotter coordinate of the start of the row
+    pixsize is the size of each pixel (which may be negative)
+    numpix is the number of pixels
+    minpos and maxpos are the range of visible plotter coordinates
+
+    Returns (start, stop) indices of visible pixels.
+    """
+
+    if pixsize == 0:
+        return 0, 0
+    t1 = (minpos-coord0) / pixsize
+    t2 = (maxpos-coord0) / pixsize
+    start = max( 0, int(N.floor(min(t1, t2))) )
+    stop = min( numpix, int(N.ceil(max(t1, t2))) )
+    return start, max(start, stop)
 
 class Image(plotters.GenericPlotter):
     """A class which plots an image on a graph with a specified
@@ -158,6 +302,18 @@ class Image(plotters.GenericPlotter):
         self.lastdataset = None
         self.schangeset = -1
 
+        # reduced resolution copies of the data and transparency data,
+        # with the datasets, versions and modes they were made from
+        self._pyramid = None
+        self._pyramidkey = None
+        self._transpyramid = None
+        self._transpyramidkey = None
+
+        # last colour mapped part of the image and the key it was
+        # made with
+        self._image = None
+        self._imagekey = None
+
         # this is the range of data plotted, computed when plot is changed
         # the ColorBar object needs this later
         self.cacheddatarange = (0, 1)
@@ -225,6 +381,14 @@ class Image(plotters.GenericPlotter):
                              usertext = 'Smooth',
                              formatting = True ) )
 
+        s.add( setting.Choice( 'downsample',
+                               ('mean', 'min', 'max', 'none'), 'mean',
+                               descr = 'Method to combine pixels when the '
+                               'image is reduced to the output resolution '
+                               '(only for bitmap output and the plot '
+                               'window)',
+                               usertext = 'Downsample' ) )
+
     def _getUserDescription(self):
         """User friendly description."""
         s = self.settings
@@ -300,36 +464,20 @@ class Image(plotters.GenericPlotter):
             minval, maxval = maxval, minval
             cmap = cmap[::-1]
 
-        # apply transparency
-        if trans != 0:
-            cmap = cmap.copy()
-            cmap[:,3] = (cmap[:,3].astype(N.float32) * (100-trans) /
-                         100.).astype(N.intc)
-        
         # apply scaling of data
         fracs = applyScaling(datain, scaling, minval, maxval)
 
-        if not slowfuncs:
-            img = numpyToQImage(fracs, cmap, transimg is not None)
-            if transimg is not None:
-                applyImageTransparancy(img, transimg)
-        else:
-            img = slowNumpyToQImage(fracs, cmap, transimg)
-        return img
+        return getColorMapLUT(cmap, trans).toQImage(fracs, transimg)
 
     applyColorMap = classmethod(applyColorMap)
 
     def updateImage(self):
-        """Update the image with new contents."""
+        """Update the range of values and colour map of the image."""
 
         s = self.settings
         d = self.document
         data = d.data[s.data]
 
-        transimg = None
-        if s.transparencyData in d.data:
-            transimg = d.data[s.transparencyData].data
-
         minval = s.min
         if minval == 'Auto':
             minval = N.nanmin(data.data)
@@ -343,11 +491,63 @@ class Image(plotters.GenericPlotter):
         cmap = self.colormaps[s.colorMap]
         if s.colorInvert:
             cmap = cmap[::-1]
+        self.cachedcolormap = cmap
+
+        # image is colour mapped when drawn
+        self._image = self._imagekey = None
+
+    def getPyramids(self, data, mode):
+        """Get image pyramids for the data and transparency data
+        (or None if there is no transparency data)."""
+
+        s = self.settings
+        d = self.document
+
+        key = (data, data.dataVersion(), mode)
+        if key != self._pyramidkey:
+            self._pyramid = ImagePyramid(data.data, mode)
+            self._pyramidkey = key
+
+        transdata = d.data.get(s.transparencyData)
+        if transdata is None or transdata.dimensions != 2:
+            self._transpyramid = self._transpyramidkey = None
+        else:
+            key = (transdata, transdata.dataVersion())
+            if key != self._transpyramidkey:
+                self._transpyramid = ImagePyramid(transdata.data, 'mean')
+                self._transpyramidkey = key
+
+        return self._pyramid, self._transpyramid
+
+    def makeImage(self, data, mode, level, xrange, yrange):
+        """Make a QImage of part of the data at a pyramid level.
+
+        mode is the method used to make the pyramid
+        xrange and yrange are (start, stop) indices of pixels at the
+        level.
+        """
 
-        self.image = self.applyColorMap(cmap, s.colorScaling,
-                                        data.data,
-                                        minval, maxval, s.transparency,
-                                        transimg=transimg)
+        s = self.settings
+        key = (self.schangeset, data, mode, level, xrange, yrange)
+        if key == self._imagekey:
+            return self._image
+
+        pyramid, transpyramid = self.getPyramids(data, mode)
+        level, vals = pyramid.getLevel(level)
+        vals = vals[yrange[0]:yrange[1], xrange[0]:xrange[1]]
+
+        transimg = None
+        if transpyramid is not None:
+            transimg = transpyramid.getLevel(level)[1]
+            transimg = transimg[yrange[0]:yrange[1], xrange[0]:xrange[1]]
+
+        minval, maxval = self.cacheddatarange
+        self._image = self.applyColorMap(self.cachedcolormap,
+                                         s.colorScaling, vals,
+                                         minval, maxval, s.transparency,
+                                         transimg=transimg)
+        self._imagekey = key
+        return self._image
 
     def providesAxesDependency(self):
         """Range information provided by widget."""
@@ -379,53 +579,6 @@ class Image(plotters.GenericPlotter):
             axrange[0] = min( axrange[0], dyrange[0] )
             axrange[1] = max( axrange[1], dyrange[1] )
 
-    def cutImageToFit(self, pltx, plty, posn):
-        x1, y1, x2, y2 = posn
-        pltx1, pltx2 = pltx
-        pltw = pltx2-pltx1
-        plty2, plty1 = plty
-        plth = plty2-plty1
-
-        imw = self.image.width()
-        imh = self.image.height()
-        pixw = pltw / float(imw)
-        pixh = plth / float(imh)
-        cutr = [0, 0, imw-1, imh-1]
-
-        # work out where image intercepts posn, and make sure image
-        # fills at least that area
-
-        # need to chop left
-        if pltx1 < x1:
-            d = int((x1-pltx1) / pixw)
-            cutr[0] += d
-            pltx[0] += d*pixw
-
-        # need to chop right
-        if pltx2 > x2:
-            d = max(0, int((pltx2-x2) / pixw) - 1)
-            cutr[2] -= d
-            pltx[1] -= d*pixw
-
-        # chop top
-        if plty1 < y1:
-            d = int((y1-plty1) / pixh)
-            cutr[1] += d
-            plty[1] += d*pixh
-            
-        # chop bottom
-        if plty2 > y2:
-            d = max(0, int((plty2-y2) / pixh) - 1)
-            cutr[3] -= d
-            plty[0] -= d*pixh
-
-        # create chopped-down image
-        newimage = self.image.copy(cutr[0], cutr[1],
-                                   cutr[2]-cutr[0]+1, cutr[3]-cutr[1]+1)
-
-        # return new image coordinates and image
-        return pltx, plty, newimage
-
     def makeColorbarImage(self, direction='horz'):
         """Make a QImage colorbar for the current plot.
 
@@ -535,15 +688,48 @@ class Image(plotters.GenericPlotter):
         coordsx = axes[0].dataToPlotterCoords(posn, N.array(rangex))
         coordsy = axes[1].dataToPlotterCoords(posn, N.array(rangey))
 
-        # truncate image down if necessary
+        yw, xw = data.data.shape
+        if xw == 0 or yw == 0:
+            return
+
+        # use a reduced resolution copy of the data if the pixels
+        # are smaller than the output pixels
+        mode = s.downsample
+        level = 0
+        if ( mode != 'none' and phelper.bitmapoutput and
+             coordsx[1] != coordsx[0] and coordsy[1] != coordsy[0] ):
+            pixperoutput = min( abs(xw / (coordsx[1]-coordsx[0])),
+                                abs(yw / (coordsy[1]-coordsy[0])) )
+            if pixperoutput >= 2:
+                level = int( N.log2(pixperoutput) )
+        if mode == 'none':
+            # only the full resolution data are used
+            mode = 'mean'
+        level, vals = self.getPyramids(data, mode)[0].getLevel(level)
+
+        # size of pixels at level in plotter coordinates
         # This assumes linear pixels!
-        if ( coordsx[0] < x1 or coordsx[1] > x2 or
-             coordsy[0] < y1 or coordsy[1] > y2 ):
+        pixw = (coordsx[1]-coordsx[0]) / xw * 2**level
+        pixh = (coordsy[1]-coordsy[0]) / yw * 2**level
 
-            coordsx, coordsy, image = self.cutImageToFit(coordsx, coordsy,
-                                                         posn)
-        else:
-            image = self.image
+        # only colour map the visible pixels
+        xrange = visiblePixels(coordsx[0], pixw, vals.shape[1], x1, x2)
+        yrange = visiblePixels(coordsy[0], pixh, vals.shape[0], y1, y2)
+        if xrange[0] == xrange[1] or yrange[0] == yrange[1]:
+            return
+        image = self.makeImage(data, mode, level, xrange, yrange)
+
+        # odd rows and columns are padded when reducing, so the last
+        # pixels at a level can cover more data pixels than exist
+        # work out the fraction of the image covering the data
+        scale = 2**level
+        xstop = min(xrange[1]*scale, xw)
+        ystop = min(yrange[1]*scale, yw)
+        xfrac = (xstop - xrange[0]*scale) / float((xrange[1]-xrange[0])*scale)
+        yfrac = (ystop - yrange[0]*scale) / float((yrange[1]-yrange[0])*scale)
+
+        coordsx = [ coordsx[0] + xrange[0]*pixw, coordsx[0] + xrange[1]*pixw ]
+        coordsy = [ coordsy[0] + yrange[0]*pixh, coordsy[0] + yrange[1]*pixh ]
 
         # clip data within bounds of plotter
         clip = self.clipAxesBounds(axes, posn)
@@ -555,6 +741,13 @@ class Image(plotters.GenericPlotter):
                                   qt4.Qt.IgnoreAspectRatio,
                                   qt4.Qt.SmoothTransformation )
 
+        # crop the padding: the last column is on the right of the
+        # image, and the last row at the top
+        srcrect = qt4.QRectF( 0, image.height()*(1-yfrac),
+                              image.width()*xfrac, image.height()*yfrac )
+        coordsx[1] = coordsx[0] + (coordsx[1]-coordsx[0])*xfrac
+        coordsy[1] = coordsy[0] + (coordsy[1]-coordsy[0])*yfrac
+
         # get position and size of output image
         xp, yp = coordsx[0], coordsy[1]
         xw = coordsx[1]-coordsx[0]
@@ -574,7 +767,7 @@ class Image(plotters.GenericPlotter):
             painter.scale(xscale, yscale)
 
         # draw image
-        painter.drawImage(qt4.QRectF(xp, yp, abs(xw), abs(yw)), image)
+        painter.drawImage(qt4.QRectF(xp, yp, abs(xw), abs(yw)), image, srcrect)
 
         # restore painter if image was inverted
         if xscale != 1 or yscale != 1:
@@ -85,8 +85,9 @@ class NonOrthFunction(Widget):
                            ' over', usertext='Steps', formatting=True), 0 )
 
     def initEnviron(self):
-        '''Set up function environment.'''
-        return self.document.eval_context.copy()
+        '''Set up variables for evaluating function (in addition to
+        the document context).'''
+        return {}
        
     def logEvalError(self, ex):
         '''Write error message to document log for exception ex.'''
@@ -115,7 +116,8 @@ class NonOrthFunction(Widget):
         env = self.initEnviron()
         env[s.variable] = invals
         try:
-            vals = eval(self.checker.compiled, env) + invals*0.
+            vals = ( self.document.evalCode(self.checker.compiled, env) +
+                     invals*0. )
         except Exception, e:
             self.logEvalError(e)
             vals = invals = N.array([])
@@ -30,12 +30,27 @@ import widget
 import graph
 import page
 
+def _axesCacheKey(plotter, axesnames):
+    """Return key identifying state of axes used by plotter."""
+    if not hasattr(plotter.parent, 'getAxes'):
+        return None
+    key = []
+    for axis in plotter.parent.getAxes(axesnames):
+        if axis is None:
+            key.append(None)
+        else:
+            key.append( (tuple(axis.getPlottedRange()),
+                         widget.settingsCacheKey(axis.settings,
+                                                 plotter.document)) )
+    return tuple(key)
+
 class GenericPlotter(widget.Widget):
     """Generic plotter."""
 
     typename='genericplotter'
     allowedparenttypes=[graph.Graph]
     isplotter = True
+    cacherender = True
 
     def __init__(self, parent, name=None):
         """Initialise object, setting axes."""
@@ -61,6 +76,14 @@ class GenericPlotter(widget.Widget):
         s = self.settings
         return (s.xAxis, s.yAxis)
 
+    def renderCacheKey(self, parentposn, painthelper, outerbounds):
+        """Include state of axes in key."""
+        key = widget.Widget.renderCacheKey(self, parentposn, painthelper,
+                                           outerbounds)
+        if key is None:
+            return None
+        return key + ( _axesCacheKey(self, self.getAxesNames()), )
+
     def lookupAxis(self, axisname):
         """Find widget associated with axisname."""
         w = self.parent
@@ -138,6 +161,8 @@ class FreePlotter(widget.Widget):
     """A plotter which can be plotted on the page or in a graph."""
 
     allowedparenttypes = [graph.Graph, page.Page]
+    cacherender = True
+
     def __init__(self, parent, name=None):
         """Initialise object, setting axes."""
         widget.Widget.__init__(self, parent, name=name)
@@ -170,6 +195,15 @@ class FreePlotter(widget.Widget):
                             descr = 'Name of Y-axis to use',
                             usertext='Y axis') )
 
+    def renderCacheKey(self, parentposn, painthelper, outerbounds):
+        """Include state of axes in key."""
+        key = widget.Widget.renderCacheKey(self, parentposn, painthelper,
+                                           outerbounds)
+        if key is None:
+            return None
+        s = self.settings
+        return key + ( _axesCacheKey(self, (s.xAxis, s.yAxis)), )
+
     def _getPlotterCoords(self, posn):
         """Calculate coordinates from relative or axis positioning."""
 
@@ -200,6 +200,54 @@ _errorBarFunctionMap = {
     'linevertbar': (_errorBarsBar, _errorBarsFilled),
     }
 
+def _decimateLine(xvals, yvals):
+    """Reduce the points in a line to those visible at pixel resolution.
+
+    For each run of consecutive points within the same pixel column,
+    the first, last, minimum and maximum points are kept, so the line
+    covers the same pixels.
+    Returns new x and y arrays."""
+
+    if len(xvals) < 5:
+        return xvals, yvals
+
+    # split points into runs of points with the same pixel column
+    cols = N.floor(xvals)
+    starts = N.concatenate( ([True], cols[1:] != cols[:-1]) )
+    runs = N.cumsum(starts) - 1
+    startidx = N.nonzero(starts)[0]
+    if len(startidx)*4 >= len(xvals):
+        return xvals, yvals
+    endidx = N.concatenate( (startidx[1:]-1, [len(xvals)-1]) )
+
+    # sort by y within each run to find the extreme points of each run
+    order = N.lexsort( (yvals, runs) )
+    minidx = order[startidx]
+    maxidx = order[endidx]
+
+    keep = N.unique( N.concatenate( (startidx, endidx, minidx, maxidx) ) )
+    return xvals[keep], yvals[keep]
+
+def _removeDuplicateMarkers(xvals, yvals):
+    """Remove markers which would be drawn at the same position (to
+    within a quarter of a pixel) as the next marker.
+
+    Only consecutive markers are removed, keeping the last of each run,
+    so that the marker drawn on top at each position is unchanged.
+    Returns new x and y arrays."""
+
+    if len(xvals) < 2:
+        return xvals, yvals
+
+    qx = N.floor(xvals*4 + 0.5)
+    qy = N.floor(yvals*4 + 0.5)
+
+    keep = N.concatenate( ((qx[1:] != qx[:-1]) | (qy[1:] != qy[:-1]),
+                           [True]) )
+    if keep.all():
+        return xvals, yvals
+    return xvals[keep], yvals[keep]
+
 class MarkerFillBrush(setting.Brush):
     def __init__(self, name, **args):
         setting.Brush.__init__(self, name, **args)
@@ -234,6 +282,14 @@ class PointPlotter(GenericPlotter):
                            ' for each datapoint by this factor',
                            usertext='Thin markers',
                            formatting=True), 0 )
+        s.add( setting.Choice('decimate',
+                              ('bitmap', 'always', 'never'), 'bitmap',
+                              descr='Skip plotting lines and markers which '
+                              'would not be visible at the output '
+                              'resolution (bitmap: only for bitmap output '
+                              'and the plot window)',
+                              usertext='Decimate',
+                              formatting=True), 0 )
         s.add( setting.DistancePt('markerSize',
                                   '3pt',
                                   descr = 'Size of marker to plot',
@@ -626,6 +682,33 @@ class PointPlotter(GenericPlotter):
     def pickIndex(self, oldindex, direction, bounds):
         return self._pickable(bounds).pickIndex(oldindex, direction, bounds)
 
+    def _visibleRows(self, xaxis, posn, cliprect, margin,
+                     xv, yv, text, scalepoints):
+        """Return the rows of the data which are visible, if the x
+        values are memory mapped and sorted, so the rest of the file is
+        not read.
+
+        Points up to margin pixels outside the plot, and one more point
+        either side, are kept so markers and lines crossing the edge
+        are drawn.
+        """
+
+        if not isinstance(xv, document.DatasetMemmap) or xv.hasErrors():
+            return xv, yv, text, scalepoints
+
+        xrange = xaxis.plotterToDataCoords(
+            posn, N.array([cliprect.left()-margin, cliprect.right()+margin]))
+        rows = xv.valueIndexRange(xrange.min(), xrange.max())
+        if rows is None:
+            return xv, yv, text, scalepoints
+
+        start, stop = max(rows[0]-1, 0), rows[1]+1
+        if text:
+            text = text[start:stop]
+        if scalepoints is not None:
+            scalepoints = scalepoints[start:stop]
+        return xv[start:stop], yv[start:stop], text, scalepoints
+
     def draw(self, parentposn, phelper, outerbounds=None):
         """Plot the data on a plotter."""
 
@@ -652,7 +735,7 @@ class PointPlotter(GenericPlotter):
         # if text entered, then multiply up to get same number of values
         # as datapoints
         if text:
-            length = min( len(xv.data), len(yv.data) )
+            length = min( len(xv), len(yv) )
             text = text*(length / len(text)) + text[:length % len(text)]
 
         # get axes widgets
@@ -664,6 +747,15 @@ class PointPlotter(GenericPlotter):
         cliprect = self.clipAxesBounds(axes, posn)
         painter = phelper.painter(self, posn, clip=cliprect)
 
+        # only read visible part of memory mapped data
+        xv, yv, text, scalepoints = self._visibleRows(
+            axes[0], posn, cliprect, s.get('markerSize').convert(painter),
+            xv, yv, text, scalepoints)
+
+        # whether to skip points not visible at the output resolution
+        decimate = ( s.decimate == 'always' or
+                     (s.decimate == 'bitmap' and phelper.bitmapoutput) )
+
         # loop over chopped up values
         for xvals, yvals, tvals, ptvals in document.generateValidDatasetParts(
             xv, yv, text, scalepoints):
@@ -684,6 +776,10 @@ class PointPlotter(GenericPlotter):
                 if s.PlotLine.bezierJoin and hasqtloops:
                     self._drawBezierLine( painter, xplotter, yplotter, posn,
                                           xvals, yvals )
+                elif decimate and s.PlotLine.steps == 'off':
+                    xline, yline = _decimateLine(xplotter, yplotter)
+                    self._drawPlotLine( painter, xline, yline, posn,
+                                        xvals, yvals, cliprect )
                 else:
                     self._drawPlotLine( painter, xplotter, yplotter, posn,
                                         xvals, yvals, cliprect )
@@ -719,6 +815,8 @@ class PointPlotter(GenericPlotter):
                 scaling = None
                 if ptvals:
                     scaling = ptvals.data
+                elif decimate:
+                    xplt, yplt = _removeDuplicateMarkers(xplt, yplt)
 
                 # actually plot datapoints
                 utils.plotMarkers(painter, xplt, yplt, s.marker, markersize,
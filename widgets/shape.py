@@ -229,6 +229,9 @@ class ImageFile(BoxShape):
     description = 'Image file'
     allowusercreation = True
 
+    # image file may change without the widget changing
+    cacherender = False
+
     def __init__(self, parent, name=None):
         BoxShape.__init__(self, parent, name=name)
         if type(self) == ImageFile:
@@ -25,6 +25,33 @@ import veusz.document as document
 import veusz.utils as utils
 import veusz.setting as setting
 
+def settingsCacheKey(settings, doc):
+    """Return a tuple of the values in settings and the versions of
+    datasets referred to, for detecting changes."""
+
+    out = []
+    for s in settings.getSettingList():
+        val = s.val
+        out.append(val)
+
+        # record versions of datasets used
+        if isinstance(s, setting.Datasets):
+            names = val
+        elif isinstance(s, setting.Dataset) and isinstance(val, basestring):
+            names = (val,)
+        else:
+            names = ()
+        for name in names:
+            ds = doc.data.get(name)
+            if ds is None:
+                out.append(None)
+            else:
+                out.append(ds.dataVersion())
+
+    for s in settings.getSettingsList():
+        out.append( settingsCacheKey(s, doc) )
+    return tuple(out)
+
 class Action(object):
     """A class to wrap functions operating on widgets.
 
@@ -60,6 +87,9 @@ class Widget(object):
     # list of allowed types this can have as a parent
     allowedparenttypes = []
 
+    # whether output can be reused if renderCacheKey is unchanged
+    cacherender = False
+
     def __init__(self, parent, name=None):
         """Initialise a blank widget."""
 
@@ -130,6 +160,7 @@ class Widget(object):
                 raise ValueError, 'New name "%s" already exists' % name
 
         self.name = name
+        setting.Reference.treeChanged()
 
     def addDefaultSubWidgets(self):
         '''Add default sub widgets to widget, if any'''
@@ -179,6 +210,7 @@ class Widget(object):
         index is a position to place the new child
         """
         self.children.insert(index, child)
+        setting.Reference.treeChanged()
 
     def createUniqueName(self, prefix):
         """Create a name using the prefix which hasn't been used before."""
@@ -253,6 +285,7 @@ class Widget(object):
 
         if i < nc:
             self.children.pop(i)
+            setting.Reference.treeChanged()
         else:
             raise ValueError, \
                   "Cannot remove graph '%s' - does not exist" % name
@@ -306,11 +339,27 @@ class Widget(object):
 
             # iterate over children in reverse order
             for c in reversed(self.children):
-                c.draw(bounds, painthelper, outerbounds=outerbounds)
+                painthelper.drawWidget(c, bounds, outerbounds=outerbounds)
  
         # return our final bounds
         return bounds
 
+    def renderCacheKey(self, parentposn, painthelper, outerbounds):
+        """Return a key identifying the output of draw, or None if the
+        output cannot be reused.
+
+        The output is only cached for widgets without children, whose
+        output depends only on their settings, datasets and bounds.
+        """
+
+        if not self.cacherender or self.children:
+            return None
+
+        doc = self.document
+        return ( tuple(parentposn), outerbounds and tuple(outerbounds),
+                 self.position, doc.customschangeset,
+                 settingsCacheKey(self.settings, doc) )
+
     def getSaveText(self, saveall = False):
         """Return text to restore object
 
@@ -373,6 +422,7 @@ class Widget(object):
 
         # remove the widget from its current location
         c.pop(oldindex)
+        setting.Reference.treeChanged()
 
         # build a list of places widgets can be placed (slots)
         slots = []
@@ -782,7 +782,10 @@ class MainWindow(qt4.QMainWindow):
             qt4.QApplication.setOverrideCursor( qt4.QCursor(qt4.Qt.WaitCursor) )
             try:
                 ofile = open(self.filename, 'w')
-                self.document.saveToFile(ofile)
+                self.document.saveToFile(
+                    ofile,
+                    binarydata=setting.settingdb['file_binarydata'],
+                    compress=setting.settingdb['file_compressbinary'])
                 self.updateStatusbar("Saved to %s" % self.filename)
             except IOError, e:
                 qt4.QApplication.restoreOverrideCursor()
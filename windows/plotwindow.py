@@ -61,7 +61,17 @@ class PickerCrosshairItem( qt4.QGraphicsPathItem ):
         self.hide()
 
 class RenderControl(qt4.QObject):
-    """Object for rendering plots in a separate thread."""
+    """Object for rendering plots in a separate thread.
+
+    Pages are split into tiles which the threads render separately, so
+    that tiles can be shown as they are finished. A tile only plays the
+    output of widgets which could draw on it. Tiles of jobs which have
+    been superseded are dropped, and a tile being rendered is abandoned
+    between the output of widgets if a newer job is added.
+    """
+
+    # width and height of tiles rendered
+    tilesize = 256
 
     def __init__(self, plotwindow):
         """Start up numthreads rendering threads."""
@@ -73,6 +83,8 @@ class RenderControl(qt4.QObject):
         self.latestjobs = []
         self.latestaddedjob = -1
         self.latestdrawnjob = -1
+        # number of tiles left to render for each job
+        self.remainingtiles = {}
         self.plotwindow = plotwindow
 
         self.updateNumberThreads()
@@ -106,42 +118,93 @@ class RenderControl(qt4.QObject):
         """Exit threads started."""
         self.updateNumberThreads(num=0)
 
+    def makeTiles(self, pagesize):
+        """Split page into list of tiles (x, y, width, height).
+
+        The tiles are returned in reverse order of rendering."""
+        size = self.tilesize
+        tiles = []
+        for y in xrange(0, pagesize[1], size):
+            for x in xrange(0, pagesize[0], size):
+                tiles.append( (x, y,
+                               min(size, pagesize[0]-x),
+                               min(size, pagesize[1]-y)) )
+        tiles.reverse()
+        return tiles
+
+    def renderTile(self, jobid, helper, tile):
+        """Render part of page in helper to an image.
+
+        Returns None if the job was superseded while rendering."""
+        x, y, w, h = tile
+        img = qt4.QImage(w, h, qt4.QImage.Format_ARGB32_Premultiplied)
+        img.fill( setting.settingdb.color('page').rgb() )
+
+        painter = qt4.QPainter(img)
+        aa = self.plotwindow.antialias
+        painter.setRenderHint(qt4.QPainter.Antialiasing, aa)
+        painter.setRenderHint(qt4.QPainter.TextAntialiasing, aa)
+        # the view transformation is used to select the tile, as the
+        # recorded drawing sets the world transformation
+        painter.setWindow(x, y, w, h)
+        painter.setViewport(0, 0, w, h)
+
+        def callback():
+            """Stop if job superseded."""
+            return self.latestaddedjob != jobid
+
+        finished = helper.renderToPainter(
+            painter, callback=callback, rect=qt4.QRectF(x, y, w, h))
+        painter.end()
+        if finished:
+            return img
+        return None
+
+    def _tilesDone(self, jobid, num):
+        """Record that num tiles of job have been rendered or dropped.
+
+        Should be called with mutex locked. Returns True if job is
+        finished."""
+        self.remainingtiles[jobid] -= num
+        if self.remainingtiles[jobid] == 0:
+            del self.remainingtiles[jobid]
+            return True
+        return False
+
     def processNextJob(self):
-        """Take a job from the queue and process it.
+        """Take a tile from the queue and process it.
 
-        emits renderfinished(jobid, img, painthelper)
-        when done, if job has not been superseded
+        emits rendertile(jobid, x, y, img, painthelper) when tile is
+        done, if job has not been superseded
         """
 
         self.mutex.lock()
-        jobid, helper = self.latestjobs[-1]
-        del self.latestjobs[-1]
-        lastadded = self.latestaddedjob
+        if not self.latestjobs:
+            # tiles were dropped as job was superseded
+            self.mutex.unlock()
+            return
+        jobid, helper, tile = self.latestjobs.pop()
         self.mutex.unlock()
 
         # don't process jobs which have been superseded
-        if lastadded == jobid:
-            img = qt4.QImage(helper.pagesize[0], helper.pagesize[1],
-                             qt4.QImage.Format_ARGB32_Premultiplied)
-            img.fill( setting.settingdb.color('page').rgb() )
-
-            painter = qt4.QPainter(img)
-            aa = self.plotwindow.antialias
-            painter.setRenderHint(qt4.QPainter.Antialiasing, aa)
-            painter.setRenderHint(qt4.QPainter.TextAntialiasing, aa)
-            helper.renderToPainter(painter)
-            painter.end()
+        if self.latestaddedjob == jobid:
+            img = self.renderTile(jobid, helper, tile)
 
             self.mutex.lock()
             # just throw away result if it older than the latest one
-            if jobid > self.latestdrawnjob:
-                self.emit( qt4.SIGNAL("renderfinished"),
-                              jobid, img, helper )
+            if img is not None and jobid >= self.latestdrawnjob:
+                self.emit( qt4.SIGNAL("rendertile"),
+                           jobid, tile[0], tile[1], img, helper )
                 self.latestdrawnjob = jobid
             self.mutex.unlock()
 
-        # tell any listeners that a job has been processed
-        self.plotwindow.emit( qt4.SIGNAL("queuechange"), -1 )
+        self.mutex.lock()
+        finished = self._tilesDone(jobid, 1)
+        self.mutex.unlock()
+
+        if finished:
+            # tell any listeners that a job has been processed
+            self.plotwindow.emit( qt4.SIGNAL("queuechange"), -1 )
 
     def addJob(self, helper):
         """Process drawing job in PaintHelper given."""
@@ -149,18 +212,37 @@ class RenderControl(qt4.QObject):
         # indicate that there is a new item to be processed to listeners
         self.plotwindow.emit( qt4.SIGNAL("queuechange"), 1 )
 
-        # add the job to the queue
+        tiles = self.makeTiles(helper.pagesize)
+
+        # add the job to the queue, dropping tiles of old jobs
         self.mutex.lock()
         self.latestaddedjob += 1
-        self.latestjobs.append( (self.latestaddedjob, helper) )
+        jobid = self.latestaddedjob
+        dropped = {}
+        for oldid, oldhelper, oldtile in self.latestjobs:
+            dropped[oldid] = dropped.get(oldid, 0) + 1
+        finished = [oldid for oldid, num in dropped.iteritems()
+                    if self._tilesDone(oldid, num)]
+        self.latestjobs = [ (jobid, helper, tile) for tile in tiles ]
+        self.remainingtiles[jobid] = len(tiles)
         self.mutex.unlock()
 
-        if self.threads:
-            # tell a thread to process job
-            self.sem.release(1)
+        for oldid in finished:
+            self.plotwindow.emit( qt4.SIGNAL("queuechange"), -1 )
+
+        if not tiles:
+            # nothing to draw for empty page
+            self.mutex.lock()
+            del self.remainingtiles[jobid]
+            self.mutex.unlock()
+            self.plotwindow.emit( qt4.SIGNAL("queuechange"), -1 )
+        elif self.threads:
+            # tell threads to process tiles
+            self.sem.release(len(tiles))
         else:
             # process job in current thread if multithreading disabled
-            self.processNextJob()
+            for tile in tiles:
+                self.processNextJob()
 
 class RenderThread( qt4.QThread ):
     """A thread for processing rendering jobs.
@@ -257,8 +339,11 @@ class PlotWindow( qt4.QGraphicsView ):
 
         # for rendering plots in separate threads
         self.rendercontrol = RenderControl(self)
-        self.connect(self.rendercontrol, qt4.SIGNAL("renderfinished"),
-        self.slotRenderFinished)
+        self.connect(self.rendercontrol, qt4.SIGNAL("rendertile"),
+                     self.slotRenderTile)
+        # image being built up from tiles and its job
+        self.renderpixmap = None
+        self.renderjob = -1
 
         # mode for clicking
         self.clickmode = 'select'
@@ -825,7 +910,8 @@ class PlotWindow( qt4.QGraphicsView ):
                 # errors cause an exception window to pop up
                 try:
                     phelper = document.PaintHelper(
-                        size, scaling=self.zoomfactor, dpi=self.dpi)
+                        size, scaling=self.zoomfactor, dpi=self.dpi,
+                        previous=self.painthelper)
                     self.document.paintTo(phelper, self.pagenumber)
 
                 except Exception:
@@ -839,6 +925,7 @@ class PlotWindow( qt4.QGraphicsView ):
                 self.rendercontrol.addJob(phelper)
             else:
                 self.painthelper = None
+                self.renderpixmap = None
                 self.pagenumber = 0
                 size = self.document.docSize()
                 pixmap = qt4.QPixmap(*size)
@@ -853,12 +940,30 @@ class PlotWindow( qt4.QGraphicsView ):
             self.oldzoom = self.zoomfactor
             self.docchangeset = self.document.changeset
 
-    def slotRenderFinished(self, jobid, img, helper):
-        """Update image on display if rendering (usually in other
-        thread) finished."""
-        bufferpixmap = qt4.QPixmap.fromImage(img)
-        self.setSceneRect(0, 0, bufferpixmap.width(), bufferpixmap.height())
-        self.pixmapitem.setPixmap(bufferpixmap)
+    def slotRenderTile(self, jobid, x, y, img, helper):
+        """Update image on display when a tile has been rendered
+        (usually in other thread)."""
+        if jobid < self.renderjob:
+            return
+
+        if jobid > self.renderjob:
+            # new job: keep showing the old image until overwritten,
+            # if it is the same size
+            w, h = helper.pagesize
+            oldpixmap = self.renderpixmap
+            if ( oldpixmap is not None and oldpixmap.width() == w and
+                 oldpixmap.height() == h ):
+                self.renderpixmap = qt4.QPixmap(oldpixmap)
+            else:
+                self.renderpixmap = qt4.QPixmap(w, h)
+                self.renderpixmap.fill( setting.settingdb.color('page') )
+                self.setSceneRect(0, 0, w, h)
+            self.renderjob = jobid
+
+        painter = qt4.QPainter(self.renderpixmap)
+        painter.drawImage(x, y, img)
+        painter.end()
+        self.pixmapitem.setPixmap(self.renderpixmap)
 
     def _constructContextMenu(self):
         """Construct the context menu."""